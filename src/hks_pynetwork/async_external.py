@@ -0,0 +1,335 @@
+import copy
+import asyncio
+import collections
+
+from hks_pylib.logger import LoggerGenerator
+from hks_pylib.cryptography.ciphers.cipherid import CipherID
+from hks_pylib.cryptography.ciphers.hkscipher import HKSCipher
+from hks_pylib.logger.logger_generator import InvisibleLoggerGenerator
+from hks_pylib.logger.standard import StdLevels, StdUsers
+from hkserror.hkserror import HTypeError
+
+from hks_pynetwork.packet_buffer import PacketBuffer
+from hks_pynetwork.secure_packet import SecurePacketEncoder, SecurePacketDecoder
+from hks_pynetwork.logger import generate_logger
+
+from hks_pynetwork.errors.external import STCPSocketClosedError
+
+
+class _STCPProtocol(asyncio.BufferedProtocol):
+    def __init__(self, stcp_socket: "AsyncSTCPSocket", connected_cb=None):
+        self._stcp_socket = stcp_socket
+        self._connected_cb = connected_cb
+
+    def connection_made(self, transport):
+        self._stcp_socket._connection_made(transport)
+        if self._connected_cb is not None:
+            self._connected_cb(self._stcp_socket)
+
+    def get_buffer(self, sizehint):
+        return self._stcp_socket._get_buffer(sizehint)
+
+    def buffer_updated(self, nbytes):
+        self._stcp_socket._buffer_updated(nbytes)
+
+    def connection_lost(self, exc):
+        self._stcp_socket._connection_lost(exc)
+
+    def pause_writing(self):
+        self._stcp_socket._pause_writing()
+
+    def resume_writing(self):
+        self._stcp_socket._resume_writing()
+
+
+class AsyncSTCPSocket(object):
+    """The asyncio version of STCPSocket, it uses the same wire format.
+
+    Use open_connection() or start_server() to create it. All methods
+    must be called in the thread of the event loop which serves it."""
+    # The minimum size of memory which the transport receives into.
+    READ_SIZE = 2**16
+
+    def __init__(
+                    self,
+                    cipher: HKSCipher,
+                    name: str,
+                    logger_generator: LoggerGenerator = InvisibleLoggerGenerator(),
+                    display: dict = {},
+                    max_buffer_bytes: int = None
+                ):
+        if not isinstance(cipher, HKSCipher):
+            raise HTypeError("cipher", cipher, HKSCipher)
+
+        if not isinstance(name, str):
+            raise HTypeError("name", name, str)
+
+        if not isinstance(logger_generator, LoggerGenerator):
+            raise HTypeError("logger_generator", logger_generator, LoggerGenerator)
+
+        if not isinstance(display, dict):
+            raise HTypeError("display", display, dict)
+
+        self._name = name
+        self._logger_generator = logger_generator
+        self._display = display
+        self._log = generate_logger(self._logger_generator, name, self._display)
+
+        self._log(StdUsers.DEV, StdLevels.DEBUG, "Initialized with "
+        "cipher {}.", CipherID.cls2name(type(cipher)))
+
+        self.__cipher = cipher
+        self.__cipher.reset()
+
+        self.__packet_encoder = SecurePacketEncoder(self.__cipher)
+        self.__packet_decoder = SecurePacketDecoder(self.__cipher)
+        self.__buffer = PacketBuffer(
+                decoder=self.__packet_decoder,
+                name="PacketBuffer of {}".format(name),
+                logger_generator=self._logger_generator,
+                display=self._display,
+                max_bytes=max_buffer_bytes
+            )
+
+        self._transport = None
+        self._closed = False
+        self._reading_paused = False
+
+        self._recv_waiter = None
+        self._closed_waiter = None
+        self._paused = False
+
+        # The senders which wait until the transport resumes writing.
+        self._drain_waiters = collections.deque()
+
+    def _connection_made(self, transport):
+        self._transport = transport
+
+    def _get_buffer(self, sizehint):
+        # The bytes are received directly into the packet buffer.
+        return self.__buffer.reserve(max(sizehint, AsyncSTCPSocket.READ_SIZE))
+
+    def _buffer_updated(self, nbytes):
+        self.__buffer.commit(nbytes)
+        if self._recv_waiter is not None and self.__buffer.has_packet():
+            self._wake_up_receiver()
+
+        # Stop reading until recv() is called, so that TCP pushes back.
+        if not self._reading_paused and self.__buffer.isfull():
+            self._reading_paused = True
+            self._transport.pause_reading()
+
+    def _connection_lost(self, exc):
+        self._closed = True
+        if exc is None:
+            self._log(StdUsers.DEV, StdLevels.INFO, "Closed.")
+        else:
+            self._log(StdUsers.DEV, StdLevels.INFO, "Closed ({}).", exc)
+
+        self._wake_up_receiver()
+        if self._closed_waiter is not None and not self._closed_waiter.done():
+            self._closed_waiter.set_result(None)
+
+        # Fail the senders which are waiting for the writing buffer.
+        self._paused = False
+        while self._drain_waiters:
+            waiter = self._drain_waiters.popleft()
+            if not waiter.done():
+                waiter.set_exception(STCPSocketClosedError("Connection closed."))
+
+    def _pause_writing(self):
+        self._paused = True
+
+    def _resume_writing(self):
+        self._paused = False
+        while self._drain_waiters:
+            waiter = self._drain_waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+
+    def _wake_up_receiver(self):
+        waiter, self._recv_waiter = self._recv_waiter, None
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        self.close()
+        await self.wait_closed()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> bytes:
+        try:
+            return await self.recv()
+        except STCPSocketClosedError:
+            raise StopAsyncIteration
+
+    async def recv(self) -> bytes:
+        return (await self.recv_many(max_count=1))[0]
+
+    async def recv_many(self, max_count: int = None, max_bytes: int = None) -> list:
+        """Wait until there is at least one message, then return all
+        messages which have been received completely. Parameters
+        max_count and max_bytes are passed to PacketBuffer.pop_many()."""
+        while True:
+            data = self.__buffer.pop_many(max_count, max_bytes)
+            if data:
+                if self._reading_paused and not self.__buffer.isfull():
+                    self._reading_paused = False
+                    if not self._closed:
+                        self._transport.resume_reading()
+
+                return data
+
+            if self._closed:
+                raise STCPSocketClosedError("Connection closed.")
+
+            if self._recv_waiter is not None:
+                raise RuntimeError("Another coroutine is already "
+                "waiting for incoming data.")
+
+            self._recv_waiter = asyncio.get_running_loop().create_future()
+            try:
+                await self._recv_waiter
+            finally:
+                self._recv_waiter = None
+
+    async def send(self, data: bytes) -> int:
+        if not isinstance(data, bytes):
+            raise HTypeError("data", data, bytes)
+
+        if self._closed or self._transport.is_closing():
+            raise STCPSocketClosedError("Connection closed.")
+
+        self.__cipher.reset()
+        parts = self.__packet_encoder.encode_parts(data)
+        self._transport.writelines(parts)
+
+        if self._paused:
+            waiter = asyncio.get_running_loop().create_future()
+            self._drain_waiters.append(waiter)
+            await waiter
+
+        return sum(len(part) for part in parts)
+
+    async def sendall(self, data: bytes) -> None:
+        await self.send(data)
+
+    def close(self):
+        if self._transport is not None and not self._transport.is_closing():
+            self._transport.close()
+
+    async def wait_closed(self):
+        if self._closed:
+            return
+
+        if self._closed_waiter is None:
+            self._closed_waiter = asyncio.get_running_loop().create_future()
+
+        await asyncio.shield(self._closed_waiter)
+
+    def isclosed(self):
+        return self._closed
+
+    def isworking(self):
+        return self._transport is not None and not self._closed
+
+    def getpeername(self):
+        return self._transport.get_extra_info("peername")
+
+
+async def open_connection(
+                            address,
+                            cipher: HKSCipher,
+                            name: str,
+                            logger_generator: LoggerGenerator = InvisibleLoggerGenerator(),
+                            display: dict = {},
+                            max_buffer_bytes: int = None
+                        ) -> AsyncSTCPSocket:
+    """Connect to a STCP server and return an AsyncSTCPSocket. The address
+    is a (host, port) tuple or the path of an unix socket. See STCPSocket
+    for the parameter max_buffer_bytes."""
+    stcp_socket = AsyncSTCPSocket(cipher, name, logger_generator, display, max_buffer_bytes)
+
+    loop = asyncio.get_running_loop()
+    if isinstance(address, str):
+        await loop.create_unix_connection(lambda: _STCPProtocol(stcp_socket), address)
+    else:
+        await loop.create_connection(lambda: _STCPProtocol(stcp_socket), *address)
+
+    stcp_socket._log(StdUsers.DEV, StdLevels.INFO, "Connect to "
+    "server {} successfully.", address)
+
+    return stcp_socket
+
+
+async def start_server(
+                        client_connected_cb,
+                        address,
+                        cipher: HKSCipher,
+                        name: str,
+                        logger_generator: LoggerGenerator = InvisibleLoggerGenerator(),
+                        display: dict = {},
+                        backlog: int = 100,
+                        max_buffer_bytes: int = None
+                    ) -> asyncio.AbstractServer:
+    """Start a STCP server and return the asyncio server object.
+
+    The client_connected_cb(stcp_socket) is called with a new
+    AsyncSTCPSocket for each accepted connection, each of them uses a
+    copy of the cipher. If it is a coroutine function, it is scheduled
+    as a task. The address is a (host, port) tuple or the path of an
+    unix socket."""
+    if not callable(client_connected_cb):
+        raise HTypeError("client_connected_cb", client_connected_cb, "callable")
+
+    if not isinstance(cipher, HKSCipher):
+        raise HTypeError("cipher", cipher, HKSCipher)
+
+    log = generate_logger(logger_generator, name, display)
+    loop = asyncio.get_running_loop()
+
+    # The loop only keeps weak references to tasks, so the tasks of the
+    # callbacks are kept here until they are done.
+    tasks = set()
+
+    def task_done(task: asyncio.Task):
+        tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            log(StdUsers.DEV, StdLevels.ERROR, "Unknown error in "
+            "client_connected_cb ({}).", task.exception())
+
+    def connected_cb(stcp_socket: AsyncSTCPSocket):
+        if log.enabled:
+            log(StdUsers.DEV, StdLevels.INFO, "Server accepted "
+            "{}.", stcp_socket.getpeername())
+
+        result = client_connected_cb(stcp_socket)
+        if asyncio.iscoroutine(result):
+            task = loop.create_task(result)
+            tasks.add(task)
+            task.add_done_callback(task_done)
+
+    def protocol_factory():
+        stcp_socket = AsyncSTCPSocket(
+                cipher=copy.copy(cipher),
+                name="{} connection".format(name),
+                logger_generator=logger_generator,
+                display=display,
+                max_buffer_bytes=max_buffer_bytes
+            )
+
+        return _STCPProtocol(stcp_socket, connected_cb)
+
+    if isinstance(address, str):
+        server = await loop.create_unix_server(protocol_factory, address, backlog=backlog)
+    else:
+        server = await loop.create_server(protocol_factory, *address, backlog=backlog)
+
+    log(StdUsers.DEV, StdLevels.INFO, "Server start listening.")
+
+    return server
@@ -0,0 +1,147 @@
+import zlib
+
+try:
+    import bz2
+except ImportError:  # Python is built without bz2
+    bz2 = None
+
+try:
+    import lzma
+except ImportError:  # Python is built without lzma
+    lzma = None
+
+from hkserror.hkserror import HFormatError, HTypeError
+
+from hks_pynetwork.errors.compression import DecompressionError, UnknownCodecError
+
+
+class Codec(object):
+    """The base class of compression codecs. ID is the byte which marks the
+    compressed packets in the secure header, it must be unique."""
+    ID = None
+    NAME = None
+
+    def compress(self, data: bytes) -> bytes:
+        raise NotImplementedError()
+
+    def decompress(self, data: bytes, max_size: int) -> bytes:
+        "Raise DecompressionError if the result is larger than max_size."
+        raise NotImplementedError()
+
+
+class ZlibCodec(Codec):
+    ID = 1
+    NAME = "zlib"
+
+    def __init__(self, level: int = 6):
+        if not isinstance(level, int):
+            raise HTypeError("level", level, int)
+
+        self._level = level
+
+    def compress(self, data: bytes) -> bytes:
+        return zlib.compress(data, self._level)
+
+    def decompress(self, data: bytes, max_size: int) -> bytes:
+        decompressor = zlib.decompressobj()
+        try:
+            result = decompressor.decompress(data, max_size)
+        except zlib.error as e:
+            raise DecompressionError("Invalid zlib data ({}).".format(e))
+
+        if decompressor.unconsumed_tail:
+            raise DecompressionError("Decompressed payload is too large "
+            "(expected <= {}).".format(max_size))
+
+        if not decompressor.eof:
+            raise DecompressionError("Incomplete zlib data.")
+
+        return result
+
+
+class _StreamCodec(Codec):
+    # The codecs whose decompressors support max_length (bz2, lzma).
+    def _decompressor(self):
+        raise NotImplementedError()
+
+    def decompress(self, data: bytes, max_size: int) -> bytes:
+        decompressor = self._decompressor()
+        try:
+            result = decompressor.decompress(data, max_size)
+        except (OSError, EOFError, ValueError) as e:
+            raise DecompressionError("Invalid {} data ({}).".format(self.NAME, e))
+
+        if not decompressor.eof:
+            if len(result) >= max_size:
+                raise DecompressionError("Decompressed payload is too large "
+                "(expected <= {}).".format(max_size))
+
+            raise DecompressionError("Incomplete {} data.".format(self.NAME))
+
+        return result
+
+
+class Bz2Codec(_StreamCodec):
+    ID = 2
+    NAME = "bz2"
+
+    def __init__(self, level: int = 9):
+        if not isinstance(level, int):
+            raise HTypeError("level", level, int)
+
+        self._level = level
+
+    def compress(self, data: bytes) -> bytes:
+        return bz2.compress(data, self._level)
+
+    def _decompressor(self):
+        return bz2.BZ2Decompressor()
+
+
+class LzmaCodec(_StreamCodec):
+    ID = 3
+    NAME = "lzma"
+
+    def __init__(self, preset: int = 6):
+        if not isinstance(preset, int):
+            raise HTypeError("preset", preset, int)
+
+        self._preset = preset
+
+    def compress(self, data: bytes) -> bytes:
+        return lzma.compress(data, preset=self._preset)
+
+    def _decompressor(self):
+        return lzma.LZMADecompressor()
+
+
+# The codecs which are used to decompress packets, keyed by ID.
+_codecs = {}
+
+
+def register_codec(codec: Codec):
+    "Register a codec, so that its packets can be decoded."
+    if not isinstance(codec, Codec):
+        raise HTypeError("codec", codec, Codec)
+
+    if not isinstance(codec.ID, int) or not 0 < codec.ID <= 255:
+        raise HFormatError("Codec ID expected an integer in range [1, 255].")
+
+    _codecs[codec.ID] = codec
+
+
+def get_codec(codec_id: int) -> Codec:
+    codec = _codecs.get(codec_id)
+    if codec is None:
+        raise UnknownCodecError("Codec {} is not registered.".format(codec_id))
+
+    return codec
+
+
+register_codec(ZlibCodec())
+
+if bz2 is not None:
+    register_codec(Bz2Codec())
+
+if lzma is not None:
+    register_codec(LzmaCodec())
@@ -0,0 +1,13 @@
+from hks_pynetwork.errors import HKSPyNetworkError
+
+
+class CompressionError(HKSPyNetworkError):
+    "The exception is raised by failures in compression module."
+
+
+class UnknownCodecError(CompressionError):
+    "The exception is raised when the codec of a packet is not registered."
+
+
+class DecompressionError(CompressionError):
+    "The exception is raised when a compressed payload is invalid or too large."
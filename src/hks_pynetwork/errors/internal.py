@@ -18,3 +18,9 @@ class ChannelClosedError(ChannelError):
 
 class ForwardNodeError(ChannelError):
     "The exception is raised by failures in forwarder."
+
+class ChannelBufferFullError(ChannelError):
+    "The exception is raised when a message is pushed to a full channel buffer."
+
+class ChannelTimeoutError(ChannelError):
+    "The exception is raised when no message is received before timeout."
@@ -0,0 +1,5 @@
+from hks_pynetwork.errors import HKSPyNetworkError
+
+
+class MetricsError(HKSPyNetworkError):
+    "The exception is raised by failures in metrics module."
@@ -19,3 +19,7 @@ class PacketSizeError(PacketDecodingError, PacketEncodingError):
 
 class IncompletePacketError(PacketDecodingError):
     "The exception is raised when the incomplete packet is extracted."
+
+
+class BufferSizeError(PacketError):
+    "The exception is raised when a buffer is too small for a payload."
@@ -0,0 +1,13 @@
+from hks_pynetwork.errors import HKSPyNetworkError
+
+
+class PoolError(HKSPyNetworkError):
+    "The exception is raised by failures in pool module."
+
+
+class PoolClosedError(PoolError):
+    "The exception is raised when a closed pool is used."
+
+
+class PoolTimeoutError(PoolError):
+    "The exception is raised when no connection is available before timeout."
@@ -8,3 +8,7 @@ class SecurePacketError(HKSPyNetworkError):
 class CipherTypeMismatchError(SecurePacketError):
     """The exception is raised when type of cipher of
     decoded packet is diffrent from intial cipher."""
+
+
+class BatchFormatError(SecurePacketError):
+    "The exception is raised when the payload of a batch packet is malformed."
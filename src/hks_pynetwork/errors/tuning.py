@@ -0,0 +1,9 @@
+from hks_pynetwork.errors import HKSPyNetworkError
+
+
+class TuningError(HKSPyNetworkError):
+    "The exception is raised by failures in tuning module."
+
+
+class UnknownProfileError(TuningError):
+    "The exception is raised when a tuning profile is not registered."
@@ -1,30 +1,102 @@
 import copy
 import time
 import errno
+import queue
 import socket
+import selectors
+import itertools
 import threading
+import collections
 
 from hks_pylib.logger import LoggerGenerator
 from hks_pylib.cryptography.ciphers.cipherid import CipherID
 from hks_pylib.cryptography.ciphers.hkscipher import HKSCipher
+from hks_pylib.cryptography.ciphers.symmetrics import AES_CTR
 from hks_pylib.logger.logger_generator import InvisibleLoggerGenerator
 from hks_pylib.logger.standard import StdLevels, StdUsers
 from hkserror.hkserror import HFormatError, HTypeError
 
-from hks_pynetwork.packet_buffer import PacketBuffer
+from hks_pynetwork.packet_buffer import ABNORMAL_PACKET_ERRORS, PacketBuffer, writable_view
 from hks_pynetwork.secure_packet import SecurePacketEncoder, SecurePacketDecoder
+from hks_pynetwork.secure_packet import FLAG_STREAM, FLAG_STREAM_END, FLAG_BATCH, pack_batch
+from hks_pynetwork.secure_packet import DEFAULT_COMPRESS_THRESHOLD
+from hks_pynetwork.compression import Codec
+from hks_pynetwork.parallel import ParallelCrypter
+from hks_pynetwork.metrics import MetricsRegistry
+from hks_pynetwork.logger import generate_logger
+from hks_pynetwork.tuning import AdaptiveReadSize, TuningProfile, get_profile
 
-from hks_pylib.errors.cryptography.ciphers import CipherParameterError
-from hks_pylib.errors.cryptography.ciphers.symmetrics import UnAuthenticatedPacketError
+from hks_pynetwork.errors.external import STCPSocketError, STCPSocketClosedError
+from hks_pynetwork.errors.external import STCPSocketTimeoutError
+from hks_pynetwork.errors.packet import BufferSizeError
 
-from hks_pynetwork.errors.packet import IncompletePacketError
-from hks_pynetwork.errors.secure_packet import CipherTypeMismatchError
-from hks_pynetwork.errors.external import STCPSocketClosedError, STCPSocketTimeoutError
+
+# Most of systems limit the number of buffers of sendmsg() to 1024.
+MAX_SENDMSG_BUFFERS = 512
+
+# The address families of STCPSocket and STCPServer. AF_UNIX is not
+# available on Windows.
+SUPPORTED_FAMILIES = tuple(
+    getattr(socket, family) for family in ("AF_INET", "AF_INET6", "AF_UNIX")
+    if hasattr(socket, family)
+)
+
+
+def _check_family(family):
+    if not isinstance(family, int):
+        raise HTypeError("family", family, int)
+
+    if family not in SUPPORTED_FAMILIES:
+        raise HFormatError("Parameter family expected AF_INET, AF_INET6 or AF_UNIX.")
+
+
+def _send_buffers(sock: socket.socket, buffers) -> int:
+    "Send the buffers by one system call and return the number of sent bytes."
+    if not hasattr(sock, "sendmsg"):  # Windows
+        return sock.send(buffers[0])
+
+    return sock.sendmsg(list(itertools.islice(buffers, MAX_SENDMSG_BUFFERS)))
+
+
+def _consume(buffers: collections.deque, size: int):
+    "Remove size bytes which have been sent from the head of buffers."
+    while buffers and size >= len(buffers[0]):
+        size -= len(buffers[0])
+        buffers.popleft()
+
+    if size > 0:
+        buffers[0] = buffers[0][size:]
+
+
+class _SocketMetrics(object):
+    "The metrics of the sockets of a class, their names start with prefix."
+    def __init__(self, metrics: MetricsRegistry, prefix: str):
+        self.bytes_sent = metrics.counter(prefix + ".bytes_sent")
+        self.packets_sent = metrics.counter(prefix + ".packets_sent")
+        self.bytes_received = metrics.counter(prefix + ".bytes_received")
+        self.encode_seconds = metrics.histogram(prefix + ".encode_seconds")
+
+
+def _check_metrics(metrics):
+    if metrics is not None and not isinstance(metrics, MetricsRegistry):
+        raise HTypeError("metrics", metrics, MetricsRegistry, None)
+
+
+def _check_profile(profile) -> TuningProfile:
+    "Return the TuningProfile of profile which is a profile or its name."
+    if isinstance(profile, str):
+        return get_profile(profile)
+
+    if profile is not None and not isinstance(profile, TuningProfile):
+        raise HTypeError("profile", profile, TuningProfile, str, None)
+
+    return profile
 
 
 class STCPSocket(object):
     DEFAULT_TIME_OUT = 0.1
     DEFAULT_RELOAD_TIME = 0.1
+    DEFAULT_STREAM_CHUNK_SIZE = 2**16
 
     def __init__(
                     self,
@@ -32,8 +104,42 @@ class STCPSocket(object):
                     name: str,
                     buffer_size: int,
                     logger_generator: LoggerGenerator = InvisibleLoggerGenerator(),
-                    display: dict = {}
+                    display: dict = {},
+                    max_buffer_bytes: int = None,
+                    family: int = socket.AF_INET,
+                    compressor: Codec = None,
+                    compress_threshold: int = DEFAULT_COMPRESS_THRESHOLD,
+                    crypter: ParallelCrypter = None,
+                    session: bool = False,
+                    metrics: MetricsRegistry = None,
+                    profile: TuningProfile = None
                 ):
+        """Parameter max_buffer_bytes limits the received data which has
+        not been read by recv() yet. When it is reached, the socket is not
+        read until recv() is called, so the sender is slowed down by TCP
+        flow control. The received data is unbounded by default.
+
+        Parameter family is the address family of socket, the address of
+        AF_UNIX is a path. The accepted sockets use the same family.
+
+        If compressor is given, the sent messages which have at least
+        compress_threshold bytes are compressed (see SecurePacketEncoder).
+        The compressed messages are always accepted by the receiver.
+
+        If crypter is given, the large messages are encrypted and decrypted
+        on its thread pool (see ParallelCrypter).
+
+        If session is True, the nonce of AES_CTR is sent once and the
+        next messages only carry a counter (see SecurePacketEncoder).
+
+        If metrics is given, the sent and received bytes, the sent packets
+        and the encoding time are recorded in it as "stcp_socket.*", the
+        received packets are recorded by PacketBuffer.
+
+        Parameter profile is a TuningProfile or the name of a registered
+        one, e.g. "low-latency" or "bulk-throughput". Its socket options
+        are set by connect(), listen() and on the accepted sockets. If it
+        adapts the read size, buffer_size is the initial read size."""
         if not isinstance(cipher, HKSCipher):
             raise HTypeError("cipher", cipher, HKSCipher)
 
@@ -42,7 +148,17 @@ class STCPSocket(object):
 
         if buffer_size <= 0:
             raise HFormatError("Parameter buffer_size expected an positive integer.")
-        
+
+        if max_buffer_bytes is not None and not isinstance(max_buffer_bytes, int):
+            raise HTypeError("max_buffer_bytes", max_buffer_bytes, int, None)
+
+        if max_buffer_bytes is not None and max_buffer_bytes <= 0:
+            raise HFormatError("Parameter max_buffer_bytes expected a positive integer.")
+
+        _check_family(family)
+        _check_metrics(metrics)
+        profile = _check_profile(profile)
+
         if not isinstance(logger_generator, LoggerGenerator):
             raise HTypeError("logger_generator", logger_generator, LoggerGenerator)
 
@@ -55,24 +171,47 @@ class STCPSocket(object):
         self._name = name
         self._logger_generator = logger_generator
         self._display = display
-        self._log = self._logger_generator.generate(name, self._display)
+        self._log = generate_logger(self._logger_generator, name, self._display)
 
         self._log(StdUsers.DEV, StdLevels.DEBUG, "Initialized with "
-        "cipher {}.".format(CipherID.cls2name(type(cipher))))
+        "cipher {}.", CipherID.cls2name(type(cipher)))
 
-        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._family = family
+        self._socket = socket.socket(family, socket.SOCK_STREAM)
         self.__cipher = cipher
         self.__cipher.reset()
 
         self.set_reload_time(STCPSocket.DEFAULT_RELOAD_TIME)
         self.set_recv_timeout(None)
 
-        self.__packet_encoder = SecurePacketEncoder(self.__cipher)
-        self.__packet_decoder = SecurePacketDecoder(self.__cipher)
+        self.__compressor = compressor
+        self.__compress_threshold = compress_threshold
+        self.__crypter = crypter
+        self.__session = session
+        self.__metrics_registry = metrics
+        self._metrics = None if metrics is None else _SocketMetrics(metrics, "stcp_socket")
+        self.__packet_encoder = SecurePacketEncoder(
+                self.__cipher,
+                compressor=compressor,
+                compress_threshold=compress_threshold,
+                crypter=crypter,
+                session=session
+            )
+        self.__packet_decoder = SecurePacketDecoder(self.__cipher, crypter=crypter)
         self.__buffer = None
         self.__buffer_size = buffer_size
-
-        self.__buffer_available = threading.Event()
+        self.__profile = profile
+        self.__read_size = None if profile is None else profile.read_size(buffer_size)
+        self.__max_buffer_bytes = max_buffer_bytes
+        self.__send_lock = threading.Lock()
+
+        # Notified by the automatic received process whenever the buffer
+        # holds a complete packet or the connection is closed.
+        self.__buffer_available = threading.Condition()
+
+        # Notified by the receivers whenever a packet is popped, so that
+        # the automatic received process continues after the buffer was full.
+        self.__buffer_not_full = threading.Condition()
         self._stop_auto_recv = False
         self._prepare_close = False
 
@@ -88,8 +227,14 @@ class STCPSocket(object):
     def _start_auto_recv(self):
         self._log(StdUsers.DEV, StdLevels.INFO, "Start the automatic received process.")
         while True:
+            if self.__read_size is None:
+                read_size = self.__buffer_size
+            else:
+                read_size = self.__read_size.size
+
             try:
-                data = self._socket.recv(self.__buffer_size)
+                # The bytes are received directly into the packet buffer.
+                size = self._socket.recv_into(self.__buffer.reserve(read_size), read_size)
             except socket.error as e:
                 if isinstance(e, socket.timeout) and not self._stop_auto_recv:
                     continue
@@ -97,39 +242,57 @@ class STCPSocket(object):
                 self._socket.close()
                 if e.errno in (errno.ECONNRESET, errno.ECONNABORTED, errno.ECONNREFUSED):
                     self._log(StdUsers.DEV, StdLevels.INFO, "Automatic received "
-                    "process closed normally ({}).".format(e))
+                    "process closed normally ({}).", e)
                     break
                 elif isinstance(e, socket.timeout):
                     self._log(StdUsers.DEV, StdLevels.INFO, "Automatic received "
                     "process closed normally (timeout and socket closed).")
                     break
-                elif isinstance(e, OSError) and e.errno == 10038:
+                elif isinstance(e, OSError) and e.errno in (errno.EBADF, 10038):
                     self._log(StdUsers.DEV, StdLevels.INFO, "Automatic received "
                     "process closed normally (remote socket closed).")
                     break
                 else:
                     self._log(StdUsers.DEV, StdLevels.ERROR, "Automatic received "
-                    "process closed with an unknown socket error ({}).".format(e))
+                    "process closed with an unknown socket error ({}).", e)
                     raise e
             except Exception as e:
                 self._socket.close()
                 self._log(StdUsers.DEV, StdLevels.ERROR, "Automatic received process "
-                "closed with an unknown error ({}).".format(e))
+                "closed with an unknown error ({}).", e)
                 break
             else:  # If there is no error
                 # When be closed by the remote party,
                 # socket will receive infinite empty packets
-                if not data:
+                if not size:
                     self._socket.close()
                     self._log(StdUsers.DEV, StdLevels.INFO, "Automatic received process "
                     "closed normally (remote socket closed).")
                     break
-                self.__buffer.push(data)
-                self.__buffer_available.set()
 
-        self.__buffer_available.set()
+                if self._metrics is not None:
+                    self._metrics.bytes_received.inc(size)
+
+                if self.__read_size is not None:
+                    self.__read_size.update(size)
+
+                self.__buffer.commit(size)
+                if self.__buffer.has_packet():
+                    with self.__buffer_available:
+                        self.__buffer_available.notify_all()
+
+                # Stop reading while the buffer is full, the data is kept in
+                # the kernel buffer and TCP pushes back on the remote party.
+                if self.__buffer.isfull():
+                    with self.__buffer_not_full:
+                        while self.__buffer.isfull() and not self._stop_auto_recv:
+                            self.__buffer_not_full.wait()
+
+        with self.__buffer_available:
+            self.__buffer_available.notify_all()
 
     def set_reload_time(self, value: float):
+        "Kept for compatibility, recv() waits for the packet instead of polling."
         if not isinstance(value, (int, float)):
             raise HTypeError("value", value, float, int)
 
@@ -137,7 +300,7 @@ class STCPSocket(object):
             raise HFormatError("Parameter value expected a non-negative number.")
 
         self._log(StdUsers.DEV, StdLevels.DEBUG, "Set reload "
-        "time to {}.".format(value))
+        "time to {}.", value)
         self.__reload_time = value
 
     def set_recv_timeout(self, value: float):
@@ -148,7 +311,7 @@ class STCPSocket(object):
             raise HFormatError("Parameter value expected a non-negative number.")
 
         self._log(StdUsers.DEV, StdLevels.DEBUG, "Set received "
-        "timeout to {}.".format(value))
+        "timeout to {}.", value)
         self.__recv_timeout = value
 
     def settimeout_raw(self, value: float):
@@ -159,75 +322,222 @@ class STCPSocket(object):
             raise HFormatError("Parameter value expected a non-negative number.")
 
         self._log(StdUsers.DEV, StdLevels.DEBUG, "Set timeout "
-        "to {}.".format(value))
+        "to {}.", value)
 
         return self._socket.settimeout(value)
 
     def recv(self) -> bytes:
-        data = b''
-        if self.__recv_timeout is not None:
-            start_recv_time = time.time()
+        return self.__recv(self.__buffer.pop, b"")
 
-        while not data:
-            if self.isclosed() and len(self.__buffer) == 0:
-                raise STCPSocketClosedError("Connection closed.")
+    def recv_many(self, max_count: int = None, max_bytes: int = None) -> list:
+        """Wait until there is at least one message, then return all
+        messages which have been received completely. Parameters
+        max_count and max_bytes are passed to PacketBuffer.pop_many()."""
+        if max_count is not None and not isinstance(max_count, int):
+            raise HTypeError("max_count", max_count, int, None)
+
+        if max_bytes is not None and not isinstance(max_bytes, int):
+            raise HTypeError("max_bytes", max_bytes, int, None)
+
+        def pop():
+            return self.__buffer.pop_many(max_count, max_bytes)
+
+        return self.__recv(pop, [])
+
+    def recv_into(self, buffer) -> int:
+        """Wait until there is a message, write it to the writable buffer
+        (e.g. a bytearray or memoryview) and return its size. It does not
+        allocate the memory of the message, so the same buffer can be
+        reused. If the buffer is too small, BufferSizeError is raised and
+        the message is kept to be received again."""
+        view = writable_view(buffer)
+
+        def pop():
+            return self.__buffer.pop_into(view)
+
+        return self.__recv(pop, 0)
+
+    def __recv(self, pop, default):
+        if self.__recv_timeout is not None:
+            deadline = time.monotonic() + self.__recv_timeout
 
+        while True:
             try:
-                data = self.__buffer.pop()
-            except IncompletePacketError as e:
-                # Not enough length of packet, waiting more data
-                continue
-            except (UnAuthenticatedPacketError,
-                    CipherParameterError,
-                    CipherTypeMismatchError) as e:
-                self._log(StdUsers.USER, StdLevels.WARNING, "Detect an abnormal packet.")
-                self._log(StdUsers.DEV, StdLevels.WARNING, "Detect an abnormal packet "
-                "({}).".format(e))
-                break
+                data = pop()
+            except ABNORMAL_PACKET_ERRORS as e:
+                if self._log.enabled:
+                    self._log(StdUsers.USER, StdLevels.WARNING, "Detect an abnormal packet.")
+                    self._log(StdUsers.DEV, StdLevels.WARNING, "Detect an abnormal packet "
+                    "({}).", e)
+                return default
+            except BufferSizeError:
+                raise
             except Exception as e:
                 self._log(StdUsers.USER, StdLevels.INFO, "Unknown error.")
                 self._log(StdUsers.DEV, StdLevels.ERROR, "Unknown error "
-                "({}).".format(e))
-                break
-            finally:
-                if not data:
-                    if self.__recv_timeout is not None and\
-                        time.time() - start_recv_time > self.__recv_timeout:
-                        if self.__recv_timeout != 0:
-                            raise STCPSocketTimeoutError("Receiving exceeds timeout.")
-                        else:
-                            raise STCPSocketTimeoutError("Method recv() can not return "
-                            "the value immediately.")
+                "({}).", e)
+                return default
+
+            if data:
+                if self.__max_buffer_bytes is not None:
+                    with self.__buffer_not_full:
+                        self.__buffer_not_full.notify()
+
+                return data
 
-                    time.sleep(self.__reload_time)
+            with self.__buffer_available:
+                # Check again with the lock held, so that the notification of
+                # a packet pushed after pop() can not be missed.
+                if self.__buffer.has_packet():
+                    continue
+
+                if self.isclosed():
+                    raise STCPSocketClosedError("Connection closed.")
+
+                if self.__recv_timeout is None:
+                    self.__buffer_available.wait()
+                    continue
 
-                    if self.__recv_timeout is None and len(self.__buffer) == 0\
-                        and not self.isclosed():
-                        self.__buffer_available.wait()
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    if self.__recv_timeout != 0:
+                        raise STCPSocketTimeoutError("Receiving exceeds timeout.")
+                    else:
+                        raise STCPSocketTimeoutError("Method recv() can not return "
+                        "the value immediately.")
+
+                self.__buffer_available.wait(remaining)
+
+    def __send_parts(self, parts: list):
+        # Write the header and the ciphertext by scatter-gather I/O, so the
+        # ciphertext is never copied into a packet.
+        buffers = collections.deque(memoryview(part) for part in parts)
+        while buffers:
+            try:
+                sent = _send_buffers(self._socket, buffers)
+            except socket.timeout:
+                # The timeout is only used by the automatic received process.
+                continue
 
-        self.__buffer_available.clear()
-        return data
+            _consume(buffers, sent)
+
+    def __send_packet(self, data: bytes, flags: int = 0) -> int:
+        # The caller must hold the send lock.
+        if self._metrics is not None:
+            start = time.perf_counter()
+
+        if not self.__packet_encoder.session:
+            self.__cipher.reset()
+        parts = self.__packet_encoder.encode_parts(data, flags)
+
+        if self._metrics is not None:
+            self._metrics.encode_seconds.observe(time.perf_counter() - start)
+
+        self.__send_parts(parts)
+        size = sum(len(part) for part in parts)
+
+        if self._metrics is not None:
+            self._metrics.bytes_sent.inc(size)
+            self._metrics.packets_sent.inc()
+
+        return size
 
     def send(self, data: bytes) -> int:
+        "Send the whole packet and return its size."
         if not isinstance(data, bytes):
             raise HTypeError("data", data, bytes)
 
-        self.__cipher.reset()
-        packet = self.__packet_encoder.encode(data)
-        return self._socket.send(packet)
+        with self.__send_lock:
+            return self.__send_packet(data)
 
-    def sendall(self, data: bytes) -> int:
+    def sendall(self, data: bytes) -> None:
         if not isinstance(data, bytes):
             raise HTypeError("data", data, bytes)
 
-        self.__cipher.reset()
-        packet = self.__packet_encoder.encode(data)
-        return self._socket.sendall(packet)
+        with self.__send_lock:
+            self.__send_packet(data)
+
+    def send_batch(self, messages: list) -> int:
+        """Send a list of messages in one packet and return its size. The
+        remote party receives them one by one by recv() or recv_many()."""
+        if not isinstance(messages, (list, tuple)):
+            raise HTypeError("messages", messages, list, tuple)
+
+        if not messages:
+            raise HFormatError("Parameter messages expected a non-empty list.")
+
+        payload = pack_batch(messages)
+        with self.__send_lock:
+            return self.__send_packet(payload, FLAG_BATCH)
+
+    def send_stream(self, source, chunk_size: int = DEFAULT_STREAM_CHUNK_SIZE) -> int:
+        """Send a large message chunk by chunk and return its size.
+
+        The source is a bytes-like object, a file object opened in binary
+        mode or an iterable of bytes. Each chunk of at most chunk_size
+        bytes is encrypted and sent as its own packet, so the memory does
+        not depend on the size of the message. The remote party reads it
+        by recv_stream()."""
+        if not isinstance(chunk_size, int):
+            raise HTypeError("chunk_size", chunk_size, int)
+
+        if chunk_size <= 0:
+            raise HFormatError("Parameter chunk_size expected a positive integer.")
+
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            source = memoryview(source)
+            chunks = (source[i: i + chunk_size] for i in range(0, len(source), chunk_size))
+        elif hasattr(source, "read"):
+            chunks = iter(lambda: source.read(chunk_size), b"")
+        else:
+            chunks = iter(source)
+
+        total_size = 0
+        with self.__send_lock:
+            for chunk in chunks:
+                if not isinstance(chunk, (bytes, bytearray, memoryview)):
+                    raise HTypeError("chunk", chunk, bytes, bytearray, memoryview)
+
+                # Split the large chunks of an iterable.
+                for i in range(0, len(chunk), chunk_size):
+                    data = bytes(chunk[i: i + chunk_size])
+                    self.__send_packet(data, FLAG_STREAM)
+                    total_size += len(data)
+
+            self.__send_packet(b"", FLAG_STREAM | FLAG_STREAM_END)
+
+        return total_size
+
+    def recv_stream(self):
+        """Return an iterator of the chunks of a message which is sent by
+        send_stream(). A message which is sent by send() is returned as a
+        stream of one chunk."""
+        while True:
+            packet_dict = self.__recv(self.__buffer.pop_packet, None)
+            if packet_dict is None:
+                raise STCPSocketError("The stream is broken by an abnormal packet.")
+
+            if packet_dict["payload"]:
+                yield packet_dict["payload"]
+
+            if packet_dict["flags"] & FLAG_STREAM_END\
+                or not packet_dict["flags"] & FLAG_STREAM:
+                return
 
     def bind(self, address):
         return self._socket.bind(address)
 
-    def listen(self, __backlog: int = 0):
+    def listen(self, __backlog: int = None):
+        """The backlog is the one of profile by default, or 0 if there
+        is no profile."""
+        if self.__profile is not None:
+            self.__profile.apply(self._socket)
+
+        if __backlog is None:
+            __backlog = 0
+            if self.__profile is not None and self.__profile.backlog is not None:
+                __backlog = self.__profile.backlog
+
         self._socket.listen(__backlog)
         self._is_working = True
 
@@ -238,8 +548,9 @@ class STCPSocket(object):
         socket, addr = self._socket.accept()
         socket.settimeout(STCPSocket.DEFAULT_TIME_OUT)  # timeout for non-blocking socket
 
-        self._log(StdUsers.USER, StdLevels.INFO, "Server accepted {}.".format(addr))
-        self._log(StdUsers.DEV, StdLevels.INFO, "Server accepted {}.".format(addr))
+        if self._log.enabled:
+            self._log(StdUsers.USER, StdLevels.INFO, "Server accepted {}.", addr)
+            self._log(StdUsers.DEV, StdLevels.INFO, "Server accepted {}.", addr)
 
         socket = self._fromsocket(socket, addr, start_serve=True)
         socket._is_working = True
@@ -247,23 +558,37 @@ class STCPSocket(object):
         return socket, addr
 
     def connect(self, address):
+        # The buffer sizes must be set before connecting, so that they are
+        # used to negotiate the TCP window.
+        if self.__profile is not None:
+            self.__profile.apply(self._socket)
+
         self._socket.connect(address)
         self._is_working = True
 
         self._log(StdUsers.USER, StdLevels.INFO, "Connect to "
-        "server {} successfully.".format(address))
+        "server {} successfully.", address)
     
         self._log(StdUsers.DEV, StdLevels.INFO, "Connect to "
-        "server {} successfully.".format(address))
+        "server {} successfully.", address)
     
         self._log(StdUsers.DEV, StdLevels.DEBUG, "Transform "
-        "to STCP Socket {}.".format(address))
+        "to STCP Socket {}.", address)
 
-        self._log = self._logger_generator.generate(
-                f"STCP Socket {address}", self._display)
+        self._log = generate_logger(
+                self._logger_generator, f"STCP Socket {address}", self._display)
 
         self.settimeout_raw(STCPSocket.DEFAULT_TIME_OUT)
 
+        self.__buffer = PacketBuffer(
+                decoder=self.__packet_decoder,
+                name="Packet Buffer of {}".format(address),
+                logger_generator=self._logger_generator,
+                display=self._display,
+                max_bytes=self.__max_buffer_bytes,
+                metrics=self.__metrics_registry
+            )
+
         self._stop_auto_recv = False
         auto_recv = threading.Thread(
                 target=self._start_auto_recv,
@@ -271,16 +596,8 @@ class STCPSocket(object):
             )
         auto_recv.start()
 
-        self.__buffer = PacketBuffer(
-                decoder=self.__packet_decoder,
-                name="Packet Buffer of {}".format(address),
-                logger_generator=self._logger_generator,
-                display=self._display
-            )
-
     def close(self):
         if self.__buffer is not None:  # not STCP Listener
-            self.__buffer_available.set()
             self._stop_auto_recv = True
 
         if not self.isclosed():
@@ -288,6 +605,12 @@ class STCPSocket(object):
             self._is_working = False
             self._log(StdUsers.DEV, StdLevels.INFO, "Closed.")
 
+        with self.__buffer_available:
+            self.__buffer_available.notify_all()
+
+        with self.__buffer_not_full:
+            self.__buffer_not_full.notify_all()
+
     def isclosed(self):
         "This method returns the raw socket._closed"
         return self._socket._closed
@@ -303,16 +626,28 @@ class STCPSocket(object):
                 buffer_size=self.__buffer_size,
                 logger_generator=self._logger_generator,
                 display=self._display,
-                name=f"STCP Socket {address}"
+                name=f"STCP Socket {address}",
+                max_buffer_bytes=self.__max_buffer_bytes,
+                family=self._family,
+                compressor=self.__compressor,
+                compress_threshold=self.__compress_threshold,
+                crypter=self.__crypter,
+                session=self.__session,
+                metrics=self.__metrics_registry,
+                profile=self.__profile
             )
 
         new_socket._socket = socket
+        if self.__profile is not None:
+            self.__profile.apply(socket)
 
         new_socket.__buffer = PacketBuffer(
                 decoder=new_socket.__packet_decoder,
                 name="PacketBuffer of {}".format(address),
                 logger_generator=self._logger_generator,
-                display=self._display
+                display=self._display,
+                max_bytes=self.__max_buffer_bytes,
+                metrics=self.__metrics_registry
             )
 
         if start_serve:
@@ -324,3 +659,460 @@ class STCPSocket(object):
             auto_recv.start()
 
         return new_socket
+
+
+class STCPConnection(object):
+    "A connection which is accepted and served by STCPServer."
+    def __init__(
+                    self,
+                    server: "STCPServer",
+                    socket: socket.socket,
+                    address,
+                    cipher: HKSCipher,
+                    logger_generator: LoggerGenerator,
+                    display: dict,
+                    compressor: Codec = None,
+                    compress_threshold: int = DEFAULT_COMPRESS_THRESHOLD,
+                    crypter: ParallelCrypter = None,
+                    session: bool = False,
+                    metrics: MetricsRegistry = None,
+                    read_size: AdaptiveReadSize = None
+                ):
+        self.address = address
+        self._server = server
+        self._socket = socket
+
+        self._log = generate_logger(logger_generator, f"STCP Connection {address}", display)
+
+        # The packets are decoded in the serving thread but may be encoded in
+        # any thread, so the encoder and the decoder use their own ciphers.
+        self.__encoder_cipher = copy.copy(cipher)
+        self.__packet_encoder = SecurePacketEncoder(
+                self.__encoder_cipher,
+                compressor=compressor,
+                compress_threshold=compress_threshold,
+                crypter=crypter,
+                session=session
+            )
+        self._buffer = PacketBuffer(
+                decoder=SecurePacketDecoder(copy.copy(cipher), crypter=crypter),
+                name="PacketBuffer of {}".format(address),
+                logger_generator=logger_generator,
+                display=display,
+                metrics=metrics
+            )
+
+        self._metrics = None if metrics is None else _SocketMetrics(metrics, "stcp_server")
+        self._read_size = read_size
+
+        self._lock = threading.Lock()
+        self._outgoing = collections.deque()
+        self._closed = False
+
+    def send(self, data: bytes) -> int:
+        """Send data to the remote party. The packet is written
+        immediately if possible, the rest is written by the server."""
+        if not isinstance(data, bytes):
+            raise HTypeError("data", data, bytes)
+
+        error = None
+        with self._lock:
+            if self._closed:
+                raise STCPSocketClosedError("Connection closed.")
+
+            if self._metrics is not None:
+                start = time.perf_counter()
+
+            if not self.__packet_encoder.session:
+                self.__encoder_cipher.reset()
+            parts = self.__packet_encoder.encode_parts(data)
+            size = sum(len(part) for part in parts)
+
+            if self._metrics is not None:
+                self._metrics.encode_seconds.observe(time.perf_counter() - start)
+                self._metrics.bytes_sent.inc(size)
+                self._metrics.packets_sent.inc()
+
+            sent = 0
+            if not self._outgoing:
+                try:
+                    sent = _send_buffers(self._socket, parts)
+                except BlockingIOError:
+                    pass
+                except OSError as e:
+                    error = e
+
+            if error is None and sent < size:
+                self._outgoing.extend(memoryview(part) for part in parts)
+                _consume(self._outgoing, sent)
+
+        if error is not None:
+            self._server._request_close(self)
+            raise STCPSocketClosedError("Connection closed ({}).".format(error))
+
+        if sent < size:
+            self._server._request_write(self)
+
+        return size
+
+    def sendall(self, data: bytes) -> None:
+        self.send(data)
+
+    def _flush(self):
+        # Write the pending packets, return True if all of them are written.
+        with self._lock:
+            while self._outgoing:
+                try:
+                    sent = _send_buffers(self._socket, self._outgoing)
+                except BlockingIOError:
+                    return False
+
+                _consume(self._outgoing, sent)
+
+        return True
+
+    def close(self):
+        self._server._request_close(self)
+
+    def isclosed(self):
+        return self._closed
+
+
+class STCPServer(object):
+    """A STCP server which serves all connections in one thread.
+
+    The listening socket and all accepted sockets are non-blocking and
+    watched by a selector. Each complete message is passed to
+    on_message(connection, data) in the serving thread. If on_message is
+    None, the messages are put into a queue and returned by recv(). The
+    address family, the compressor, the crypter, the session mode, the
+    metrics and the tuning profile are the same as those of STCPSocket,
+    but the metrics of the connections are named "stcp_server.*"."""
+    def __init__(
+                    self,
+                    cipher: HKSCipher,
+                    name: str,
+                    buffer_size: int,
+                    on_message=None,
+                    logger_generator: LoggerGenerator = InvisibleLoggerGenerator(),
+                    display: dict = {},
+                    family: int = socket.AF_INET,
+                    compressor: Codec = None,
+                    compress_threshold: int = DEFAULT_COMPRESS_THRESHOLD,
+                    crypter: ParallelCrypter = None,
+                    session: bool = False,
+                    metrics: MetricsRegistry = None,
+                    profile: TuningProfile = None
+                ):
+        if not isinstance(cipher, HKSCipher):
+            raise HTypeError("cipher", cipher, HKSCipher)
+
+        if not isinstance(name, str):
+            raise HTypeError("name", name, str)
+
+        if not isinstance(buffer_size, int):
+            raise HTypeError("buffer_size", buffer_size, int)
+
+        if buffer_size <= 0:
+            raise HFormatError("Parameter buffer_size expected an positive integer.")
+
+        if on_message is not None and not callable(on_message):
+            raise HTypeError("on_message", on_message, "callable", None)
+
+        if not isinstance(logger_generator, LoggerGenerator):
+            raise HTypeError("logger_generator", logger_generator, LoggerGenerator)
+
+        if not isinstance(display, dict):
+            raise HTypeError("display", display, dict)
+
+        _check_family(family)
+
+        if compressor is not None and not isinstance(compressor, Codec):
+            raise HTypeError("compressor", compressor, Codec, None)
+
+        if not isinstance(compress_threshold, int):
+            raise HTypeError("compress_threshold", compress_threshold, int)
+
+        if crypter is not None and not isinstance(crypter, ParallelCrypter):
+            raise HTypeError("crypter", crypter, ParallelCrypter, None)
+
+        if not isinstance(session, bool):
+            raise HTypeError("session", session, bool)
+
+        if session and type(cipher) is not AES_CTR:
+            raise HTypeError("cipher", cipher, AES_CTR)
+
+        _check_metrics(metrics)
+        profile = _check_profile(profile)
+
+        self._name = name
+        self._logger_generator = logger_generator
+        self._display = display
+        self._log = generate_logger(self._logger_generator, name, self._display)
+
+        self.__cipher = cipher
+        self.__buffer_size = buffer_size
+        self.__on_message = on_message
+        self.__compressor = compressor
+        self.__compress_threshold = compress_threshold
+        self.__crypter = crypter
+        self.__session = session
+        self.__metrics = metrics
+        self.__profile = profile
+        self.__messages = queue.Queue()
+
+        self._socket = socket.socket(family, socket.SOCK_STREAM)
+        self._selector = selectors.DefaultSelector()
+        self._connections = {}
+
+        # Other threads ask the serving thread to register sockets for
+        # writing or to close them, then wake it up via this socket pair.
+        self._lock = threading.Lock()
+        self._pending_writes = set()
+        self._pending_closes = set()
+        self._wakeup_reader, self._wakeup_writer = socket.socketpair()
+        self._wakeup_reader.setblocking(False)
+        self._wakeup_writer.setblocking(False)
+
+        self._serving_thread = None
+        self._shutdown_request = False
+        self._is_shut_down = threading.Event()
+        self._is_shut_down.set()
+
+    def bind(self, address):
+        return self._socket.bind(address)
+
+    def listen(self, __backlog: int = None):
+        """The backlog is the one of profile by default, or 128 if there
+        is no profile."""
+        if self.__profile is not None:
+            self.__profile.apply(self._socket)
+
+        if __backlog is None:
+            __backlog = 128
+            if self.__profile is not None and self.__profile.backlog is not None:
+                __backlog = self.__profile.backlog
+
+        self._socket.listen(__backlog)
+        self._socket.setblocking(False)
+
+        self._log(StdUsers.USER, StdLevels.INFO, "Server start listening.")
+        self._log(StdUsers.DEV, StdLevels.INFO, "Server start listening.")
+
+    def getsockname(self):
+        return self._socket.getsockname()
+
+    @property
+    def connections(self):
+        return list(self._connections.values())
+
+    def serve_forever(self):
+        "Serve all connections until shutdown() is called."
+        self._serving_thread = threading.get_ident()
+        self._shutdown_request = False
+        self._is_shut_down.clear()
+
+        self._selector.register(self._socket, selectors.EVENT_READ, None)
+        self._selector.register(self._wakeup_reader, selectors.EVENT_READ, self)
+
+        try:
+            while not self._shutdown_request:
+                for key, mask in self._selector.select():
+                    if key.data is None:
+                        self._accept()
+                    elif key.data is self:
+                        self._handle_requests()
+                    else:
+                        if mask & selectors.EVENT_READ:
+                            self._read(key.data)
+                        if mask & selectors.EVENT_WRITE and not key.data.isclosed():
+                            self._write(key.data)
+        finally:
+            for connection in list(self._connections.values()):
+                self._close_connection(connection)
+
+            self._selector.close()
+            self._socket.close()
+            self._wakeup_reader.close()
+            self._wakeup_writer.close()
+            self._serving_thread = None
+            self._is_shut_down.set()
+
+            self._log(StdUsers.DEV, StdLevels.INFO, "Closed.")
+
+    def shutdown(self):
+        "Stop serve_forever() and wait until it returns."
+        self._shutdown_request = True
+        self._wake_up()
+        if self._serving_thread != threading.get_ident():
+            self._is_shut_down.wait()
+
+    def recv(self, timeout: float = None):
+        """Return the tuple (connection, data) of a received message. It
+        is only used if the server does not have on_message callback."""
+        if self.__on_message is not None:
+            raise STCPSocketError("Messages are passed to the on_message callback.")
+
+        try:
+            return self.__messages.get(timeout=timeout)
+        except queue.Empty:
+            raise STCPSocketTimeoutError("Receiving exceeds timeout.")
+
+    def _wake_up(self):
+        try:
+            self._wakeup_writer.send(b"\0")
+        except (BlockingIOError, OSError):
+            # The wakeup socket is full (the serving thread will wake up
+            # anyway) or closed (the server was shut down).
+            pass
+
+    def _request_write(self, connection: STCPConnection):
+        if self._serving_thread == threading.get_ident():
+            self._selector.modify(connection._socket,
+                selectors.EVENT_READ | selectors.EVENT_WRITE, connection)
+            return
+
+        with self._lock:
+            self._pending_writes.add(connection)
+        self._wake_up()
+
+    def _request_close(self, connection: STCPConnection):
+        if self._serving_thread == threading.get_ident():
+            self._close_connection(connection)
+            return
+
+        with self._lock:
+            self._pending_closes.add(connection)
+        self._wake_up()
+
+    def _handle_requests(self):
+        try:
+            while self._wakeup_reader.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+
+        with self._lock:
+            pending_writes, self._pending_writes = self._pending_writes, set()
+            pending_closes, self._pending_closes = self._pending_closes, set()
+
+        for connection in pending_writes:
+            if not connection.isclosed():
+                self._selector.modify(connection._socket,
+                    selectors.EVENT_READ | selectors.EVENT_WRITE, connection)
+
+        for connection in pending_closes:
+            self._close_connection(connection)
+
+    def _accept(self):
+        try:
+            sock, address = self._socket.accept()
+        except BlockingIOError:
+            return
+
+        sock.setblocking(False)
+        read_size = None
+        if self.__profile is not None:
+            self.__profile.apply(sock)
+            read_size = self.__profile.read_size(self.__buffer_size)
+
+        connection = STCPConnection(
+                server=self,
+                socket=sock,
+                address=address,
+                cipher=self.__cipher,
+                logger_generator=self._logger_generator,
+                display=self._display,
+                compressor=self.__compressor,
+                compress_threshold=self.__compress_threshold,
+                crypter=self.__crypter,
+                session=self.__session,
+                metrics=self.__metrics,
+                read_size=read_size
+            )
+
+        self._connections[sock.fileno()] = connection
+        self._selector.register(sock, selectors.EVENT_READ, connection)
+
+        if self._log.enabled:
+            self._log(StdUsers.USER, StdLevels.INFO, "Server accepted {}.", address)
+            self._log(StdUsers.DEV, StdLevels.INFO, "Server accepted {}.", address)
+
+    def _read(self, connection: STCPConnection):
+        if connection._read_size is None:
+            read_size = self.__buffer_size
+        else:
+            read_size = connection._read_size.size
+
+        try:
+            size = connection._socket.recv_into(
+                connection._buffer.reserve(read_size), read_size)
+        except BlockingIOError:
+            return
+        except OSError as e:
+            self._log(StdUsers.DEV, StdLevels.INFO, "Connection {} closed "
+            "({}).", connection.address, e)
+            self._close_connection(connection)
+            return
+
+        if not size:
+            self._log(StdUsers.DEV, StdLevels.INFO, "Connection {} closed "
+            "(remote socket closed).", connection.address)
+            self._close_connection(connection)
+            return
+
+        if connection._metrics is not None:
+            connection._metrics.bytes_received.inc(size)
+
+        if connection._read_size is not None:
+            connection._read_size.update(size)
+
+        connection._buffer.commit(size)
+        try:
+            messages = connection._buffer.pop_many()
+        except Exception as e:
+            # The stream can not be decoded any more, only this connection
+            # is closed and the server keeps serving the others.
+            self._log(StdUsers.DEV, StdLevels.WARNING, "Connection {} closed "
+            "(undecodable packet: {}).", connection.address, type(e).__name__)
+            self._close_connection(connection)
+            return
+
+        for message in messages:
+            if self.__on_message is None:
+                self.__messages.put((connection, message))
+                continue
+
+            try:
+                self.__on_message(connection, message)
+            except Exception as e:
+                self._log(StdUsers.DEV, StdLevels.ERROR, "Unknown error in "
+                "on_message callback ({}).", e)
+
+    def _write(self, connection: STCPConnection):
+        try:
+            flushed = connection._flush()
+        except OSError as e:
+            self._log(StdUsers.DEV, StdLevels.INFO, "Connection {} closed "
+            "({}).", connection.address, e)
+            self._close_connection(connection)
+            return
+
+        if flushed:
+            self._selector.modify(connection._socket,
+                selectors.EVENT_READ, connection)
+
+    def _close_connection(self, connection: STCPConnection):
+        with connection._lock:
+            if connection._closed:
+                return
+            connection._closed = True
+
+        self._connections.pop(connection._socket.fileno(), None)
+        try:
+            self._selector.unregister(connection._socket)
+        except (KeyError, ValueError):
+            pass
+
+        connection._socket.close()
+        connection._log(StdUsers.DEV, StdLevels.INFO, "Closed.")
@@ -1,59 +1,265 @@
 from os import name
+import time
+import struct
 import random
 import threading
+import collections
 
 from hks_pylib.logger import LoggerGenerator
 from hks_pylib.logger.logger_generator import InvisibleLoggerGenerator
 from hks_pylib.logger.standard import StdLevels, StdUsers
-from hkserror.hkserror import HTypeError
+from hkserror.hkserror import HFormatError, HTypeError
 from hks_pynetwork.external import STCPSocket, STCPSocketClosedError
+from hks_pynetwork.secure_packet import BATCH_ITEM_STRUCT
+from hks_pynetwork.metrics import MetricsRegistry
+from hks_pynetwork.logger import generate_logger
 
 from hks_pynetwork.errors.internal import ChannelError, ChannelSlotError, ChannelClosedError, ForwardNodeError
+from hks_pynetwork.errors.internal import ChannelBufferFullError
+
+
+class _ChannelMessage(object):
+    __slots__ = ("source", "message", "obj", "popped")
+
+    def __init__(self, source: str, message: bytes, obj: object):
+        self.source = source
+        self.message = message
+        self.obj = obj
+        self.popped = False
 
 
 class ChannelBuffer(object):
-    def __init__(self):
-        self._buffer = []
-        self.__lock = threading.Lock()
+    # Each message is stored in the queue of all messages and in the queue
+    # of its source. A popped message is only marked as popped and left in
+    # the other queue, it is skipped when it reaches the head of that queue.
+    # The queues are compacted when popped messages outnumber the others.
+    MIN_COMPACT_SIZE = 64
+
+    # The policies which are applied when a message is pushed to a full
+    # buffer: wait until there is enough space, drop the oldest messages
+    # or raise ChannelBufferFullError.
+    BLOCK = "block"
+    DROP_OLDEST = "drop_oldest"
+    RAISE = "raise"
+    POLICIES = (BLOCK, DROP_OLDEST, RAISE)
+
+    def __init__(
+                    self,
+                    max_messages: int = None,
+                    max_bytes: int = None,
+                    policy: str = BLOCK,
+                    metrics: MetricsRegistry = None
+                ):
+        """If metrics is given, the total number and size of messages in
+        the buffers and the dropped messages are recorded in it."""
+        if max_messages is not None and not isinstance(max_messages, int):
+            raise HTypeError("max_messages", max_messages, int, None)
+
+        if max_messages is not None and max_messages <= 0:
+            raise HFormatError("Parameter max_messages expected a positive integer.")
+
+        if max_bytes is not None and not isinstance(max_bytes, int):
+            raise HTypeError("max_bytes", max_bytes, int, None)
+
+        if max_bytes is not None and max_bytes <= 0:
+            raise HFormatError("Parameter max_bytes expected a positive integer.")
+
+        if policy not in ChannelBuffer.POLICIES:
+            raise HFormatError("Parameter policy expected one of {}.".format(
+                ", ".join(ChannelBuffer.POLICIES)))
 
-    def push(self, source: str, message: bytes, obj: object = None):
-        self.__lock.acquire()
-        self._buffer.append({"source": source, "message": message, "obj": obj})
-        self.__lock.release()
+        if metrics is not None and not isinstance(metrics, MetricsRegistry):
+            raise HTypeError("metrics", metrics, MetricsRegistry, None)
+
+        self._max_messages = max_messages
+        self._max_bytes = max_bytes
+        self._policy = policy
+
+        self._buffer = collections.deque()
+        self._sources = {}
+        self._size = 0
+        self._bytes = 0
+        self._garbage = 0
+        self._closed = False
+        self.__lock = threading.Lock()
+        self.__not_full = threading.Condition(self.__lock)
+
+        self._metrics = metrics
+        if metrics is not None:
+            self._messages_gauge = metrics.gauge("channel_buffer.messages")
+            self._bytes_gauge = metrics.gauge("channel_buffer.bytes")
+            self._dropped_messages = metrics.counter("channel_buffer.dropped_messages")
+
+    def _isfull(self, size: int):
+        # A message is always accepted by an empty buffer, even if it is
+        # larger than max_bytes. The caller must hold the lock.
+        if self._size == 0:
+            return False
+
+        if self._max_messages is not None and self._size >= self._max_messages:
+            return True
+
+        return self._max_bytes is not None and self._bytes + size > self._max_bytes
+
+    def push(self, source: str, message: bytes, obj: object = None, timeout: float = None):
+        """Push a message to the buffer. If the buffer is full, the policy
+        is applied. With the BLOCK policy, ChannelBufferFullError is raised
+        if there is no space after timeout seconds (None means forever)."""
+        with self.__lock:
+            self._push(_ChannelMessage(source, message, obj), timeout)
+
+    def push_many(self, source: str, messages: list, timeout: float = None, wakeup=None):
+        """Push a list of (message, obj) from the same source by taking
+        the lock once. The policy and the timeout are applied to each
+        message. The callable wakeup is called before waiting for space,
+        so the consumer can pop the messages which have been pushed."""
+        with self.__lock:
+            for message, obj in messages:
+                self._push(_ChannelMessage(source, message, obj), timeout, wakeup)
+
+    def _push(self, packet: _ChannelMessage, timeout: float, wakeup=None):
+        # The caller must hold the lock.
+        size = len(packet.message)
+        if self._closed:
+            raise ChannelClosedError("Channel buffer closed.")
+
+        if self._isfull(size):
+            if self._policy == ChannelBuffer.RAISE:
+                raise ChannelBufferFullError("Channel buffer is full.")
+
+            if self._policy == ChannelBuffer.DROP_OLDEST:
+                while self._isfull(size):
+                    self._drop_oldest()
+            else:
+                if wakeup is not None:
+                    wakeup()
+
+                if not self.__not_full.wait_for(
+                    lambda: self._closed or not self._isfull(size), timeout):
+                    raise ChannelBufferFullError("Channel buffer is still "
+                    "full after {} seconds.".format(timeout))
+
+                if self._closed:
+                    raise ChannelClosedError("Channel buffer closed.")
+
+        self._buffer.append(packet)
+
+        source_queue = self._sources.get(packet.source)
+        if source_queue is None:
+            source_queue = self._sources[packet.source] = collections.deque()
+        source_queue.append(packet)
+
+        self._size += 1
+        self._bytes += size
+
+        if self._metrics is not None:
+            self._messages_gauge.inc()
+            self._bytes_gauge.inc(size)
+
+    def _drop_oldest(self):
+        # The caller must hold the lock and the buffer must not be empty.
+        packet = self._buffer.popleft()
+        while packet.popped:
+            self._garbage -= 1
+            packet = self._buffer.popleft()
+
+        # The message is still in the queue of its source.
+        packet.popped = True
+        self._size -= 1
+        self._bytes -= len(packet.message)
+        self._garbage += 1
+
+        if self._metrics is not None:
+            self._messages_gauge.dec()
+            self._bytes_gauge.dec(len(packet.message))
+            self._dropped_messages.inc()
 
     def pop(self, source: str = None):
-        self.__lock.acquire()
-        if len(self._buffer) == 0:
-            return None, None, None
-
-        idx = 0
-        if source is not None:
-            for i, packet in enumerate(self._buffer):
-                if packet["source"] == source:
-                    idx = i
+        with self.__lock:
+            if source is None:
+                queue = self._buffer
+            else:
+                queue = self._sources.get(source)
+
+            packet = None
+            while queue:
+                packet = queue.popleft()
+                if not packet.popped:
                     break
 
-        packet = self._buffer[idx]
-        del self._buffer[idx]
+                self._garbage -= 1
+                packet = None
+
+            if source is not None and queue is not None and not queue:
+                del self._sources[source]
+
+            if packet is None:
+                return None, None, None
+
+            packet.popped = True
+            self._size -= 1
+            self._bytes -= len(packet.message)
+            self._garbage += 1
+
+            if self._metrics is not None:
+                self._messages_gauge.dec()
+                self._bytes_gauge.dec(len(packet.message))
+
+            if self._garbage > max(self._size, ChannelBuffer.MIN_COMPACT_SIZE):
+                self._compact()
+
+            self.__not_full.notify()
+
+        return packet.source, packet.message, packet.obj
 
-        self.__lock.release()
-        return packet["source"], packet["message"], packet["obj"]
+    def _compact(self):
+        self._buffer = collections.deque(p for p in self._buffer if not p.popped)
+
+        self._sources = {}
+        for packet in self._buffer:
+            source_queue = self._sources.get(packet.source)
+            if source_queue is None:
+                source_queue = self._sources[packet.source] = collections.deque()
+            source_queue.append(packet)
+
+        self._garbage = 0
+
+    def close(self):
+        "Release the producers which are waiting for the space of buffer."
+        with self.__lock:
+            self._closed = True
+            self.__not_full.notify_all()
+
+    def nbytes(self):
+        "Return the total size of messages in buffer."
+        return self._bytes
 
     def __len__(self):
-        return len(self._buffer)
+        return self._size
 
 
 class LocalNode(object):
-    nodes = []
-    node_names = []
-    MAX_NODES = 8
+    # The registry of all local nodes in the process, keyed by name. The
+    # number of nodes is unlimited if MAX_NODES is None.
+    nodes = {}
+    MAX_NODES = None
     lock = threading.Lock()
 
     def __init__(self,
             name: str = None,
             logger_generator: LoggerGenerator = InvisibleLoggerGenerator(),
-            display: dict = {}
+            display: dict = {},
+            max_messages: int = None,
+            max_bytes: int = None,
+            policy: str = ChannelBuffer.BLOCK,
+            metrics: MetricsRegistry = None
         ):
+        """Parameters max_messages and max_bytes limit the buffer of
+        received messages, the policy (see ChannelBuffer) is applied to
+        the senders when it is full. The buffer is unbounded by default.
+
+        If metrics is given, the sent and received messages are recorded
+        in it as "local_node.*", and the buffer as "channel_buffer.*"."""
         if name is not None and not isinstance(name, str):
             raise HTypeError("name", name, str, None)
 
@@ -63,66 +269,170 @@ class LocalNode(object):
         if not isinstance(display, dict):
             raise HTypeError("display", display, dict)
 
-        if name is None:
-            while name is None or name in LocalNode.node_names:
-                name = str(random.randint(1000000, 9999999))
+        buffer = ChannelBuffer(max_messages, max_bytes, policy, metrics)
+
+        with LocalNode.lock:
+            if name is None:
+                while name is None or name in LocalNode.nodes:
+                    name = str(random.randint(1000000, 9999999))
 
-        if name in LocalNode.node_names:
-            raise ChannelSlotError(f"Name {name} is in use.")
+            if name in LocalNode.nodes:
+                raise ChannelSlotError(f"Name {name} is in use.")
 
-        if len(LocalNode.nodes) >= LocalNode.MAX_NODES:
-            raise ChannelSlotError("No available slot in Local Node list.")
+            if LocalNode.MAX_NODES is not None\
+                and len(LocalNode.nodes) >= LocalNode.MAX_NODES:
+                raise ChannelSlotError("No available slot in Local Node list.")
 
-        LocalNode.lock.acquire()
-        LocalNode.node_names.append(name)
-        LocalNode.nodes.append(self)
-        LocalNode.lock.release()
+            LocalNode.nodes[name] = self
 
         self.name = name
-        self._buffer = ChannelBuffer()
+        self._buffer = buffer
         self._closed = False
+
+        self._metrics = metrics
+        if metrics is not None:
+            self._sent_messages = metrics.counter("local_node.sent_messages")
+            self._sent_bytes = metrics.counter("local_node.sent_bytes")
+            self._received_messages = metrics.counter("local_node.received_messages")
  
         self._buffer_available = threading.Event()
         self.__send_lock = threading.Lock()
         self.__recv_lock = threading.Lock()
 
-        self._log = logger_generator.generate(
-                name,
-                display
-            )
+        self._log = generate_logger(logger_generator, name, display)
 
         self._log(StdUsers.DEV, StdLevels.INFO,
-        "{} join to Local Nodes.".format(name))
+        "{} join to Local Nodes.", name)
 
-    def send(self, destination_name: str, message: bytes, obj: object = None):
-        if not isinstance(destination_name, str):
-            raise HTypeError("destination_name", destination_name, str)
+    @staticmethod
+    def lookup(name: str) -> "LocalNode":
+        """Return the local node which has the given name. The returned
+        node can be passed to send() instead of its name to avoid looking
+        it up again."""
+        if not isinstance(name, str):
+            raise HTypeError("name", name, str)
 
-        if not isinstance(message, bytes):
-            raise HTypeError("message", message, bytes)
+        node = LocalNode.nodes.get(name)
+        if node is None:
+            raise ChannelSlotError(f"Channel name {name} doesn't exist.")
 
-        self.__send_lock.acquire()
-        if isinstance(message, bytes) is False:
-            raise Exception("Message must be a bytes object.")
+        return node
 
+    def _deliver(self, source_name: str, message: bytes, obj: object):
+        "Push a message to the buffer of this node and wake up its receiver."
         if self._closed:
-            raise ChannelClosedError("Channel closed.")
+            raise ChannelSlotError("The destination node has been closed.")
 
         try:
-            slot_of_destination = LocalNode.node_names.index(destination_name)
-            destination_node: LocalNode = LocalNode.nodes[slot_of_destination]
-        except ValueError:
-            raise ChannelSlotError(f"Channel name {destination_name} doesn't exist.")
+            self._buffer.push(source_name, message, obj)
+        except ChannelClosedError:
+            raise ChannelSlotError("The destination node has been closed.")
+
+        self._wake_up()
+
+    def _wake_up(self):
+        # Event.set() takes the lock of the event, skip it if the receiver
+        # has not consumed the previous wake-up. It is safe because recv()
+        # only waits when the buffer is empty.
+        if not self._buffer_available.is_set():
+            self._buffer_available.set()
+
+    def _deliver_many(self, source_name: str, messages: list):
+        "Push a list of (message, obj) and wake up the receiver once."
+        if self._closed:
+            raise ChannelSlotError("The destination node has been closed.")
+
+        try:
+            self._buffer.push_many(source_name, messages, wakeup=self._wake_up)
+        except ChannelClosedError:
+            raise ChannelSlotError("The destination node has been closed.")
+        finally:
+            self._wake_up()
+
+    def send(self, destination, message: bytes, obj: object = None):
+        """Send a message to the destination which is the name of a local
+        node or the node itself (see lookup())."""
+        if not isinstance(destination, (str, LocalNode)):
+            raise HTypeError("destination", destination, str, LocalNode)
+
+        if not isinstance(message, bytes):
+            raise HTypeError("message", message, bytes)
 
-        destination_node._buffer.push(self.name, message, obj)
-        destination_node._buffer_available.set()
-        self.__send_lock.release()
+        with self.__send_lock:
+            if self._closed:
+                raise ChannelClosedError("Channel closed.")
+
+            if isinstance(destination, str):
+                destination = LocalNode.lookup(destination)
+
+            destination._deliver(self.name, message, obj)
+
+        if self._metrics is not None:
+            self._sent_messages.inc()
+            self._sent_bytes.inc(len(message))
+
+    def send_many(self, messages: list):
+        """Send a list of (destination, message) or (destination, message,
+        obj). All destinations are looked up before any message is sent.
+        The messages to the same destination keep their order and are
+        pushed to its buffer at once."""
+        batches = {}
+        for item in messages:
+            if not isinstance(item, tuple) or len(item) not in (2, 3):
+                raise HTypeError("item of messages", item, tuple)
+
+            destination, message = item[0], item[1]
+            obj = item[2] if len(item) == 3 else None
+            if not isinstance(message, bytes):
+                raise HTypeError("message", message, bytes)
+
+            if isinstance(destination, str):
+                destination = LocalNode.lookup(destination)
+            elif not isinstance(destination, LocalNode):
+                raise HTypeError("destination", destination, str, LocalNode)
+
+            batch = batches.get(destination)
+            if batch is None:
+                batch = batches[destination] = []
+            batch.append((message, obj))
+
+        self.__send_batches(batches)
+
+    def multicast(self, destinations: list, message: bytes, obj: object = None):
+        """Send the same message to a list of destinations, which are names
+        of local nodes or the nodes themselves. The same obj is shared by
+        all of them, a destination which is repeated receives it once."""
+        if not isinstance(message, bytes):
+            raise HTypeError("message", message, bytes)
+
+        batches = {}
+        for destination in destinations:
+            if isinstance(destination, str):
+                destination = LocalNode.lookup(destination)
+            elif not isinstance(destination, LocalNode):
+                raise HTypeError("destination", destination, str, LocalNode)
+
+            batches[destination] = [(message, obj)]
+
+        self.__send_batches(batches)
+
+    def __send_batches(self, batches: dict):
+        with self.__send_lock:
+            if self._closed:
+                raise ChannelClosedError("Channel closed.")
+
+            for destination, batch in batches.items():
+                destination._deliver_many(self.name, batch)
+
+                if self._metrics is not None:
+                    self._sent_messages.inc(len(batch))
+                    self._sent_bytes.inc(sum(len(message) for message, _ in batch))
 
     def recv(self, source: str = None):
         if source is not None and not isinstance(source, str):
             raise HTypeError("source", source, str, None)
 
-        if source is not None and source not in LocalNode.node_names:
+        if source is not None and source not in LocalNode.nodes:
             raise ChannelError("{} has not existed in Local Nodes.".format(source))
 
         if self._closed:
@@ -136,6 +446,10 @@ class LocalNode(object):
             raise ChannelClosedError("Channel closed.")
 
         source, msg, obj = self._buffer.pop(source)
+
+        if self._metrics is not None and msg is not None:
+            self._received_messages.inc()
+
         return source, msg, obj
 
     def close(self):
@@ -144,21 +458,22 @@ class LocalNode(object):
 
             self._closed = True
             self._buffer_available.set()
+            self._buffer.close()
 
-            my_slot = LocalNode.node_names.index(self.name)
-            del LocalNode.node_names[my_slot]
-            del LocalNode.nodes[my_slot]
-            del self._buffer
+            with LocalNode.lock:
+                del LocalNode.nodes[self.name]
 
             name = self.name
             self.name = None
             self.__recv_lock.release()
 
             self._log(StdUsers.DEV, StdLevels.INFO,
-            "{} leaves Local Nodes.".format(name))
+            "{} leaves Local Nodes.", name)
 
 
 class ForwardNode(LocalNode):
+    DEFAULT_BATCH_MAX_DELAY = 0.001
+
     def __init__(
                     self,
                     node: LocalNode,
@@ -166,8 +481,22 @@ class ForwardNode(LocalNode):
                     name: str,
                     implicated_die: bool = False,
                     logger_generator: LoggerGenerator = InvisibleLoggerGenerator(),
-                    display: tuple = {}
+                    display: tuple = {},
+                    max_messages: int = None,
+                    max_bytes: int = None,
+                    policy: str = ChannelBuffer.BLOCK,
+                    batch_max_bytes: int = None,
+                    batch_max_delay: float = DEFAULT_BATCH_MAX_DELAY,
+                    metrics: MetricsRegistry = None
                 ):
+        """If batch_max_bytes is set, the messages from the local node are
+        coalesced and sent in one packet (see STCPSocket.send_batch()).
+        A batch is sent when it reaches batch_max_bytes or batch_max_delay
+        seconds after its first message. The remote party must use a
+        version which supports batch packets.
+
+        If metrics is given, the forwarded messages are recorded in it as
+        "forward_node.*", see also LocalNode."""
         if node is not None and not isinstance(node, LocalNode):
             raise HTypeError("node", node, LocalNode, None)
 
@@ -186,14 +515,39 @@ class ForwardNode(LocalNode):
         if not isinstance(display, dict):
             raise HTypeError("display", display, dict)
 
+        if batch_max_bytes is not None and not isinstance(batch_max_bytes, int):
+            raise HTypeError("batch_max_bytes", batch_max_bytes, int, None)
+
+        if batch_max_bytes is not None and batch_max_bytes <= 0:
+            raise HFormatError("Parameter batch_max_bytes expected a positive integer.")
+
+        if not isinstance(batch_max_delay, (int, float)):
+            raise HTypeError("batch_max_delay", batch_max_delay, float, int)
+
+        if batch_max_delay < 0:
+            raise HFormatError("Parameter batch_max_delay expected a non-negative number.")
+
         self._node = node
         self._socket = socket
+        self._batch_max_bytes = batch_max_bytes
+        self._batch_max_delay = batch_max_delay
+
+        # The message which didn't fit the previous batch.
+        self._batch_leftover = None
         super().__init__(
                 name=name,
                 logger_generator=logger_generator,
-                display=display
+                display=display,
+                max_messages=max_messages,
+                max_bytes=max_bytes,
+                policy=policy,
+                metrics=metrics
             )
 
+        if metrics is not None:
+            self._messages_to_remote = metrics.counter("forward_node.messages_to_remote")
+            self._messages_from_remote = metrics.counter("forward_node.messages_from_remote")
+
         self._implicated_die = implicated_die
         if display is None:
             display = socket._log.display
@@ -247,7 +601,7 @@ class ForwardNode(LocalNode):
     def _wait_message_from_remote(self):
         while not self._closed:
             try:
-                data = self._socket.recv()
+                data = self._socket.recv_many()
             except STCPSocketClosedError:
                 self._log(StdUsers.DEV, StdLevels.INFO, "Forwarding message from "
                 "remote node closed normally (remote node closed).")
@@ -257,13 +611,16 @@ class ForwardNode(LocalNode):
                 "remote node closed with an unknown error in data receiving.")
 
                 self._log(StdUsers.DEV, StdLevels.ERROR, "Forwarding message from "
-                "remote node closed with an unknown error in data receiving ({}).".format(e))
+                "remote node closed with an unknown error in data receiving ({}).", e)
                 break
 
             if data:
+                if self._metrics is not None:
+                    self._messages_from_remote.inc(len(data))
+
                 try:
-                    super().send(self._node.name, data)
-                except ChannelClosedError:
+                    super().send_many([(self._node, message) for message in data if message])
+                except (ChannelClosedError, ChannelSlotError):
                     self._log(StdUsers.DEV, StdLevels.INFO, "Forwarding message from "
                     "remote node closed normally (local node closed).")
                     break
@@ -273,14 +630,17 @@ class ForwardNode(LocalNode):
 
                     self._log(StdUsers.DEV, StdLevels.ERROR, "Forwarding message from "
                     "remote node closed with an unknown error "
-                    "in data sending ({}).".format(e))
+                    "in data sending ({}).", e)
                     break
         self._one_thread_stop.set()
 
     def _wait_message_from_node(self):
         while not self._closed:
             try:
-                _, message, _ = super().recv()
+                if self._batch_leftover is not None:
+                    message, self._batch_leftover = self._batch_leftover, None
+                else:
+                    _, message, _ = super().recv()
             except AttributeError as e:  
                 # (Old version) After closing forwarder,
                 # it doesn't have buffer attribute.
@@ -307,12 +667,24 @@ class ForwardNode(LocalNode):
 
                 self._log(StdUsers.DEV, StdLevels.ERROR, "Forwarding message "
                 "from local node closed with an unknown "
-                "error ({}) in data receiving.".format(e))
+                "error ({}) in data receiving.", e)
                 break
 
             if message:
                 try:
-                    self._socket.send(message)
+                    if self._batch_max_bytes is None:
+                        self._socket.send(message)
+                        count = 1
+                    else:
+                        messages = self._collect_batch(message)
+                        if len(messages) == 1:
+                            self._socket.send(message)
+                        else:
+                            self._socket.send_batch(messages)
+                        count = len(messages)
+
+                    if self._metrics is not None:
+                        self._messages_to_remote.inc(count)
                 except STCPSocketClosedError:
                     self._log(StdUsers.DEV, StdLevels.INFO, "Forwarding message "
                     "from local node closed normally (remote node closed).")
@@ -323,13 +695,316 @@ class ForwardNode(LocalNode):
 
                     self._log(StdUsers.DEV, StdLevels.ERROR, "Forwarding message "
                     "from local node closed with an unknown "
-                    "error in data sending ({}).".format(e))
+                    "error in data sending ({}).", e)
                     break
 
         self._one_thread_stop.set()
 
+    def _collect_batch(self, message: bytes) -> list:
+        # Pop the messages which follow the first one until the batch is
+        # full or the delay is over. The message which would exceed
+        # batch_max_bytes is kept for the next batch.
+        messages = [message]
+        size = len(message) + BATCH_ITEM_STRUCT.size
+        deadline = time.monotonic() + self._batch_max_delay
+        while not self._closed:
+            _, message, _ = self._buffer.pop()
+            if message is None:
+                # Check again after clearing the event, so that the message
+                # which is pushed in the meantime can not be missed.
+                self._buffer_available.clear()
+                _, message, _ = self._buffer.pop()
+
+            if message is None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self._buffer_available.wait(remaining):
+                    break
+                continue
+
+            # The messages are popped without recv(), they are recorded as
+            # recv() does.
+            if self._metrics is not None:
+                self._received_messages.inc()
+
+            if not message:
+                continue
+
+            if size + len(message) + BATCH_ITEM_STRUCT.size > self._batch_max_bytes:
+                self._batch_leftover = message
+                break
+
+            messages.append(message)
+            size += len(message) + BATCH_ITEM_STRUCT.size
+
+        return messages
+
     def send(self, received_node_name, message):
         raise NotImplementedError("Forwarder doesn't have send() method.")
 
+    def send_many(self, messages):
+        raise NotImplementedError("Forwarder doesn't have send_many() method.")
+
+    def multicast(self, destinations, message, obj=None):
+        raise NotImplementedError("Forwarder doesn't have multicast() method.")
+
     def recv(self):
         raise NotImplementedError("Forwarder doesn't have recv() method.")
+
+
+# SOURCE_SIZE (2 bytes) + DESTINATION_SIZE (2 bytes), followed by the
+# names of source node and destination node and the message.
+HUB_FRAME_STRUCT = struct.Struct(">HH")
+
+
+class _RemoteNode(LocalNode):
+    """The local representative of a node on the other side of a ForwardHub.
+    Messages which are sent to it are queued to the hub."""
+    def __init__(self, hub: "ForwardHub", name: str):
+        super().__init__(name, hub._logger_generator, hub._display)
+        self._hub = hub
+
+    def _deliver(self, source_name: str, message: bytes, obj: object):
+        if self._closed:
+            raise ChannelSlotError("The destination node has been closed.")
+
+        self._hub._enqueue(source_name, self.name, message)
+
+    def _deliver_many(self, source_name: str, messages: list):
+        if self._closed:
+            raise ChannelSlotError("The destination node has been closed.")
+
+        for message, _ in messages:
+            self._hub._enqueue(source_name, self.name, message)
+
+    def recv(self, source: str = None):
+        raise NotImplementedError("Remote node doesn't have recv() method.")
+
+
+class ForwardHub(object):
+    """Forward the messages of many local nodes over one STCP socket.
+
+    Each remote node is represented by a local node with the same name
+    (see add_remote()), so a local node sends to a remote node as if it
+    were local. Each frame is tagged with the names of its source and its
+    destination, the hub on the other side delivers it to the local node
+    with the destination name. Only the frames whose source has been added
+    by add_remote() are accepted, the others are dropped, so each side adds
+    the remote nodes which may send to it. Node names must be unique in all
+    connected processes. The object of a message is not forwarded.
+
+    The hub uses two threads, whatever the number of nodes is."""
+    MAX_BATCH_SIZE = 2**16
+
+    def __init__(
+                    self,
+                    socket: STCPSocket,
+                    name: str,
+                    implicated_die: bool = False,
+                    logger_generator: LoggerGenerator = InvisibleLoggerGenerator(),
+                    display: dict = {}
+                ):
+        if not isinstance(socket, STCPSocket):
+            raise HTypeError("socket", socket, STCPSocket)
+
+        if not isinstance(name, str):
+            raise HTypeError("name", name, str)
+
+        if not isinstance(implicated_die, bool):
+            raise HTypeError("implicated_die", implicated_die, bool)
+
+        if not isinstance(logger_generator, LoggerGenerator):
+            raise HTypeError("logger_generator", logger_generator, LoggerGenerator)
+
+        if not isinstance(display, dict):
+            raise HTypeError("display", display, dict)
+
+        self.name = name
+        self._socket = socket
+        self._implicated_die = implicated_die
+        self._logger_generator = logger_generator
+        self._display = display
+        self._log = generate_logger(logger_generator, name, display)
+
+        self._remote_nodes = {}
+        self._lock = threading.Lock()
+
+        # The outgoing messages, the destination name is stored as object.
+        self._outgoing = ChannelBuffer()
+        self._outgoing_available = threading.Event()
+
+        self._closed = False
+        self._one_thread_stop = threading.Event()
+
+    def add_remote(self, name: str) -> LocalNode:
+        "Add a node of the other side and return its local representative."
+        if not isinstance(name, str):
+            raise HTypeError("name", name, str)
+
+        with self._lock:
+            if self._closed:
+                raise ChannelClosedError("Forward hub closed.")
+
+            node = self._remote_nodes.get(name)
+            if node is None:
+                node = self._remote_nodes[name] = _RemoteNode(self, name)
+                self._log(StdUsers.DEV, StdLevels.DEBUG, "Add remote "
+                "node {}.", name)
+
+        return node
+
+    def remove_remote(self, name: str):
+        with self._lock:
+            node = self._remote_nodes.pop(name, None)
+
+        if node is not None:
+            node.close()
+
+    def _enqueue(self, source_name: str, destination_name: str, message: bytes):
+        if self._closed:
+            raise ChannelSlotError("The forward hub has been closed.")
+
+        self._outgoing.push(source_name, message, destination_name)
+        if not self._outgoing_available.is_set():
+            self._outgoing_available.set()
+
+    def start(self):
+        "Start forwarding, this method returns after the hub is closed."
+        self._log(StdUsers.DEV, StdLevels.INFO, "Start forwarding.")
+
+        t1 = threading.Thread(
+                target=self._wait_message_from_nodes,
+                name="WaitFromLocal of {}".format(self.name),
+                daemon=True
+            )
+        t1.start()
+
+        t2 = threading.Thread(
+                target=self._wait_message_from_remote,
+                name="WaitFromRemote of {}".format(self.name),
+                daemon=True
+            )
+        t2.start()
+
+        self._one_thread_stop.wait()
+        self.close()
+
+        self._log(StdUsers.DEV, StdLevels.INFO, "Stop completely.")
+
+    def _pop_frames(self) -> list:
+        frames = []
+        size = 0
+        while size < ForwardHub.MAX_BATCH_SIZE:
+            source, message, destination = self._outgoing.pop()
+            if message is None:
+                break
+
+            source = source.encode()
+            destination = destination.encode()
+            frame = b"".join((
+                HUB_FRAME_STRUCT.pack(len(source), len(destination)),
+                source,
+                destination,
+                message
+            ))
+
+            frames.append(frame)
+            size += len(frame)
+
+        return frames
+
+    def _wait_message_from_nodes(self):
+        while True:
+            frames = self._pop_frames()
+            if not frames:
+                if self._closed:
+                    break
+
+                self._outgoing_available.wait()
+                self._outgoing_available.clear()
+                continue
+
+            try:
+                if len(frames) == 1:
+                    self._socket.send(frames[0])
+                else:
+                    self._socket.send_batch(frames)
+            except Exception as e:
+                self._log(StdUsers.DEV, StdLevels.INFO, "Forwarding message "
+                "from local nodes closed ({}).", e)
+                break
+
+        self._one_thread_stop.set()
+
+    def _route(self, frame: bytes):
+        # Return the source name, the destination name and the message of
+        # a frame. Raise ChannelSlotError if the source is not a remote node.
+        source_size, destination_size = HUB_FRAME_STRUCT.unpack_from(frame)
+        current_index = HUB_FRAME_STRUCT.size
+        source = frame[current_index: current_index + source_size].decode()
+        current_index += source_size
+        destination = frame[current_index: current_index + destination_size].decode()
+        current_index += destination_size
+
+        if source not in self._remote_nodes:
+            raise ChannelSlotError("Unknown source.")
+
+        return source, destination, frame[current_index:]
+
+    def _wait_message_from_remote(self):
+        while not self._closed:
+            try:
+                frames = self._socket.recv_many()
+            except STCPSocketClosedError:
+                self._log(StdUsers.DEV, StdLevels.INFO, "Forwarding message from "
+                "remote node closed normally (remote node closed).")
+                break
+            except Exception as e:
+                self._log(StdUsers.DEV, StdLevels.ERROR, "Forwarding message from "
+                "remote node closed with an unknown error in data receiving ({}).", e)
+                break
+
+            for frame in frames:
+                try:
+                    source, destination, message = self._route(frame)
+                except (struct.error, UnicodeDecodeError):
+                    if self._log.enabled:
+                        self._log(StdUsers.DEV, StdLevels.WARNING, "Drop an "
+                        "abnormal frame from remote.")
+                    continue
+                except ChannelSlotError:
+                    if self._log.enabled:
+                        self._log(StdUsers.DEV, StdLevels.WARNING, "Drop a "
+                        "frame from unknown remote node.")
+                    continue
+
+                node = LocalNode.nodes.get(destination)
+                try:
+                    if node is None:
+                        raise ChannelSlotError("Unknown destination.")
+                    node._deliver(source, message, None)
+                except ChannelSlotError:
+                    if self._log.enabled:
+                        self._log(StdUsers.DEV, StdLevels.WARNING, "Drop a message "
+                        "from {} to unavailable node {}.", source, destination)
+
+        self._one_thread_stop.set()
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+
+            self._closed = True
+            remote_nodes = list(self._remote_nodes.values())
+            self._remote_nodes.clear()
+
+        self._outgoing_available.set()
+        self._one_thread_stop.set()
+
+        for node in remote_nodes:
+            node.close()
+
+        if self._implicated_die:
+            self._socket.close()
+
+        self._log(StdUsers.DEV, StdLevels.INFO, "Closed.")
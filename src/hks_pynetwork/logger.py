@@ -0,0 +1,72 @@
+from hks_pylib.logger import LoggerGenerator
+from hks_pylib.logger.logger import Display
+from hks_pylib.logger.logger_generator import InvisibleLoggerGenerator
+from hks_pylib.logger.standard import Levels, Users
+from hkserror.hkserror import HTypeError
+
+
+class LazyLogger(object):
+    """A wrapper of a logger of hks_pylib which skips the disabled records
+    without calling the logger.
+
+    The displayed users and levels are read once when it is created, so
+    attribute enabled is False if no record can be emitted at all. The
+    message is formatted with the positional arguments only when the
+    record is emitted, e.g. log(StdUsers.DEV, StdLevels.INFO, "Server
+    accepted {}.", address)."""
+    def __init__(self, logger=None):
+        # None means that the logger is invisible.
+        self._logger = logger
+
+        display = getattr(logger, "_display", None)
+        config = getattr(logger, "_config", None)
+        if logger is None:
+            self._displayed = set()
+        elif not isinstance(display, dict) or config is None:
+            # An unknown logger, all records are passed to it.
+            self._displayed = None
+        else:
+            self._displayed = set()
+            for user, levels in display.items():
+                if levels is Display.ALL:
+                    levels = config.levels(user)
+
+                for level in levels:
+                    self._displayed.add((user, level))
+
+        self.enabled = self._displayed is None or bool(self._displayed)
+
+    def isenabled(self, user: Users, level: Levels) -> bool:
+        "Return True if the records of user and level are emitted."
+        if not self.enabled:
+            return False
+
+        return self._displayed is None or (user, level) in self._displayed
+
+    def __call__(self, user: Users, level: Levels, message: str, *args):
+        if not self.enabled:
+            return
+
+        if self._displayed is not None and (user, level) not in self._displayed:
+            return
+
+        if args:
+            message = message.format(*args)
+
+        self._logger(user, level, message)
+
+
+def generate_logger(
+                        logger_generator: LoggerGenerator,
+                        name: str,
+                        display: dict
+                    ) -> LazyLogger:
+    """Return a LazyLogger of the logger which is generated by
+    logger_generator. No logger is generated if it is invisible."""
+    if not isinstance(logger_generator, LoggerGenerator):
+        raise HTypeError("logger_generator", logger_generator, LoggerGenerator)
+
+    if isinstance(logger_generator, InvisibleLoggerGenerator):
+        return LazyLogger()
+
+    return LazyLogger(logger_generator.generate(name, display))
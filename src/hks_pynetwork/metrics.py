@@ -0,0 +1,183 @@
+import math
+import weakref
+import threading
+
+from hkserror.hkserror import HTypeError
+
+from hks_pynetwork.errors.metrics import MetricsError
+
+
+class _ThreadSentinel(object):
+    "It is released with the thread-local data when its thread finishes."
+
+
+class _Metric(object):
+    # Each thread updates its own cell, so the hot paths never take a lock
+    # and no update is lost. The cells are merged when they are read. The
+    # cell of a finished thread is folded into _retired and dropped.
+    def __init__(self, name: str):
+        self.name = name
+        self._local = threading.local()
+        self._cells = {}  # id of cell -> cell of a running thread
+        self._retired = self._new_cell()
+        self._lock = threading.Lock()
+
+    def _new_cell(self):
+        raise NotImplementedError()
+
+    def _cell(self):
+        try:
+            return self._local.cell
+        except AttributeError:
+            cell = self._new_cell()
+            with self._lock:
+                self._cells[id(cell)] = cell
+
+            self._local.cell = cell
+            self._local.sentinel = _ThreadSentinel()
+            weakref.finalize(self._local.sentinel, self._retire, id(cell))
+            return cell
+
+    def _retire(self, key: int):
+        with self._lock:
+            cell = self._cells.pop(key, None)
+            if cell is not None:
+                for i, value in enumerate(cell):
+                    self._retired[i] += value
+
+    def _all_cells(self) -> list:
+        "Return the copies of the retired cell and the cells of running threads."
+        with self._lock:
+            return [list(self._retired)] + [list(cell) for cell in self._cells.values()]
+
+    def snapshot(self):
+        raise NotImplementedError()
+
+
+class Counter(_Metric):
+    "A value which only increases, for example the number of sent bytes."
+    def _new_cell(self):
+        return [0]
+
+    def inc(self, amount: int = 1):
+        try:
+            self._local.cell[0] += amount
+        except AttributeError:
+            self._cell()[0] += amount
+
+    @property
+    def value(self):
+        return sum(cell[0] for cell in self._all_cells())
+
+    def snapshot(self):
+        return self.value
+
+
+class Gauge(Counter):
+    "A value which goes up and down, for example the size of a queue."
+    def dec(self, amount: int = 1):
+        self.inc(-amount)
+
+    def set(self, value):
+        # It is not atomic with the concurrent inc() and dec().
+        self.inc(value - self.value)
+
+
+class Histogram(_Metric):
+    """The distribution of observed values, for example latencies in
+    seconds. A value is counted in the bucket of the smallest power of
+    two which is greater than it, the values <= 0 are in bucket 0.0."""
+    # The buckets of the exponents in [-MAX_EXPONENT, MAX_EXPONENT], the
+    # values which are out of range are counted in the first or last one.
+    MAX_EXPONENT = 64
+
+    def _new_cell(self):
+        # [count, sum, bucket of values <= 0, buckets of exponents...]
+        return [0, 0, 0] + [0] * (2 * Histogram.MAX_EXPONENT + 1)
+
+    def observe(self, value):
+        try:
+            cell = self._local.cell
+        except AttributeError:
+            cell = self._cell()
+
+        if value > 0:
+            exponent = math.frexp(value)[1]
+            if exponent > Histogram.MAX_EXPONENT:
+                exponent = Histogram.MAX_EXPONENT
+            elif exponent < -Histogram.MAX_EXPONENT:
+                exponent = -Histogram.MAX_EXPONENT
+            cell[exponent + Histogram.MAX_EXPONENT + 3] += 1
+        else:
+            cell[2] += 1
+
+        cell[0] += 1
+        cell[1] += value
+
+    @property
+    def count(self):
+        return sum(cell[0] for cell in self._all_cells())
+
+    def snapshot(self):
+        "Return a dict of count, sum and buckets (upper bound -> count)."
+        total = [0] * len(self._new_cell())
+        for cell in self._all_cells():
+            for i, value in enumerate(cell):
+                total[i] += value
+
+        buckets = {}
+        if total[2]:
+            buckets[0.0] = total[2]
+
+        for i, value in enumerate(total[3:]):
+            if value:
+                buckets[math.ldexp(1.0, i - Histogram.MAX_EXPONENT)] = value
+
+        return {"count": total[0], "sum": total[1], "buckets": buckets}
+
+
+class MetricsRegistry(object):
+    """The metrics of the objects which are created with this registry.
+
+    The objects of the same class share their metrics, the names are
+    prefixed by the class, e.g. "stcp_socket.bytes_sent". A metric is
+    updated without any lock, so it can be left enabled in production."""
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get(self, name: str, metric_type):
+        if not isinstance(name, str):
+            raise HTypeError("name", name, str)
+
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = metric_type(name)
+            elif type(metric) is not metric_type:
+                raise MetricsError("Metric {} is a {}, not a {}.".format(
+                    name, type(metric).__name__, metric_type.__name__))
+
+        return metric
+
+    def counter(self, name: str) -> Counter:
+        "Return the counter of the name, it is created if it does not exist."
+        return self._get(name, Counter)
+
+    def gauge(self, name: str) -> Gauge:
+        "Return the gauge of the name, it is created if it does not exist."
+        return self._get(name, Gauge)
+
+    def histogram(self, name: str) -> Histogram:
+        "Return the histogram of the name, it is created if it does not exist."
+        return self._get(name, Histogram)
+
+    def snapshot(self) -> dict:
+        "Return the current values of all metrics, keyed by their names."
+        with self._lock:
+            metrics = list(self._metrics.values())
+
+        return {metric.name: metric.snapshot() for metric in metrics}
+
+    def __contains__(self, name):
+        return name in self._metrics
@@ -11,13 +11,13 @@ MAX_PACKET_SIZE = MAX_HEADER_SIZE + MAX_PAYLOAD_SIZE
 
 MIN_HEADER_SIZE = 6
 
+# HEADER_SIZE (2 bytes) + PAYLOAD_SIZE (4 bytes)
+HEADER_STRUCT = struct.Struct(">HI")
 
-class PacketEncoder(object):
-    def encode(self, payload: bytes):
-        if not isinstance(payload, bytes):
-            raise HTypeError("payload", payload, bytes)
 
-        if len(payload) > MAX_PAYLOAD_SIZE:
+class PacketEncoder(object):
+    def encode_header(self, payload_size: int, optional_header: bytes = b""):
+        if payload_size > MAX_PAYLOAD_SIZE:
             raise PacketSizeError("Payload size is too large "
             "(expected < {}).".format(MAX_PAYLOAD_SIZE))
 
@@ -25,20 +25,29 @@ class PacketEncoder(object):
         # HEADER = HEADER_SIZE(2 bytes) + PAYLOAD_SIZE(4 byte) + OPTIONAL_HEADER
         # ==> PACKET = HERDER_SIZE + PAYLOAD_SIZE + OPTIONAL_HEADER + PAYLOAD
 
-        header_struct = ">HI"
+        header_size = MIN_HEADER_SIZE + len(optional_header)
+        if header_size > MAX_HEADER_SIZE:
+            raise PacketSizeError("Header size is too large "
+            "(expected < {}).".format(MAX_HEADER_SIZE))
+
+        return HEADER_STRUCT.pack(header_size, payload_size) + optional_header
 
-        header_dummy = struct.pack(header_struct, 0, 0)
-        header_size = len(header_dummy)
+    def encode_parts(self, payload: bytes):
+        """Return the packet as the list [header, payload], it is used to
+        write the packet (e.g. by socket.sendmsg) without concatenating."""
+        if not isinstance(payload, bytes):
+            raise HTypeError("payload", payload, bytes)
 
-        header = struct.pack(header_struct, header_size, len(payload))
+        return [self.encode_header(len(payload)), payload]
 
-        return header + payload
+    def encode(self, payload: bytes):
+        return b"".join(self.encode_parts(payload))
 
 
 class PacketDecoder(object):
     def get_header(self, packet: bytes):
-        if not isinstance(packet, bytes):
-            raise HTypeError("packet", packet, bytes)
+        if not isinstance(packet, (bytes, bytearray, memoryview)):
+            raise HTypeError("packet", packet, bytes, bytearray, memoryview)
 
         if len(packet) > MAX_PACKET_SIZE:
             raise PacketSizeError("Packet size is too large "
@@ -47,7 +56,11 @@ class PacketDecoder(object):
         if len(packet) < MIN_HEADER_SIZE:
             raise IncompletePacketError("Incomplete header.")
 
-        header_size, payload_size = struct.unpack(">HI", packet[:MIN_HEADER_SIZE])
+        header_size, payload_size = HEADER_STRUCT.unpack_from(packet)
+        if header_size < MIN_HEADER_SIZE:
+            raise PacketSizeError("Header size is too small "
+            "(expected >= {}).".format(MIN_HEADER_SIZE))
+
         if header_size > MAX_HEADER_SIZE:
             raise PacketSizeError("Header size is too large "
             "(expected < {}).".format(MAX_HEADER_SIZE))
@@ -62,8 +75,10 @@ class PacketDecoder(object):
         return header_dict
 
     def decode(self, packet: bytes):
-        if not isinstance(packet, bytes):
-            raise HTypeError("packet", packet, bytes)
+        # The payload is sliced from the packet, so a memoryview packet
+        # gives a memoryview payload without copying.
+        if not isinstance(packet, (bytes, bytearray, memoryview)):
+            raise HTypeError("packet", packet, bytes, bytearray, memoryview)
 
         header = self.get_header(packet)
 
@@ -1,108 +1,422 @@
+import time
 import threading
+import collections
 
 from hks_pylib.logger import LoggerGenerator
 from hks_pylib.logger.logger_generator import InvisibleLoggerGenerator
 from hks_pylib.logger.standard import StdLevels, StdUsers
-from hkserror.hkserror import HTypeError
+from hkserror.hkserror import HFormatError, HTypeError
 from hks_pynetwork.secure_packet import PacketDecoder
+from hks_pynetwork.secure_packet import FLAG_BATCH, unpack_batch
+from hks_pynetwork.metrics import MetricsRegistry
+from hks_pynetwork.logger import generate_logger
 
-from hks_pynetwork.errors.packet import IncompletePacketError, PacketSizeError
-from hks_pynetwork.errors.secure_packet import CipherTypeMismatchError
+from hks_pylib.errors.cryptography.ciphers import CipherParameterError
+from hks_pylib.errors.cryptography.ciphers.symmetrics import UnAuthenticatedPacketError
+
+from hks_pynetwork.errors.packet import BufferSizeError, IncompletePacketError, PacketSizeError
+from hks_pynetwork.errors.secure_packet import CipherTypeMismatchError, SecurePacketError
+from hks_pynetwork.errors.compression import CompressionError
+
+
+# The errors of a packet which is received completely but can not be
+# decoded, the packet is dropped and the next packets are still valid.
+ABNORMAL_PACKET_ERRORS = (
+    UnAuthenticatedPacketError,
+    CipherParameterError,
+    SecurePacketError,
+    CompressionError
+)
+
+
+def writable_view(buffer) -> memoryview:
+    "Return a memoryview of bytes of the writable buffer."
+    try:
+        view = memoryview(buffer)
+    except TypeError:
+        view = None
+
+    if view is None or view.readonly:
+        raise HTypeError("buffer", buffer, bytearray, memoryview)
+
+    return view.cast("B")
 
 
 class PacketBuffer():
+    DEFAULT_CAPACITY = 4096
+
     def __init__(
                     self,
                     decoder: PacketDecoder,
                     name: str,
                     logger_generator: LoggerGenerator = InvisibleLoggerGenerator(),
-                    display: dict = {}
+                    display: dict = {},
+                    capacity: int = DEFAULT_CAPACITY,
+                    max_bytes: int = None,
+                    metrics: MetricsRegistry = None
                 ) -> None:
+        """Parameter max_bytes is the soft limit of unread bytes, see
+        isfull(). The buffer is unbounded if it is None.
+
+        If metrics is given, the unread bytes, the decoded packets, the
+        decoding errors and the decoding time are recorded in it."""
         if not isinstance(decoder, PacketDecoder):
             raise HTypeError("decoder", decoder, PacketDecoder)
 
         if name is not None and not isinstance(name, str):
             raise HTypeError("name", name, str, None)
 
-        self._buffer = []
+        if not isinstance(capacity, int):
+            raise HTypeError("capacity", capacity, int)
+
+        if capacity <= 0:
+            raise HFormatError("Parameter capacity expected a positive integer.")
 
+        if max_bytes is not None and not isinstance(max_bytes, int):
+            raise HTypeError("max_bytes", max_bytes, int, None)
+
+        if max_bytes is not None and max_bytes <= 0:
+            raise HFormatError("Parameter max_bytes expected a positive integer.")
+
+        if metrics is not None and not isinstance(metrics, MetricsRegistry):
+            raise HTypeError("metrics", metrics, MetricsRegistry, None)
+
+        # The received bytes are stored in a preallocated bytearray. The
+        # unread bytes are always buffer[start:end]. When the tail of the
+        # bytearray is full, the unread bytes are moved to the head or the
+        # bytearray is doubled, so each received byte is copied O(1) times.
+        self._min_capacity = capacity
+        self._buffer = bytearray(capacity)
+        self._view = memoryview(self._buffer)
+        self._start = 0
+        self._end = 0
+
+        # The size of the free memory which is returned by reserve() and
+        # not committed yet, None if there is no reservation.
+        self._reserved = None
+
+        self._max_bytes = max_bytes
         self._packet_decoder = decoder
 
-        self.__print = logger_generator.generate(name, display)
-        
-        self._current_packet = b""
-        self._current_packet_size = 0
+        self.__print = generate_logger(logger_generator, name, display)
+
         self._expected_current_packet_size = 0
-        
-        self._push_lock = threading.Lock()
 
-    def push(self, packet: bytes, append_to_end: bool = True):
-        if not isinstance(packet, bytes):
-            raise HTypeError("packet", packet, bytes)
+        # The packet dicts which have been decoded but not popped yet, e.g.
+        # the messages of a batch packet.
+        self._pending = collections.deque()
+
+        # The error of a packet which pop_many() raises in the next call,
+        # because the payloads popped before it have been returned.
+        self._error = None
+
+        self._lock = threading.Lock()
+
+        self._metrics = metrics
+        if metrics is not None:
+            self._unread_bytes = metrics.gauge("packet_buffer.unread_bytes")
+            self._decoded_packets = metrics.counter("packet_buffer.decoded_packets")
+            self._decode_errors = metrics.counter("packet_buffer.decode_errors")
+            self._decode_seconds = metrics.histogram("packet_buffer.decode_seconds")
 
-        if not isinstance(append_to_end, bool):
-            raise HTypeError("append_to_end", append_to_end, bool)
+    def _reserve(self, size: int):
+        if self._end + size <= len(self._buffer):
+            return
 
-        self._push_lock.acquire()
+        used = self._end - self._start
 
-        if append_to_end:
-            self._buffer.append(packet)
+        # Only compact if at least a half of buffer is free after that,
+        # otherwise the same unread bytes would be moved again and again.
+        if (used + size) * 2 <= len(self._buffer):
+            self._view[:used] = self._view[self._start: self._end]
         else:
-            self._buffer.insert(0, packet)
+            capacity = len(self._buffer) * 2
+            while capacity < (used + size) * 2:
+                capacity *= 2
 
-        self._push_lock.release()
+            new_buffer = bytearray(capacity)
+            new_buffer[:used] = self._view[self._start: self._end]
 
-    def pop(self):
-        if len(self._buffer) == 0:
-            return b""
+            self._buffer = new_buffer
+            self._view = memoryview(self._buffer)
+
+        self._start = 0
+        self._end = used
+
+    def _clear(self):
+        self._expected_current_packet_size = 0
+
+        # The reserved memory is being written, so it can not be moved.
+        if self._reserved is not None:
+            self._start = self._end
+            return
+
+        self._start = 0
+        self._end = 0
+
+        # Give back the memory which is allocated for a large packet.
+        if len(self._buffer) > self._min_capacity * 4:
+            self._buffer = bytearray(self._min_capacity)
+            self._view = memoryview(self._buffer)
+
+    def push(self, packet: bytes):
+        if not isinstance(packet, (bytes, bytearray, memoryview)):
+            raise HTypeError("packet", packet, bytes, bytearray, memoryview)
+
+        size = len(packet)
+        with self._lock:
+            self._reserve(size)
+            self._view[self._end: self._end + size] = packet
+            self._end += size
 
-        self._current_packet_size += len(self._buffer[0])
-        self._current_packet += self._buffer[0]
-        del self._buffer[0]
+        if self._metrics is not None:
+            self._unread_bytes.inc(size)
 
-        if self._packet_decoder is None:
-            ret = self._current_packet
-            self._current_packet = b""
-            self._current_packet_size = 0
-            self._expected_current_packet_size = 0
-            return ret
+    def reserve(self, size: int) -> memoryview:
+        """Return a writable memoryview of at least size bytes at the end
+        of buffer, e.g. for socket.recv_into(). The written bytes are
+        pushed by commit(). The reservation is released by commit() or
+        replaced by the next reserve(), only one producer can use it."""
+        if not isinstance(size, int):
+            raise HTypeError("size", size, int)
 
+        if size <= 0:
+            raise HFormatError("Parameter size expected a positive integer.")
+
+        with self._lock:
+            # Keep this memory when the buffer is cleared, otherwise it is
+            # allocated again by the next reservation.
+            self._min_capacity = max(self._min_capacity, size)
+            self._reserved = None
+            self._reserve(size)
+            self._reserved = len(self._buffer) - self._end
+            return self._view[self._end:]
+
+    def commit(self, size: int):
+        "Push the first size bytes which are written to the reserved memory."
+        if not isinstance(size, int):
+            raise HTypeError("size", size, int)
+
+        with self._lock:
+            if self._reserved is None:
+                raise HFormatError("Method reserve() must be called before commit().")
+
+            if not 0 <= size <= self._reserved:
+                raise HFormatError("Parameter size expected an integer "
+                "in [0, {}].".format(self._reserved))
+
+            self._reserved = None
+            self._end += size
+
+        if self._metrics is not None:
+            self._unread_bytes.inc(size)
+
+    def _peek_packet_size(self):
+        # Return the size of the first packet in buffer or None if it is
+        # not completely received. The caller must hold the lock.
         if self._expected_current_packet_size == 0:
             try:
-                packet_dict = self._packet_decoder.get_header(self._current_packet)
+                header = self._packet_decoder.get_header(
+                    self._view[self._start: self._end])
                 self._expected_current_packet_size =\
-                    packet_dict["payload_size"] + packet_dict["header_size"]
+                    header["payload_size"] + header["header_size"]
             except IncompletePacketError:
-                return b""
+                return None
             except PacketSizeError:
-                self.__print(StdUsers.DEV, StdLevels.WARNING, "Detect an "
-                "abnormal packet (invalid size).")
+                if self.__print.enabled:
+                    self.__print(StdUsers.DEV, StdLevels.WARNING, "Detect an "
+                    "abnormal packet (invalid size).")
 
-                self._current_packet = b""
-                self._current_packet_size = 0
-                self._expected_current_packet_size = 0
-                return b""
+                if self._metrics is not None:
+                    self._decode_errors.inc()
+                    self._unread_bytes.dec(self._end - self._start)
 
-        if self._current_packet_size < self._expected_current_packet_size:
-            return b""
+                # The stream can not be synchronized again, drop it all.
+                self._clear()
+                return None
+
+        packet_size = self._expected_current_packet_size
+        if self._end - self._start < packet_size:
+            return None
+
+        return packet_size
+
+    def _raise_error(self):
+        # Raise the error which has been kept by pop_many(). The caller
+        # must hold the lock.
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def _pop_packet(self, copy: bool = True):
+        # Return the decoded packet dict or None if there is no complete
+        # packet in buffer. A batch packet is returned as a packet for each
+        # of its messages. If copy is False, the payload may be a view of
+        # the buffer which is valid until the lock is released. The caller
+        # must hold the lock.
+        self._raise_error()
+
+        if self._pending:
+            return self._pending.popleft()
+
+        packet_size = self._peek_packet_size()
+        if packet_size is None:
+            return None
+
+        packet = self._view[self._start: self._start + packet_size]
+        self._start += packet_size
+        self._expected_current_packet_size = 0
+
+        if self._metrics is not None:
+            self._unread_bytes.dec(packet_size)
+            start = time.perf_counter()
 
         try:
-            packet_dict = self._packet_decoder.decode(self._current_packet)
-        except CipherTypeMismatchError as e:
-            self.__print(StdUsers.DEV, StdLevels.WARNING, "Detect an "
-            "abnormal packet ({}).".format(e))
+            packet_dict = self._packet_decoder.decode(packet)
+        except Exception as e:
+            if self._metrics is not None:
+                self._decode_errors.inc()
+
+            if self.__print.enabled and isinstance(e, CipherTypeMismatchError):
+                self.__print(StdUsers.DEV, StdLevels.WARNING, "Detect an "
+                "abnormal packet ({}).", e)
+            raise e
         finally:
-            if  self._current_packet_size > self._expected_current_packet_size:
-                apart_of_next_packet = self._current_packet[
-                        self._expected_current_packet_size :
-                    ]
-                self.push(apart_of_next_packet, append_to_end=False)
+            if self._start == self._end:
+                self._clear()
+
+        if self._metrics is not None:
+            self._decode_seconds.observe(time.perf_counter() - start)
+            self._decoded_packets.inc()
+
+        # The payload of a plain decoder is a slice of the buffer,
+        # it must be copied before the buffer is overwritten.
+        if copy and isinstance(packet_dict["payload"], memoryview):
+            packet_dict["payload"] = packet_dict["payload"].tobytes()
+
+        if packet_dict.get("flags", 0) & FLAG_BATCH:
+            messages = unpack_batch(packet_dict["payload"])
+            packet_dict["flags"] &= ~FLAG_BATCH
+            packet_dict["payload"] = messages[0] if messages else b""
+            self._pending.extend({"payload": message, "flags": 0} for message in messages[1:])
+
+        return packet_dict
 
-            self._current_packet = b""
-            self._current_packet_size = 0
-            self._expected_current_packet_size = 0
+    def pop_packet(self):
+        "Pop the first packet and return its decoded dict or None."
+        with self._lock:
+            return self._pop_packet()
+
+    def pop(self):
+        packet_dict = self.pop_packet()
+
+        if packet_dict is None:
+            return b""
 
         return packet_dict["payload"]
 
+    def pop_into(self, buffer) -> int:
+        """Pop the first packet, write its payload to the writable buffer
+        and return the size of payload, 0 if there is no packet. If the
+        buffer is too small, BufferSizeError is raised and the packet is
+        kept in buffer. The payload of a plain decoder is copied directly
+        from the received bytes."""
+        view = writable_view(buffer)
+        with self._lock:
+            packet_dict = self._pop_packet(copy=False)
+            if packet_dict is None:
+                return 0
+
+            payload = packet_dict["payload"]
+            size = len(payload)
+            if size > len(view):
+                if isinstance(payload, memoryview):
+                    packet_dict["payload"] = payload.tobytes()
+
+                self._pending.appendleft(packet_dict)
+                raise BufferSizeError("Buffer is too small "
+                "(expected >= {} bytes).".format(size))
+
+            view[:size] = payload
+
+        return size
+
+    def has_packet(self):
+        "Return True if there is at least one complete packet in buffer."
+        with self._lock:
+            return self._error is not None or bool(self._pending)\
+                or self._peek_packet_size() is not None
+
+    def isfull(self):
+        """Return True if the unread bytes reach max_bytes and at least one
+        packet can be popped. The producer should stop pushing until the
+        buffer is not full. A packet which is larger than max_bytes is
+        never blocked, because it can only be popped when it is complete."""
+        if self._max_bytes is None:
+            return False
+
+        with self._lock:
+            return self._end - self._start >= self._max_bytes\
+                and (bool(self._pending) or self._peek_packet_size() is not None)
+
+    def pop_many(self, max_count: int = None, max_bytes: int = None):
+        """Pop all complete packets in buffer and return their payloads.
+
+        Parameter max_count limits the number of returned payloads and
+        max_bytes limits the total size of popped packets. At least one
+        payload is returned if there is a complete packet, even if its
+        size exceeds max_bytes. Abnormal packets are skipped. The messages
+        of a batch packet are returned as separate payloads. If another
+        error occurs after some payloads are popped, these payloads are
+        returned and the error is raised by the next call."""
+        if max_count is not None and not isinstance(max_count, int):
+            raise HTypeError("max_count", max_count, int, None)
+
+        if max_count is not None and max_count <= 0:
+            raise HFormatError("Parameter max_count expected a positive integer.")
+
+        if max_bytes is not None and not isinstance(max_bytes, int):
+            raise HTypeError("max_bytes", max_bytes, int, None)
+
+        if max_bytes is not None and max_bytes <= 0:
+            raise HFormatError("Parameter max_bytes expected a positive integer.")
+
+        payloads = []
+        total_size = 0
+        with self._lock:
+            self._raise_error()
+            while max_count is None or len(payloads) < max_count:
+                if self._pending:
+                    packet_size = len(self._pending[0]["payload"])
+                else:
+                    packet_size = self._peek_packet_size()
+                    if packet_size is None:
+                        break
+
+                if max_bytes is not None and payloads\
+                    and total_size + packet_size > max_bytes:
+                    break
+
+                try:
+                    try:
+                        packet_dict = self._pop_packet()
+                    except ABNORMAL_PACKET_ERRORS as e:
+                        if self.__print.enabled:
+                            self.__print(StdUsers.DEV, StdLevels.WARNING, "Skip an "
+                            "abnormal packet ({}).", e)
+                        continue
+                except Exception as e:
+                    if not payloads:
+                        raise
+
+                    self._error = e
+                    break
+
+                total_size += packet_size
+                payloads.append(packet_dict["payload"])
+
+        return payloads
+
     def __len__(self):
-        return len(self._buffer)
+        "Return the number of bytes which have not been popped yet."
+        return self._end - self._start
@@ -0,0 +1,108 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+
+from hks_pylib.cryptography.ciphers.hkscipher import HKSCipher
+from hks_pylib.cryptography.ciphers.symmetrics import AES_CTR
+from hkserror.hkserror import HFormatError, HTypeError
+
+
+AES_BLOCK_SIZE = algorithms.AES.block_size // 8
+
+# The counter of CTR mode is a 128-bit big-endian integer, it wraps around.
+COUNTER_MODULO = 2**128
+
+
+class ParallelCrypter(object):
+    """Encrypt or decrypt the large payloads of counter-mode ciphers on a
+    thread pool. The payload is split into chunks which are aligned to the
+    AES block, the chunk at offset N uses the counter nonce + N / 16, so
+    the result is the same as the result of the cipher itself. The crypto
+    backend releases the GIL, so the chunks are processed in parallel.
+
+    Only AES_CTR is supported, other ciphers are processed by themselves.
+    The object is thread-safe and can be shared by many sockets."""
+    DEFAULT_CHUNK_SIZE = 2**20
+    DEFAULT_THRESHOLD = 2**22
+
+    def __init__(
+                    self,
+                    max_workers: int = None,
+                    chunk_size: int = DEFAULT_CHUNK_SIZE,
+                    threshold: int = DEFAULT_THRESHOLD
+                ):
+        """The payloads which are smaller than threshold are processed by
+        the cipher in the calling thread. Parameter max_workers is the
+        number of threads, it is the number of CPUs by default."""
+        if max_workers is not None and not isinstance(max_workers, int):
+            raise HTypeError("max_workers", max_workers, int, None)
+
+        if max_workers is not None and max_workers <= 0:
+            raise HFormatError("Parameter max_workers expected a positive integer.")
+
+        if not isinstance(chunk_size, int):
+            raise HTypeError("chunk_size", chunk_size, int)
+
+        if chunk_size <= 0 or chunk_size % AES_BLOCK_SIZE != 0:
+            raise HFormatError("Parameter chunk_size expected a positive "
+            "multiple of {}.".format(AES_BLOCK_SIZE))
+
+        if not isinstance(threshold, int):
+            raise HTypeError("threshold", threshold, int)
+
+        self._max_workers = max_workers or os.cpu_count() or 1
+        self._chunk_size = chunk_size
+        self._threshold = threshold
+        self._executor = ThreadPoolExecutor(
+                max_workers=self._max_workers,
+                thread_name_prefix="ParallelCrypter"
+            )
+
+    def supports(self, cipher: HKSCipher, size: int) -> bool:
+        "Return True if a payload of size bytes is processed in parallel."
+        return type(cipher) is AES_CTR and size >= self._threshold
+
+    def crypt(self, cipher: AES_CTR, data: bytes) -> bytes:
+        """Return the encrypted (or decrypted, it is the same in CTR mode)
+        data with the key and the current nonce of cipher. The cipher
+        itself is not changed."""
+        if type(cipher) is not AES_CTR:
+            raise HTypeError("cipher", cipher, AES_CTR)
+
+        if not isinstance(data, bytes):
+            raise HTypeError("data", data, bytes)
+
+        counter = int.from_bytes(cipher.get_param(0), "big")
+        return self.crypt_counter(cipher._key, counter, data)
+
+    def crypt_counter(self, key: bytes, counter: int, data: bytes) -> bytes:
+        "The same as crypt(), but the AES key and the initial counter are given."
+        view = memoryview(data)
+
+        futures = []
+        for offset in range(0, len(data), self._chunk_size):
+            nonce = (counter + offset // AES_BLOCK_SIZE) % COUNTER_MODULO
+            futures.append(self._executor.submit(
+                _crypt_chunk,
+                key,
+                nonce.to_bytes(AES_BLOCK_SIZE, "big"),
+                view[offset: offset + self._chunk_size]
+            ))
+
+        return b"".join(future.result() for future in futures)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def _crypt_chunk(key: bytes, nonce: bytes, chunk: memoryview) -> bytes:
+    encryptor = Cipher(algorithms.AES(key), modes.CTR(nonce), default_backend()).encryptor()
+    return encryptor.update(chunk) + encryptor.finalize()
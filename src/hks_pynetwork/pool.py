@@ -0,0 +1,315 @@
+import copy
+import time
+import socket
+import threading
+import contextlib
+import collections
+
+from hks_pylib.logger import LoggerGenerator
+from hks_pylib.cryptography.ciphers.cipherid import CipherID
+from hks_pylib.cryptography.ciphers.hkscipher import HKSCipher
+from hks_pylib.logger.logger_generator import InvisibleLoggerGenerator
+from hks_pylib.logger.standard import StdLevels, StdUsers
+from hkserror.hkserror import HFormatError, HTypeError
+
+from hks_pynetwork.external import STCPSocket, _check_family
+from hks_pynetwork.logger import generate_logger
+
+from hks_pynetwork.errors.pool import PoolClosedError, PoolTimeoutError
+
+
+class _Slot(object):
+    "The connections of a pool to an address with a cipher."
+    def __init__(self):
+        self.idle = collections.deque()  # (socket, time of release)
+        self.size = 0  # The number of idle, checked out and opening sockets.
+
+
+class STCPSocketPool(object):
+    """A pool of connected STCPSockets which are reused by the clients.
+
+    The sockets are pooled by the address, the address family and the
+    cipher (its class and its key), each pool opens at most max_size
+    sockets and keeps at least min_size of them after the first use. A
+    socket which has been idle for idle_timeout seconds is closed when
+    the pool is used. A checked out socket must be released with all of
+    its replies received, or be discarded."""
+    DEFAULT_MAX_SIZE = 8
+    DEFAULT_IDLE_TIMEOUT = 60.0
+
+    def __init__(
+                    self,
+                    cipher: HKSCipher,
+                    name: str,
+                    buffer_size: int,
+                    logger_generator: LoggerGenerator = InvisibleLoggerGenerator(),
+                    display: dict = {},
+                    min_size: int = 0,
+                    max_size: int = DEFAULT_MAX_SIZE,
+                    idle_timeout: float = DEFAULT_IDLE_TIMEOUT,
+                    family: int = socket.AF_INET
+                ):
+        if not isinstance(cipher, HKSCipher):
+            raise HTypeError("cipher", cipher, HKSCipher)
+
+        if not isinstance(name, str):
+            raise HTypeError("name", name, str)
+
+        if not isinstance(buffer_size, int):
+            raise HTypeError("buffer_size", buffer_size, int)
+
+        if buffer_size <= 0:
+            raise HFormatError("Parameter buffer_size expected an positive integer.")
+
+        if not isinstance(logger_generator, LoggerGenerator):
+            raise HTypeError("logger_generator", logger_generator, LoggerGenerator)
+
+        if not isinstance(display, dict):
+            raise HTypeError("display", display, dict)
+
+        if not isinstance(min_size, int):
+            raise HTypeError("min_size", min_size, int)
+
+        if not isinstance(max_size, int):
+            raise HTypeError("max_size", max_size, int)
+
+        if not 0 <= min_size <= max_size or max_size <= 0:
+            raise HFormatError("Parameters expected 0 <= min_size <= max_size and max_size > 0.")
+
+        if idle_timeout is not None and not isinstance(idle_timeout, (int, float)):
+            raise HTypeError("idle_timeout", idle_timeout, float, int, None)
+
+        if idle_timeout is not None and idle_timeout < 0:
+            raise HFormatError("Parameter idle_timeout expected a non-negative number.")
+
+        _check_family(family)
+
+        self._name = name
+        self._logger_generator = logger_generator
+        self._display = display
+        self._log = generate_logger(logger_generator, name, display)
+
+        self._cipher = cipher
+        self._buffer_size = buffer_size
+        self._min_size = min_size
+        self._max_size = max_size
+        self._idle_timeout = idle_timeout
+        self._family = family
+
+        self._slots = {}
+        self._keys = {}  # id of checked out socket -> key of its slot
+        self._closed = False
+        self._available = threading.Condition()
+
+    def _key(self, address, cipher: HKSCipher):
+        # The key of cipher is a private attribute of hks_pylib ciphers,
+        # the cipher object itself is used if it doesn't exist.
+        cipher_key = getattr(cipher, "_key", None)
+        if not isinstance(cipher_key, bytes):
+            cipher_key = id(cipher)
+
+        cipher_hash = CipherID.cls2hash(type(cipher)) or type(cipher).__qualname__
+        return (self._family, address, cipher_hash, cipher_key)
+
+    def _open(self, address, cipher: HKSCipher) -> STCPSocket:
+        stcp_socket = STCPSocket(
+                cipher=copy.copy(cipher),
+                name="{} connection".format(self._name),
+                buffer_size=self._buffer_size,
+                logger_generator=self._logger_generator,
+                display=self._display,
+                family=self._family
+            )
+
+        try:
+            stcp_socket.connect(address)
+        except BaseException:
+            stcp_socket.close()
+            raise
+
+        return stcp_socket
+
+    def _evict(self, slot: _Slot, now: float):
+        # Return the idle sockets which should be closed. The caller must
+        # hold the lock.
+        expired = []
+        if self._idle_timeout is None:
+            return expired
+
+        while slot.idle and slot.size > self._min_size\
+            and now - slot.idle[0][1] >= self._idle_timeout:
+            expired.append(slot.idle.popleft()[0])
+            slot.size -= 1
+
+        return expired
+
+    def acquire(self, address, cipher: HKSCipher = None, timeout: float = None) -> STCPSocket:
+        """Return a connected socket to the address. The cipher of pool is
+        used if cipher is None. If the pool of this address is exhausted,
+        wait until a socket is released or raise PoolTimeoutError after
+        timeout seconds (None means forever)."""
+        if cipher is None:
+            cipher = self._cipher
+
+        if not isinstance(cipher, HKSCipher):
+            raise HTypeError("cipher", cipher, HKSCipher, None)
+
+        if timeout is not None and not isinstance(timeout, (int, float)):
+            raise HTypeError("timeout", timeout, float, int, None)
+
+        key = self._key(address, cipher)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            expired = []
+            stcp_socket = None
+            with self._available:
+                if self._closed:
+                    raise PoolClosedError("Pool closed.")
+
+                slot = self._slots.get(key)
+                if slot is None:
+                    slot = self._slots[key] = _Slot()
+
+                expired = self._evict(slot, time.monotonic())
+                while slot.idle:
+                    candidate = slot.idle.pop()[0]  # The most recently used.
+                    if candidate.isworking():
+                        stcp_socket = candidate
+                        break
+
+                    expired.append(candidate)
+                    slot.size -= 1
+
+                # Reserve the slots to open new sockets outside the lock.
+                new_sockets = 0
+                if stcp_socket is None and slot.size < self._max_size:
+                    new_sockets = max(1, self._min_size - slot.size)
+                    slot.size += new_sockets
+                elif stcp_socket is None and not expired:
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        raise PoolTimeoutError("No available connection "
+                        "to {} after {} seconds.".format(address, timeout))
+
+                    self._available.wait(remaining)
+                    continue
+
+            for expired_socket in expired:
+                expired_socket.close()
+
+            if stcp_socket is None and new_sockets == 0:
+                continue  # The closed sockets left the room for a new one.
+
+            if stcp_socket is None:
+                stcp_socket = self._open_many(key, address, cipher, new_sockets)
+
+            with self._available:
+                self._keys[id(stcp_socket)] = key
+
+            return stcp_socket
+
+    def _open_many(self, key, address, cipher: HKSCipher, count: int) -> STCPSocket:
+        # Open count sockets, keep all but one of them as idle sockets to
+        # fill the pool up to min_size.
+        sockets = []
+        try:
+            for _ in range(count):
+                sockets.append(self._open(address, cipher))
+        except BaseException:
+            self._give_back(key, sockets, count)
+            raise
+
+        self._give_back(key, sockets[1:], count - 1)
+
+        self._log(StdUsers.DEV, StdLevels.DEBUG, "Open {} connections "
+        "to {}.", count, address)
+
+        return sockets[0]
+
+    def _give_back(self, key, sockets: list, reserved: int):
+        # Put the opened sockets into the pool as idle sockets and free the
+        # reserved slots which have not been used. They are the most recent
+        # idle sockets, the idle sockets are ordered by the time of release
+        # so that _evict() stops at the first one which is not expired.
+        with self._available:
+            slot = self._slots[key]
+            slot.size -= reserved - len(sockets)
+            now = time.monotonic()
+            for stcp_socket in sockets:
+                slot.idle.append((stcp_socket, now))
+            self._available.notify_all()
+
+    def release(self, stcp_socket: STCPSocket, discard: bool = False):
+        """Give back a socket which is returned by acquire(). The socket is
+        closed instead of being reused if discard is True, if it doesn't
+        work anymore or if the pool is closed."""
+        with self._available:
+            key = self._keys.pop(id(stcp_socket), None)
+            if key is None:
+                raise HFormatError("The socket doesn't belong to this pool.")
+
+            slot = self._slots[key]
+            if discard or self._closed or not stcp_socket.isworking():
+                slot.size -= 1
+                expired = [stcp_socket]
+            else:
+                now = time.monotonic()
+                slot.idle.append((stcp_socket, now))
+                expired = self._evict(slot, now)
+
+            self._available.notify_all()
+
+        for expired_socket in expired:
+            expired_socket.close()
+
+    @contextlib.contextmanager
+    def connection(self, address, cipher: HKSCipher = None, timeout: float = None):
+        """Check out a socket in a with statement. The socket is discarded
+        if an exception is raised in the with block."""
+        stcp_socket = self.acquire(address, cipher, timeout)
+        try:
+            yield stcp_socket
+        except BaseException:
+            self.release(stcp_socket, discard=True)
+            raise
+        else:
+            self.release(stcp_socket)
+
+    def evict(self):
+        "Close the sockets which have been idle for idle_timeout seconds."
+        expired = []
+        with self._available:
+            now = time.monotonic()
+            for slot in self._slots.values():
+                expired.extend(self._evict(slot, now))
+
+        for stcp_socket in expired:
+            stcp_socket.close()
+
+    def size(self, address, cipher: HKSCipher = None):
+        "Return the number of sockets to the address, which are idle or checked out."
+        with self._available:
+            slot = self._slots.get(self._key(address, cipher or self._cipher))
+            return 0 if slot is None else slot.size
+
+    def close(self):
+        """Close all idle sockets. The checked out sockets are closed when
+        they are released."""
+        with self._available:
+            self._closed = True
+            idle = [stcp_socket for slot in self._slots.values() for stcp_socket, _ in slot.idle]
+            for slot in self._slots.values():
+                slot.size -= len(slot.idle)
+                slot.idle.clear()
+            self._available.notify_all()
+
+        for stcp_socket in idle:
+            stcp_socket.close()
+
+        self._log(StdUsers.DEV, StdLevels.INFO, "Closed.")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -1,114 +1,438 @@
+import os
 import struct
 
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+
 from hks_pylib.cryptography.ciphers.hkscipher import HKSCipher
+from hks_pylib.cryptography.ciphers.symmetrics import AES_CTR
 from hks_pylib.cryptography.ciphers.cipherid import CipherID, hash_cls_name
 from hkserror.hkserror import HTypeError
 
 from hks_pynetwork.packet import MIN_HEADER_SIZE, PacketEncoder, PacketDecoder
+from hks_pynetwork.compression import Codec, get_codec
+from hks_pynetwork.parallel import AES_BLOCK_SIZE, COUNTER_MODULO, ParallelCrypter
 
 from hks_pynetwork.errors.secure_packet import CipherTypeMismatchError, SecurePacketError
- 
+from hks_pynetwork.errors.secure_packet import BatchFormatError
+
+
+# TYPE_OF_CIPHER (2 bytes) + NUMBER_OF_PARAMS (1 byte)
+SECURE_HEADER_STRUCT = struct.Struct(">2sB")
+
+# Bits of the optional FLAGS field at the end of the secure header. The
+# field is omitted if no flag is set, so the packet is the same as the
+# packet of the older versions.
+FLAG_STREAM = 0x01      # The payload is a chunk of a stream.
+FLAG_STREAM_END = 0x02  # The payload is the last chunk of a stream.
+FLAG_BATCH = 0x04       # The payload is a batch of messages (see pack_batch()).
+FLAG_COMPRESSED = 0x08  # The payload is compressed, the ID of codec follows FLAGS.
+FLAG_SESSION = 0x10     # The payload is encrypted by a session, COUNTER follows.
+
+# The COUNTER field of session packets, it is the number of AES blocks
+# which have been used by the session before the packet.
+SESSION_COUNTER_STRUCT = struct.Struct(">I")
+MAX_SESSION_COUNTER = 2**32
+
+# The payloads which are smaller are not compressed.
+DEFAULT_COMPRESS_THRESHOLD = 512
+
+# The limit of decompressed payloads, it protects the decoder against
+# the small packets which are decompressed to huge payloads.
+DEFAULT_MAX_DECOMPRESSED_SIZE = 2**27
+
+# The size of each message in the payload of a batch packet.
+BATCH_ITEM_STRUCT = struct.Struct(">I")
+
+
+def pack_batch(messages: list) -> bytes:
+    "Pack the messages into the payload of a batch packet."
+    parts = []
+    for message in messages:
+        if not isinstance(message, bytes):
+            raise HTypeError("message", message, bytes)
+
+        parts.append(BATCH_ITEM_STRUCT.pack(len(message)))
+        parts.append(message)
+
+    return b"".join(parts)
+
+
+def unpack_batch(payload: bytes) -> list:
+    "Return the messages which are packed in the payload of a batch packet."
+    messages = []
+    current_index = 0
+    while current_index < len(payload):
+        if current_index + BATCH_ITEM_STRUCT.size > len(payload):
+            raise BatchFormatError("Incomplete size of batch item.")
+
+        size, = BATCH_ITEM_STRUCT.unpack_from(payload, current_index)
+        current_index += BATCH_ITEM_STRUCT.size
+
+        if current_index + size > len(payload):
+            raise BatchFormatError("Incomplete batch item.")
+
+        messages.append(payload[current_index: current_index + size])
+        current_index += size
+
+    return messages
+
+
+class _SessionKeystream(object):
+    # The AES_CTR keystream of a session. The packet whose COUNTER is N is
+    # encrypted with the nonce (session nonce + N), each packet uses whole
+    # blocks. The context is only created again if a packet is skipped.
+    def __init__(self, key: bytes, nonce: bytes):
+        self._key = key
+        self._nonce = int.from_bytes(nonce, "big")
+        self._context = None
+        self.counter = 0
+
+    def seek(self, counter: int):
+        if self._context is not None and counter == self.counter:
+            return
+
+        nonce = (self._nonce + counter) % COUNTER_MODULO
+        self._context = Cipher(
+                algorithms.AES(self._key),
+                modes.CTR(nonce.to_bytes(AES_BLOCK_SIZE, "big")),
+                default_backend()
+            ).encryptor()
+        self.counter = counter
+
+    def crypt(self, data: bytes, crypter: ParallelCrypter = None) -> bytes:
+        # The caller must seek() before. The data is processed by crypter
+        # if it is given.
+        blocks = -(-len(data) // AES_BLOCK_SIZE)
+        if crypter is not None:
+            nonce = (self._nonce + self.counter) % COUNTER_MODULO
+            data = crypter.crypt_counter(self._key, nonce, data)
+            self._context = None
+        else:
+            remainder = len(data) % AES_BLOCK_SIZE
+            data = self._context.update(data)
+            if remainder:
+                # Drop the rest of the last block.
+                self._context.update(bytes(AES_BLOCK_SIZE - remainder))
+
+        self.counter += blocks
+        return data
+
 
 class SecurePacketEncoder(PacketEncoder):
-    def __init__(self, cipher: HKSCipher):
+    def __init__(
+                    self,
+                    cipher: HKSCipher,
+                    compressor: Codec = None,
+                    compress_threshold: int = DEFAULT_COMPRESS_THRESHOLD,
+                    crypter: ParallelCrypter = None,
+                    session: bool = False,
+                    max_decompressed_size: int = DEFAULT_MAX_DECOMPRESSED_SIZE
+                ):
+        """If compressor is given, the payloads which have at least
+        compress_threshold bytes are compressed before being encrypted,
+        unless the compression doesn't reduce their size. The payloads
+        which are not smaller than max_decompressed_size are never
+        compressed, because the decoder with the same limit would reject
+        them (see SecurePacketDecoder). Note that the
+        size of a compressed packet depends on its content, so secrets
+        which are mixed with the data of attacker may be guessed.
+
+        If crypter is given, the large payloads are encrypted by it.
+
+        If session is True (only AES_CTR), the nonce is only sent in the
+        first packet and the next packets carry a 4-byte counter instead,
+        the cipher is not reset before each packet. The decoder must
+        receive the packets in order, as they are sent over a stream."""
         if not isinstance(cipher, HKSCipher):
             raise HTypeError("cipher", cipher, HKSCipher)
 
+        if compressor is not None and not isinstance(compressor, Codec):
+            raise HTypeError("compressor", compressor, Codec, None)
+
+        if not isinstance(compress_threshold, int):
+            raise HTypeError("compress_threshold", compress_threshold, int)
+
+        if crypter is not None and not isinstance(crypter, ParallelCrypter):
+            raise HTypeError("crypter", crypter, ParallelCrypter, None)
+
+        if not isinstance(session, bool):
+            raise HTypeError("session", session, bool)
+
+        if not isinstance(max_decompressed_size, int):
+            raise HTypeError("max_decompressed_size", max_decompressed_size, int)
+
+        if session and type(cipher) is not AES_CTR:
+            raise HTypeError("cipher", cipher, AES_CTR)
+
         self.cipher = cipher
+        self._compressor = compressor
+        self._compress_threshold = compress_threshold
+        self._max_decompressed_size = max_decompressed_size
+        self._crypter = crypter
+        self._session = session
+        self._keystream = None
+
+        # hash_cls_name() shares its hash objects between all threads, so it
+        # is only called here if the cipher class has not been registered.
+        cipher_hashvalue = CipherID.cls2hash(type(cipher)) or hash_cls_name(cipher)
+        self._secure_header_prefix = SECURE_HEADER_STRUCT.pack(
+                cipher_hashvalue,
+                cipher._number_of_params
+            )
+
+        # The secure header of session packets which do not carry the nonce.
+        self._session_header_prefix = SECURE_HEADER_STRUCT.pack(cipher_hashvalue, 0)
 
-    def encode(self, payload: bytes):
+    def encode_parts(self, payload: bytes, flags: int = 0):
         if not isinstance(payload, bytes):
             raise HTypeError("payload", payload, bytes)
 
-        payload = self.cipher.encrypt(payload)
-        packet = super().encode(payload)
+        if not isinstance(flags, int):
+            raise HTypeError("flags", flags, int)
+
+        if not 0 <= flags <= 255:
+            raise SecurePacketError("Flags must be in range [0, 255].")
+
+        if flags & (FLAG_COMPRESSED | FLAG_SESSION):
+            raise SecurePacketError("Flags FLAG_COMPRESSED and FLAG_SESSION "
+            "are set by the encoder.")
+
+        if self._compressor is not None\
+            and self._compress_threshold <= len(payload) < self._max_decompressed_size:
+            compressed_payload = self._compressor.compress(payload)
+            if len(compressed_payload) < len(payload):
+                payload = compressed_payload
+                flags |= FLAG_COMPRESSED
+
+        if self._session:
+            return self._encode_session_parts(payload, flags)
+
+        crypter = self._parallel_crypter(len(payload))
+        if crypter is not None:
+            payload = crypter.crypt(self.cipher, payload)
+        else:
+            payload = self.cipher.encrypt(payload)
 
         # SECURE HEADER = TYPE_OF_CIPHER (2 bytes) + NUMBER_OF_PARAMS(1 byte)
         #                 + PARAM1_SIZE + PARAM1 + PARAM2_SIZE + PARAM2 + ...
+        #                 + FLAGS (1 byte, optional) + CODEC_ID (1 byte, optional)
         # TYPE_OF_CIPHER is the hash value of the cipher class
+        # The secure header is the optional header of the packet.
 
-        secure_header = hash_cls_name(self.cipher)\
-            + struct.pack(">B", self.cipher._number_of_params)
-
+        secure_header = [self._secure_header_prefix]
         for i in range(self.cipher._number_of_params):
             param = self.cipher.get_param(i)
 
             if not isinstance(param, bytes):
                 raise SecurePacketError("Paramter of cipher must be bytes object.")
 
-            param_size = len(param)
-            param_struct = "B{}s".format(param_size)
-            secure_header += struct.pack(param_struct, param_size, param)
+            # PARAM_SIZE (1 byte) + PARAM
+            secure_header.append(bytes((len(param),)))
+            secure_header.append(param)
+
+        if flags & FLAG_COMPRESSED:
+            secure_header.append(bytes((flags, self._compressor.ID)))
+        elif flags:
+            secure_header.append(bytes((flags,)))
+
+        secure_header = b"".join(secure_header)
+
+        return [self.encode_header(len(payload), secure_header), payload]
 
-        # Set new header size = old header size + secure header size
-        old_header_size = struct.unpack(">H", packet[:2])[0]
-        
-        packet = packet[:old_header_size]\
-            + secure_header\
-            + packet[old_header_size:]
-        
-        new_header_size = old_header_size + len(secure_header)
-        new_header_size = struct.pack(">H", new_header_size)
+    def _parallel_crypter(self, size: int):
+        if self._crypter is not None and self._crypter.supports(self.cipher, size):
+            return self._crypter
 
-        # Return the packet with new header size
-        return new_header_size + packet[2:]
+        return None
+
+    @property
+    def session(self) -> bool:
+        "If it is True, the cipher must not be reset before each packet."
+        return self._session
+
+    def _encode_session_parts(self, payload: bytes, flags: int):
+        # SECURE HEADER = TYPE_OF_CIPHER (2 bytes) + NUMBER_OF_PARAMS (1 byte)
+        #                 + NONCE_SIZE + NONCE (only in the first packet)
+        #                 + FLAGS (1 byte) + CODEC_ID (1 byte, optional)
+        #                 + COUNTER (4 bytes)
+        blocks = -(-len(payload) // AES_BLOCK_SIZE)
+        if self._keystream is None or self._keystream.counter + blocks > MAX_SESSION_COUNTER:
+            nonce = os.urandom(AES_BLOCK_SIZE)
+            self._keystream = _SessionKeystream(self.cipher._key, nonce)
+            secure_header = [self._secure_header_prefix, bytes((len(nonce),)), nonce]
+        else:
+            secure_header = [self._session_header_prefix]
+
+        flags |= FLAG_SESSION
+        if flags & FLAG_COMPRESSED:
+            secure_header.append(bytes((flags, self._compressor.ID)))
+        else:
+            secure_header.append(bytes((flags,)))
+
+        secure_header.append(SESSION_COUNTER_STRUCT.pack(self._keystream.counter))
+        self._keystream.seek(self._keystream.counter)
+        payload = self._keystream.crypt(payload, self._parallel_crypter(len(payload)))
+
+        return [self.encode_header(len(payload), b"".join(secure_header)), payload]
 
 
 class SecurePacketDecoder(PacketDecoder):
-    def __init__(self, cipher: HKSCipher):
+    def __init__(
+                    self,
+                    cipher: HKSCipher,
+                    max_decompressed_size: int = DEFAULT_MAX_DECOMPRESSED_SIZE,
+                    crypter: ParallelCrypter = None
+                ):
+        """The compressed packets are decompressed by the registered codecs.
+        If crypter is given, the large payloads are decrypted by it. The
+        session packets are always accepted (see SecurePacketEncoder), a
+        session packet whose counter is lower than the expected one or
+        which restarts the session before its counter is exhausted is
+        rejected. Note that the packets are not authenticated, so these
+        checks do not protect against an attacker who can modify the stream."""
         if not isinstance(cipher, HKSCipher):
             raise HTypeError("cipher", cipher, HKSCipher)
 
+        if not isinstance(max_decompressed_size, int):
+            raise HTypeError("max_decompressed_size", max_decompressed_size, int)
+
+        if crypter is not None and not isinstance(crypter, ParallelCrypter):
+            raise HTypeError("crypter", crypter, ParallelCrypter, None)
+
         self.cipher = cipher
+        self._max_decompressed_size = max_decompressed_size
+        self._crypter = crypter
+        self._keystream = None
+
+        self._cipher_hashvalue = CipherID.cls2hash(type(cipher)) or hash_cls_name(cipher)
 
     def decode(self, packet: bytes):
-        if not isinstance(packet, bytes):
-            raise HTypeError("packet", packet, bytes)
+        if not isinstance(packet, (bytes, bytearray, memoryview)):
+            raise HTypeError("packet", packet, bytes, bytearray, memoryview)
 
         packet_dict = super().decode(packet)
+        header_size = packet_dict["header_size"]
+
+        # All fields of the secure header are checked against header_size,
+        # a malformed packet must raise SecurePacketError.
+        if header_size < MIN_HEADER_SIZE + SECURE_HEADER_STRUCT.size:
+            raise SecurePacketError("Secure header is too short.")
 
         # ORIGINAL HEADER = HEADER_SIZE (2 bytes) + PAYLOAD_SIZE (2 byte)
 
         # SECURE HEADER: TYPE_OF_CIPHER (2 bytes) + NUMBER_OF_PARAMS(1 byte)
         #                 + PARAM1_SIZE + PARAM1 + PARAM2_SIZE + PARAM2 + ...
+        #                 + FLAGS (1 byte, optional) + CODEC_ID (1 byte, optional)
 
-        cipher_hashvalue = packet[MIN_HEADER_SIZE: MIN_HEADER_SIZE + 2]
-        cipher_type = CipherID.hash2cls(cipher_hashvalue)
+        cipher_hashvalue, number_of_params = SECURE_HEADER_STRUCT.unpack_from(
+                packet,
+                MIN_HEADER_SIZE
+            )
 
-        if cipher_type is None:
-            raise CipherTypeMismatchError("Cipher type is invalid "
-            "(hash = {}).".format(cipher_hashvalue))
+        # Compare with the hash value of the cipher class first, the cipher
+        # class of packet is only looked up if they are different.
+        if cipher_hashvalue != self._cipher_hashvalue:
+            cipher_type = CipherID.hash2cls(cipher_hashvalue)
 
-        if not isinstance(self.cipher, cipher_type):
-            raise CipherTypeMismatchError("Cipher type mismatches "
-            "(expected {}, but received {}).".format(
-                type(self.cipher).__name__,
-                cipher_type.__name__
-            ))
+            if cipher_type is None:
+                raise CipherTypeMismatchError("Cipher type is invalid "
+                "(hash = {}).".format(cipher_hashvalue))
 
-        number_of_params = struct.unpack(
-                ">B",
-                packet[MIN_HEADER_SIZE + 2: MIN_HEADER_SIZE + 3]
-            )[0]
+            if not isinstance(self.cipher, cipher_type):
+                raise CipherTypeMismatchError("Cipher type mismatches "
+                "(expected {}, but received {}).".format(
+                    type(self.cipher).__name__,
+                    cipher_type.__name__
+                ))
 
-        current_index = MIN_HEADER_SIZE + 3
+        current_index = MIN_HEADER_SIZE + SECURE_HEADER_STRUCT.size
+        params = []
         for i in range(number_of_params):
-            param_size = struct.unpack(
-                    ">B",
-                    packet[current_index: current_index + 1]
-                )[0]
+            if current_index >= header_size:
+                raise SecurePacketError("Missing size of cipher parameter.")
+
+            param_size = packet[current_index]
             current_index += 1
 
-            param = struct.unpack(
-                    ">{}s".format(param_size),
-                    packet[current_index: current_index + param_size]
-                )[0]
+            if current_index + param_size > header_size:
+                raise SecurePacketError("Cipher parameter exceeds the header.")
+
+            params.append(bytes(packet[current_index: current_index + param_size]))
             current_index += param_size
 
-            self.cipher.set_param(i, param)
+        if current_index < header_size:
+            packet_dict["flags"] = packet[current_index]
+            current_index += 1
+        else:
+            packet_dict["flags"] = 0
+
+        codec = None
+        if packet_dict["flags"] & FLAG_COMPRESSED:
+            if current_index >= header_size:
+                raise SecurePacketError("Missing codec of compressed packet.")
+
+            codec = get_codec(packet[current_index])
+            current_index += 1
+
+        # The cipher only accepts bytes, this is the only copy of the payload.
+        payload = bytes(packet_dict["payload"])
+        if packet_dict["flags"] & FLAG_SESSION:
+            if current_index + SESSION_COUNTER_STRUCT.size > header_size:
+                raise SecurePacketError("Missing counter of session packet.")
+
+            counter, = SESSION_COUNTER_STRUCT.unpack_from(packet, current_index)
+            packet_dict["payload"] = self._decrypt_session(params, counter, payload)
+        else:
+            for i, param in enumerate(params):
+                self.cipher.set_param(i, param)
+
+            self.cipher.reset(False)
 
-        self.cipher.reset(False)
+            crypter = self._parallel_crypter(len(payload))
+            if crypter is not None:
+                packet_dict["payload"] = crypter.crypt(self.cipher, payload)
+            else:
+                packet_dict["payload"] = self.cipher.decrypt(payload)
 
-        packet_dict["payload"] = self.cipher.decrypt(packet_dict["payload"])
+        if codec is not None:
+            packet_dict["payload"] = codec.decompress(
+                packet_dict["payload"],
+                self._max_decompressed_size
+            )
 
         return packet_dict
+
+    def _decrypt_session(self, params: list, counter: int, payload: bytes) -> bytes:
+        if type(self.cipher) is not AES_CTR:
+            raise SecurePacketError("Session packets are only supported by AES_CTR.")
+
+        if params:
+            # The first packet of a new session. The encoder only starts a
+            # new session at first or when the counter would overflow.
+            if len(params) != 1 or len(params[0]) != AES_BLOCK_SIZE:
+                raise SecurePacketError("Invalid nonce of session packet.")
+
+            if counter != 0:
+                raise SecurePacketError("Counter of the first session packet "
+                "expected 0, but received {}.".format(counter))
+
+            blocks = -(-len(payload) // AES_BLOCK_SIZE)
+            if self._keystream is not None and self._keystream.counter + blocks <= MAX_SESSION_COUNTER:
+                raise SecurePacketError("Session is restarted before its counter is exhausted.")
+
+            self._keystream = _SessionKeystream(self.cipher._key, params[0])
+        elif self._keystream is None:
+            raise SecurePacketError("Session has not been started.")
+        elif counter < self._keystream.counter:
+            raise SecurePacketError("Counter of session packet is reused "
+            "(expected >= {}, but received {}).".format(self._keystream.counter, counter))
+
+        self._keystream.seek(counter)
+        return self._keystream.crypt(payload, self._parallel_crypter(len(payload)))
+
+    def _parallel_crypter(self, size: int):
+        if self._crypter is not None and self._crypter.supports(self.cipher, size):
+            return self._crypter
+
+        return None
@@ -0,0 +1,436 @@
+import os
+import re
+import stat
+import time
+import random
+import select
+import struct
+import tempfile
+import threading
+
+try:
+    from multiprocessing import shared_memory, resource_tracker
+except ImportError:  # Python < 3.8
+    shared_memory = None
+
+from hks_pylib.logger import LoggerGenerator
+from hks_pylib.logger.logger_generator import InvisibleLoggerGenerator
+from hks_pylib.logger.standard import StdLevels, StdUsers
+from hkserror.hkserror import HFormatError, HTypeError
+
+from hks_pynetwork.internal import ChannelBuffer
+from hks_pynetwork.logger import generate_logger
+
+from hks_pynetwork.errors.internal import ChannelError, ChannelSlotError, ChannelClosedError
+from hks_pynetwork.errors.internal import ChannelBufferFullError, ChannelTimeoutError
+
+
+# HEAD (8 bytes) + TAIL (8 bytes) + CAPACITY (8 bytes) + SOURCE_SIZE (2 bytes),
+# followed by the name of source node. The records start at RING_DATA_OFFSET.
+RING_HEADER_STRUCT = struct.Struct("<QQQH")
+RING_HEAD_OFFSET = 0
+RING_TAIL_OFFSET = 8
+RING_DATA_OFFSET = 288
+MAX_NAME_SIZE = RING_DATA_OFFSET - RING_HEADER_STRUCT.size
+
+POSITION_STRUCT = struct.Struct("<Q")
+RECORD_SIZE_STRUCT = struct.Struct("<I")
+
+# The names of rings, see SharedMemoryNode._connect().
+RING_NAME_PREFIX = "hkspn_"
+RING_NAME_PATTERN = re.compile(rb"hkspn_[0-9a-f]{16}")
+
+
+def _untrack(shm):
+    # The resource tracker of each process unlinks all segments which it
+    # has seen when the process exits, even if they are used by another
+    # process. Segments are unlinked by SharedMemoryNode instead.
+    try:
+        resource_tracker.unregister(shm._name, "shared_memory")
+    except Exception:
+        pass
+
+
+class _Ring(object):
+    """A ring buffer in shared memory with one producer and one consumer.
+
+    The producer only writes HEAD and the consumer only writes TAIL, both
+    of them are positions in a stream of records, so the ring is empty if
+    they are equal. Each record is [SIZE (4 bytes)][MESSAGE]."""
+    def __init__(self, shm):
+        self.shm = shm
+        self.view = shm.buf
+        if len(self.view) < RING_DATA_OFFSET:
+            raise ValueError("The ring is too small.")
+
+        _, _, self.capacity, source_size = RING_HEADER_STRUCT.unpack_from(self.view)
+        if self.capacity <= 0 or RING_DATA_OFFSET + self.capacity > len(self.view)\
+            or source_size > MAX_NAME_SIZE:
+            raise ValueError("The ring header is invalid.")
+
+        self.source = bytes(self.view[RING_HEADER_STRUCT.size:
+            RING_HEADER_STRUCT.size + source_size]).decode()
+
+    @staticmethod
+    def create(name: str, source: str, capacity: int):
+        shm = shared_memory.SharedMemory(name, create=True, size=RING_DATA_OFFSET + capacity)
+        _untrack(shm)
+
+        source = source.encode()
+        RING_HEADER_STRUCT.pack_into(shm.buf, 0, 0, 0, capacity, len(source))
+        shm.buf[RING_HEADER_STRUCT.size: RING_HEADER_STRUCT.size + len(source)] = source
+        return _Ring(shm)
+
+    @staticmethod
+    def attach(name: str):
+        shm = shared_memory.SharedMemory(name)
+        _untrack(shm)
+        try:
+            return _Ring(shm)
+        except Exception:
+            shm.close()
+            raise
+
+    def _position(self, offset):
+        return POSITION_STRUCT.unpack_from(self.view, offset)[0]
+
+    def _copy_in(self, position, data):
+        start = position % self.capacity
+        first = min(len(data), self.capacity - start)
+        self.view[RING_DATA_OFFSET + start: RING_DATA_OFFSET + start + first] = data[:first]
+        if first < len(data):
+            self.view[RING_DATA_OFFSET: RING_DATA_OFFSET + len(data) - first] = data[first:]
+
+    def _copy_out(self, position, size):
+        start = position % self.capacity
+        first = min(size, self.capacity - start)
+        data = bytes(self.view[RING_DATA_OFFSET + start: RING_DATA_OFFSET + start + first])
+        if first < size:
+            data += bytes(self.view[RING_DATA_OFFSET: RING_DATA_OFFSET + size - first])
+        return data
+
+    def write(self, message: bytes):
+        """Append a record and return True if the ring was empty, so the
+        consumer may be sleeping, or None if there is not enough space."""
+        head = self._position(RING_HEAD_OFFSET)
+        tail = self._position(RING_TAIL_OFFSET)
+
+        record_size = RECORD_SIZE_STRUCT.size + len(message)
+        if self.capacity - (head - tail) < record_size:
+            return None
+
+        self._copy_in(head, RECORD_SIZE_STRUCT.pack(len(message)))
+        self._copy_in(head + RECORD_SIZE_STRUCT.size, message)
+
+        # Publish the record after it has been written completely.
+        POSITION_STRUCT.pack_into(self.view, RING_HEAD_OFFSET, head + record_size)
+
+        # Read TAIL again, the consumer may have drained the ring meanwhile.
+        return self._position(RING_TAIL_OFFSET) == head
+
+    def read_all(self) -> list:
+        messages = []
+        tail = self._position(RING_TAIL_OFFSET)
+        while True:
+            head = self._position(RING_HEAD_OFFSET)
+            if tail == head:
+                return messages
+
+            while tail < head:
+                size, = RECORD_SIZE_STRUCT.unpack(self._copy_out(tail, RECORD_SIZE_STRUCT.size))
+                messages.append((self._copy_out(tail + RECORD_SIZE_STRUCT.size, size), None))
+                tail += RECORD_SIZE_STRUCT.size + size
+
+            # Check HEAD again after TAIL is published, the producer doesn't
+            # wake us up if it has seen the ring which is not empty.
+            POSITION_STRUCT.pack_into(self.view, RING_TAIL_OFFSET, tail)
+
+    def unlink(self):
+        # SharedMemory.unlink() also unregisters the segment from the
+        # resource tracker, see _untrack().
+        resource_tracker.register(self.shm._name, "shared_memory")
+        try:
+            self.shm.unlink()
+        except FileNotFoundError:
+            resource_tracker.unregister(self.shm._name, "shared_memory")
+
+    def close(self):
+        self.view = None
+        self.shm.close()
+
+
+class SharedMemoryNode(object):
+    """A node which exchanges messages with nodes of other processes in
+    the same host through shared memory.
+
+    Each pair of source and destination uses a ring buffer in shared
+    memory, the messages are copied into the ring by the sender and out
+    of it by the receiver. The receiver is only woken up by its FIFO in
+    DIRECTORY if the ring was empty. DIRECTORY is private to the user,
+    so only the processes of the same user can communicate. The names of
+    nodes are unique in the host, the FIFO which is left by a killed
+    process must be removed before its name is used again."""
+    DIRECTORY = os.path.join(tempfile.gettempdir(), "hks_pynetwork-{}".format(
+        os.getuid() if hasattr(os, "getuid") else 0))
+    DEFAULT_RING_SIZE = 2**20
+
+    # The time between two scans of all rings when there is no notification.
+    SCAN_INTERVAL = 0.1
+
+    def __init__(
+                    self,
+                    name: str = None,
+                    logger_generator: LoggerGenerator = InvisibleLoggerGenerator(),
+                    display: dict = {},
+                    ring_size: int = DEFAULT_RING_SIZE
+                ):
+        if shared_memory is None or not hasattr(os, "mkfifo"):
+            raise ChannelError("Shared memory node is not supported by this platform.")
+
+        if name is not None and not isinstance(name, str):
+            raise HTypeError("name", name, str, None)
+
+        if name is not None and (not name or len(name.encode()) > MAX_NAME_SIZE\
+            or "/" in name or "\0" in name):
+            raise HFormatError("Parameter name expected a non-empty string without "
+            "'/' which is at most {} bytes.".format(MAX_NAME_SIZE))
+
+        if not isinstance(logger_generator, LoggerGenerator):
+            raise HTypeError("logger_generator", logger_generator, LoggerGenerator)
+
+        if not isinstance(display, dict):
+            raise HTypeError("display", display, dict)
+
+        if not isinstance(ring_size, int):
+            raise HTypeError("ring_size", ring_size, int)
+
+        if ring_size <= RECORD_SIZE_STRUCT.size:
+            raise HFormatError("Parameter ring_size is too small.")
+
+        SharedMemoryNode._make_directory()
+
+        while True:
+            node_name = name or str(random.randint(1000000, 9999999))
+            try:
+                os.mkfifo(SharedMemoryNode._fifo_path(node_name))
+                break
+            except FileExistsError:
+                if name is not None:
+                    raise ChannelSlotError(f"Name {name} is in use.")
+
+        self.name = node_name
+        self._ring_size = ring_size
+
+        # The FIFO is opened for reading and writing, so that opening
+        # doesn't block and reading doesn't return EOF without writers.
+        self._fifo = os.open(SharedMemoryNode._fifo_path(self.name), os.O_RDWR | os.O_NONBLOCK)
+        self._fifo_data = b""
+
+        self._outgoing = {}  # destination name -> (ring, ring name, FIFO of destination)
+        self._incoming = {}  # ring name -> ring
+        self._buffer = ChannelBuffer()
+        self._closed = False
+
+        self.__send_lock = threading.Lock()
+        self.__recv_lock = threading.Lock()
+
+        self._log = generate_logger(logger_generator, self.name, display)
+        self._log(StdUsers.DEV, StdLevels.INFO,
+        "{} join to Shared Memory Nodes.", self.name)
+
+    @staticmethod
+    def _make_directory():
+        # Other users could announce their rings or spoof the source
+        # names if they could write the FIFOs.
+        try:
+            os.mkdir(SharedMemoryNode.DIRECTORY, 0o700)
+        except FileExistsError:
+            pass
+
+        info = os.lstat(SharedMemoryNode.DIRECTORY)
+        if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid()\
+            or info.st_mode & 0o077:
+            raise ChannelError("Directory {} must be owned by the user and "
+            "only accessible by it.".format(SharedMemoryNode.DIRECTORY))
+
+    @staticmethod
+    def _fifo_path(name: str):
+        return os.path.join(SharedMemoryNode.DIRECTORY, name + ".fifo")
+
+    def _connect(self, destination: str):
+        # The caller must hold the send lock.
+        try:
+            fifo = os.open(SharedMemoryNode._fifo_path(destination), os.O_WRONLY | os.O_NONBLOCK)
+        except OSError:
+            raise ChannelSlotError(f"Channel name {destination} doesn't exist.")
+
+        ring_name = RING_NAME_PREFIX + os.urandom(8).hex()
+        ring = _Ring.create(ring_name, self.name, self._ring_size)
+        self._outgoing[destination] = (ring, ring_name, fifo)
+        return self._outgoing[destination]
+
+    def _notify(self, fifo, ring_name: str):
+        try:
+            os.write(fifo, ring_name.encode() + b"\n")
+        except BlockingIOError:
+            # The FIFO is full of notifications, the receiver will read it.
+            pass
+        except BrokenPipeError:
+            raise ChannelSlotError("The destination node has been closed.")
+
+    def send(self, destination: str, message: bytes, timeout: float = None):
+        """Send a message to the node which has the destination name. If
+        the ring is full, wait until the receiver reads it or raise
+        ChannelBufferFullError after timeout seconds."""
+        if not isinstance(destination, str):
+            raise HTypeError("destination", destination, str)
+
+        if not isinstance(message, (bytes, bytearray, memoryview)):
+            raise HTypeError("message", message, bytes, bytearray, memoryview)
+
+        if RECORD_SIZE_STRUCT.size + len(message) > self._ring_size:
+            raise HFormatError("Parameter message is larger than the ring.")
+
+        with self.__send_lock:
+            if self._closed:
+                raise ChannelClosedError("Channel closed.")
+
+            connection = self._outgoing.get(destination)
+            if connection is None:
+                connection = self._connect(destination)
+            ring, ring_name, fifo = connection
+
+            deadline = None if timeout is None else time.monotonic() + timeout
+            delay = 0.0001
+            while True:
+                was_empty = ring.write(message)
+                if was_empty is not None:
+                    break
+
+                if not os.path.exists(SharedMemoryNode._fifo_path(destination)):
+                    raise ChannelSlotError("The destination node has been closed.")
+
+                if deadline is not None and time.monotonic() >= deadline:
+                    raise ChannelBufferFullError("The ring is still full "
+                    "after {} seconds.".format(timeout))
+
+                # The receiver doesn't notify the sender, so wait by polling.
+                time.sleep(delay)
+                delay = min(delay * 2, 0.01)
+
+            if was_empty:
+                self._notify(fifo, ring_name)
+
+    def _read_notifications(self):
+        # Attach the rings which are announced by the senders.
+        try:
+            while True:
+                data = os.read(self._fifo, 65536)
+                if not data:
+                    break
+                self._fifo_data += data
+        except BlockingIOError:
+            pass
+
+        *ring_names, self._fifo_data = self._fifo_data.split(b"\n")
+        for ring_name in ring_names:
+            if not ring_name:  # Sent by close().
+                continue
+
+            if not RING_NAME_PATTERN.fullmatch(ring_name):
+                self._log(StdUsers.DEV, StdLevels.WARNING, "Ignore an "
+                "invalid notification {!r}.", ring_name[:64])
+                continue
+
+            ring_name = ring_name.decode()
+            if ring_name in self._incoming:
+                continue
+
+            try:
+                ring = _Ring.attach(ring_name)
+            except FileNotFoundError:
+                self._log(StdUsers.DEV, StdLevels.WARNING, "The ring "
+                "{} has been removed.", ring_name)
+                continue
+            except (OSError, ValueError, struct.error) as e:
+                self._log(StdUsers.DEV, StdLevels.WARNING, "Ignore "
+                "the invalid ring {} ({}).", ring_name, e)
+                continue
+
+            # Both parties have mapped the ring, so its name is not needed.
+            ring.unlink()
+            self._incoming[ring_name] = ring
+
+    def _drain(self):
+        for ring in self._incoming.values():
+            messages = ring.read_all()
+            if messages:
+                self._buffer.push_many(ring.source, messages)
+
+    def recv(self, source: str = None, timeout: float = None):
+        """Return (source, message, None) of the first message, or of the
+        first message of source if it is given. Raise ChannelTimeoutError
+        if there is no message after timeout seconds (None means forever)."""
+        if source is not None and not isinstance(source, str):
+            raise HTypeError("source", source, str, None)
+
+        with self.__recv_lock:
+            deadline = None if timeout is None else time.monotonic() + timeout
+            while True:
+                if self._closed:
+                    raise ChannelClosedError("Channel closed.")
+
+                source_name, message, obj = self._buffer.pop(source)
+                if message is not None:
+                    return source_name, message, obj
+
+                self._read_notifications()
+                self._drain()
+
+                # The messages of other sources may be buffered, so wait
+                # unless there is one which can be returned.
+                source_name, message, obj = self._buffer.pop(source)
+                if message is not None:
+                    return source_name, message, obj
+
+                wait_time = SharedMemoryNode.SCAN_INTERVAL
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise ChannelTimeoutError("No message after {} seconds.".format(timeout))
+                    wait_time = min(wait_time, remaining)
+
+                select.select([self._fifo], [], [], wait_time)
+
+    def close(self):
+        with self.__send_lock:
+            if self._closed:
+                return
+
+            self._closed = True
+
+            # Wake up the receiver, it raises ChannelClosedError.
+            self._notify(self._fifo, "")
+
+            for destination, (ring, ring_name, fifo) in self._outgoing.items():
+                os.close(fifo)
+
+                # The ring is unlinked by the receiver when it is attached.
+                if not os.path.exists(SharedMemoryNode._fifo_path(destination)):
+                    ring.unlink()
+                ring.close()
+            self._outgoing.clear()
+
+        with self.__recv_lock:
+            os.unlink(SharedMemoryNode._fifo_path(self.name))
+
+            # Unlink the rings which have been announced but not attached.
+            self._read_notifications()
+            os.close(self._fifo)
+
+            for ring in self._incoming.values():
+                ring.close()
+            self._incoming.clear()
+
+        self._log(StdUsers.DEV, StdLevels.INFO,
+        "{} leaves Shared Memory Nodes.", self.name)
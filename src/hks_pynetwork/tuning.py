@@ -0,0 +1,161 @@
+import socket
+
+from hkserror.hkserror import HFormatError, HTypeError
+
+from hks_pynetwork.errors.tuning import UnknownProfileError
+
+
+# The families whose sockets have TCP options.
+TCP_FAMILIES = tuple(
+    getattr(socket, family) for family in ("AF_INET", "AF_INET6")
+    if hasattr(socket, family)
+)
+
+
+class AdaptiveReadSize(object):
+    """The size of the next read of a socket. It follows the exponentially
+    weighted moving average of the received sizes, which are the sizes of
+    messages if they are not sent back to back. A read which fills the
+    whole size means that more data is waiting, so the size is doubled."""
+    ALPHA = 0.25
+
+    def __init__(self, initial: int, minimum: int, maximum: int):
+        self._minimum = minimum
+        self._maximum = maximum
+        self.size = max(minimum, min(initial, maximum))
+        self._average = float(self.size)
+
+    def update(self, received: int):
+        if received >= self.size:
+            self._average = float(received)
+            self.size = min(self.size * 2, self._maximum)
+            return
+
+        self._average += (received - self._average) * AdaptiveReadSize.ALPHA
+        self.size = max(self._minimum, min(int(self._average * 2), self._maximum))
+
+
+class TuningProfile(object):
+    """The socket options, the listen backlog and the read sizes of
+    STCPSocket and STCPServer. The options which are None are not set, so
+    the defaults of the system are kept. TCP_NODELAY and SO_KEEPALIVE are
+    only set on TCP sockets.
+
+    If min_read_size and max_read_size are given, the read size adapts
+    to the received data in this range (see AdaptiveReadSize), otherwise
+    buffer_size of the socket is always read."""
+    def __init__(
+                    self,
+                    name: str,
+                    rcvbuf: int = None,
+                    sndbuf: int = None,
+                    nodelay: bool = None,
+                    keepalive: bool = None,
+                    backlog: int = None,
+                    min_read_size: int = None,
+                    max_read_size: int = None
+                ):
+        if not isinstance(name, str):
+            raise HTypeError("name", name, str)
+
+        for param, value in (("rcvbuf", rcvbuf), ("sndbuf", sndbuf), ("backlog", backlog)):
+            if value is not None and not isinstance(value, int):
+                raise HTypeError(param, value, int, None)
+
+            if value is not None and value < 0:
+                raise HFormatError("Parameter {} expected a non-negative integer.".format(param))
+
+        for param, value in (("nodelay", nodelay), ("keepalive", keepalive)):
+            if value is not None and not isinstance(value, bool):
+                raise HTypeError(param, value, bool, None)
+
+        if (min_read_size is None) != (max_read_size is None):
+            raise HFormatError("Parameters min_read_size and max_read_size "
+            "expected to be both given or both None.")
+
+        if min_read_size is not None:
+            if not isinstance(min_read_size, int):
+                raise HTypeError("min_read_size", min_read_size, int, None)
+
+            if not isinstance(max_read_size, int):
+                raise HTypeError("max_read_size", max_read_size, int, None)
+
+            if not 0 < min_read_size <= max_read_size:
+                raise HFormatError("Parameters expected 0 < min_read_size <= max_read_size.")
+
+        self.name = name
+        self.rcvbuf = rcvbuf
+        self.sndbuf = sndbuf
+        self.nodelay = nodelay
+        self.keepalive = keepalive
+        self.backlog = backlog
+        self.min_read_size = min_read_size
+        self.max_read_size = max_read_size
+
+    def apply(self, sock: socket.socket):
+        "Set the options of the socket."
+        if self.rcvbuf is not None:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.rcvbuf)
+
+        if self.sndbuf is not None:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.sndbuf)
+
+        if sock.family not in TCP_FAMILIES:
+            return
+
+        if self.nodelay is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, int(self.nodelay))
+
+        if self.keepalive is not None:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, int(self.keepalive))
+
+    def read_size(self, buffer_size: int) -> AdaptiveReadSize:
+        "Return the AdaptiveReadSize of a socket or None if it is fixed."
+        if self.min_read_size is None:
+            return None
+
+        return AdaptiveReadSize(buffer_size, self.min_read_size, self.max_read_size)
+
+
+_profiles = {}
+
+
+def register_profile(profile: TuningProfile):
+    "Register a profile, so that it can be used by its name."
+    if not isinstance(profile, TuningProfile):
+        raise HTypeError("profile", profile, TuningProfile)
+
+    _profiles[profile.name] = profile
+
+
+def get_profile(name: str) -> TuningProfile:
+    profile = _profiles.get(name)
+    if profile is None:
+        raise UnknownProfileError("Profile {} is not registered.".format(name))
+
+    return profile
+
+
+# The options of the system, the same as no profile.
+register_profile(TuningProfile("default"))
+
+# Small messages which are sent as soon as possible.
+register_profile(TuningProfile(
+    "low-latency",
+    nodelay=True,
+    keepalive=True,
+    backlog=128,
+    min_read_size=2**10,
+    max_read_size=2**16
+))
+
+# Large messages, the kernel buffers allow a large TCP window.
+register_profile(TuningProfile(
+    "bulk-throughput",
+    rcvbuf=2**22,
+    sndbuf=2**22,
+    keepalive=True,
+    backlog=128,
+    min_read_size=2**16,
+    max_read_size=2**20
+))
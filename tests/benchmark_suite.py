@@ -0,0 +1,249 @@
+"""The microbenchmarks of codecs and buffers.
+
+Run it from the root of repository:
+
+    PYTHONPATH=src python tests/benchmark_suite.py --output result.json
+    PYTHONPATH=src python tests/benchmark_suite.py --baseline result.json
+
+Each benchmark is run over a matrix of payload sizes and reports ops/s,
+MB/s (of payload) and the peak memory which is allocated by one
+operation. With --baseline, the results are compared with a saved JSON
+file and the exit code is 1 if any of them is slower than the threshold."""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tracemalloc
+
+from hks_pylib.logger import StandardLoggerGenerator
+from hks_pylib.cryptography.ciphers.symmetrics import AES_CTR, AES_CBC
+
+from hks_pynetwork.packet import PacketEncoder, PacketDecoder
+from hks_pynetwork.secure_packet import SecurePacketEncoder, SecurePacketDecoder
+from hks_pynetwork.packet_buffer import PacketBuffer
+from hks_pynetwork.internal import ChannelBuffer
+
+
+PAYLOAD_SIZES = (64, 1024, 16384, 262144, 2**20)
+CHUNK_SIZES = (1024, 16384, 65536)
+CIPHERS = (AES_CTR, AES_CBC)
+
+# The minimum time of each measurement and the number of measurements,
+# the best one is reported.
+MIN_TIME = 0.2
+REPEAT = 3
+
+# A benchmark is a regression if its ops/s is lower than the baseline
+# by more than this ratio.
+DEFAULT_THRESHOLD = 0.1
+
+KEY = os.urandom(32)
+
+logger_generator = StandardLoggerGenerator(os.devnull)
+
+
+def measure(function, ops_per_call: int = 1, min_time: float = MIN_TIME, repeat: int = REPEAT):
+    """Return (ops/s, peak bytes of one call). The function is called
+    until min_time seconds, the best of repeat measurements is returned."""
+    function()
+
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time / 10:
+            break
+        number *= 10
+
+    number = max(1, int(number * min_time / elapsed))
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    # Tracing is started for each case, so the peak is the peak of this
+    # call (tracemalloc.reset_peak() requires Python 3.9).
+    tracemalloc.start()
+    try:
+        current, _ = tracemalloc.get_traced_memory()
+        function()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return number * ops_per_call / best, max(peak - current, 0)
+
+
+def bench_packet(payload_size: int, **kwargs):
+    payload = os.urandom(payload_size)
+    encoder, decoder = PacketEncoder(), PacketDecoder()
+    packet = encoder.encode(payload)
+
+    yield "PacketEncoder.encode", measure(lambda: encoder.encode(payload), **kwargs)
+    yield "PacketDecoder.decode", measure(lambda: decoder.decode(packet), **kwargs)
+
+
+def bench_secure_packet(payload_size: int, **kwargs):
+    payload = os.urandom(payload_size)
+    for cipher_type in CIPHERS:
+        encoder = SecurePacketEncoder(cipher_type(KEY))
+        decoder = SecurePacketDecoder(cipher_type(KEY))
+
+        def encode():
+            # The cipher is reset before each packet as STCPSocket.send() does.
+            encoder.cipher.reset()
+            return encoder.encode(payload)
+
+        packet = encode()
+
+        name = cipher_type.__name__
+        yield "SecurePacketEncoder.encode[{}]".format(name), measure(encode, **kwargs)
+        yield "SecurePacketDecoder.decode[{}]".format(name), measure(
+            lambda: decoder.decode(packet), **kwargs)
+
+
+def bench_packet_buffer(payload_size: int, **kwargs):
+    # A stream of packets is pushed chunk by chunk and every complete
+    # packet is popped after each push, as STCPSocket does.
+    encoder = PacketEncoder()
+    n_packets = max(1, 2**20 // payload_size)
+    stream = b"".join(encoder.encode(os.urandom(payload_size)) for _ in range(n_packets))
+
+    for chunk_size in CHUNK_SIZES:
+        view = memoryview(stream)
+        chunks = [view[i: i + chunk_size] for i in range(0, len(stream), chunk_size)]
+
+        buffer = PacketBuffer(PacketDecoder(), "Benchmark", logger_generator)
+
+        def reassemble():
+            count = 0
+            for chunk in chunks:
+                buffer.push(chunk)
+                count += len(buffer.pop_many())
+            assert count == n_packets
+
+        name = "PacketBuffer.reassemble[chunk={}]".format(chunk_size)
+        yield name, measure(reassemble, ops_per_call=n_packets, **kwargs)
+
+
+def bench_channel_buffer(payload_size: int, **kwargs):
+    message = os.urandom(payload_size)
+    buffer = ChannelBuffer()
+
+    def push_pop():
+        for _ in range(100):
+            buffer.push("source", message)
+        for _ in range(100):
+            buffer.pop()
+
+    yield "ChannelBuffer.push_pop", measure(push_pop, ops_per_call=100, **kwargs)
+
+    def push_pop_source():
+        for i in range(100):
+            buffer.push(str(i % 4), message)
+        for i in range(100):
+            buffer.pop(str(i % 4))
+
+    yield "ChannelBuffer.push_pop[source]", measure(push_pop_source, ops_per_call=100, **kwargs)
+
+
+BENCHMARKS = {
+    "packet": bench_packet,
+    "secure_packet": bench_secure_packet,
+    "packet_buffer": bench_packet_buffer,
+    "channel_buffer": bench_channel_buffer,
+}
+
+
+def run(names=None, payload_sizes=PAYLOAD_SIZES, min_time: float = MIN_TIME,
+        repeat: int = REPEAT, verbose: bool = True) -> dict:
+    "Run the benchmarks and return the JSON-serializable result."
+    results = []
+    for name in names or BENCHMARKS:
+        for payload_size in payload_sizes:
+            for key, (ops, peak) in BENCHMARKS[name](
+                    payload_size, min_time=min_time, repeat=repeat):
+                result = {
+                    "benchmark": "{}/{}".format(key, payload_size),
+                    "payload_size": payload_size,
+                    "ops_per_sec": ops,
+                    "mb_per_sec": ops * payload_size / 10**6,
+                    "peak_bytes": peak
+                }
+                results.append(result)
+
+                if verbose:
+                    print("{:<50} {:>14,.0f} ops/s {:>10.1f} MB/s {:>12,} B".format(
+                        result["benchmark"], ops, result["mb_per_sec"], peak))
+
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "results": results
+    }
+
+
+def compare(result: dict, baseline: dict, threshold: float = DEFAULT_THRESHOLD) -> list:
+    """Return the list of (benchmark, baseline ops/s, current ops/s) which
+    are slower than the baseline by more than threshold."""
+    baseline_ops = {r["benchmark"]: r["ops_per_sec"] for r in baseline["results"]}
+
+    regressions = []
+    for r in result["results"]:
+        expected = baseline_ops.get(r["benchmark"])
+        if expected is not None and r["ops_per_sec"] < expected * (1 - threshold):
+            regressions.append((r["benchmark"], expected, r["ops_per_sec"]))
+
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("benchmarks", nargs="*",
+        help="the benchmarks to run: {} (default: all)".format(", ".join(BENCHMARKS)))
+    parser.add_argument("--sizes", type=int, nargs="+", default=PAYLOAD_SIZES,
+        help="the payload sizes in bytes")
+    parser.add_argument("--min-time", type=float, default=MIN_TIME)
+    parser.add_argument("--repeat", type=int, default=REPEAT)
+    parser.add_argument("--output", help="write the result to this JSON file")
+    parser.add_argument("--baseline", help="compare with this JSON file")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+        help="the tolerated slowdown ratio (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    for name in args.benchmarks:
+        if name not in BENCHMARKS:
+            parser.error("unknown benchmark {}".format(name))
+
+    result = run(args.benchmarks, args.sizes, args.min_time, args.repeat)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(result, json.load(f), args.threshold)
+
+        for benchmark, expected, ops in regressions:
+            print("REGRESSION {}: {:,.0f} -> {:,.0f} ops/s ({:+.1%})".format(
+                benchmark, expected, ops, ops / expected - 1))
+
+        if regressions:
+            return 1
+
+        print("No regression (threshold {:.0%}).".format(args.threshold))
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
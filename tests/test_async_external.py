@@ -0,0 +1,136 @@
+import os
+import random
+import tempfile
+import asyncio
+import threading
+
+from hks_pylib.logger import Display
+from hks_pylib.logger import StandardLoggerGenerator
+from hks_pylib.logger.standard import StdUsers
+from hks_pylib.cryptography.ciphers.symmetrics import AES_CTR
+
+from hks_pynetwork.external import STCPSocket
+from hks_pynetwork.async_external import open_connection, start_server
+from hks_pynetwork.errors.external import STCPSocketClosedError
+
+
+logger_generator = StandardLoggerGenerator("tests/test_async_external.log")
+DISPLAY = {StdUsers.USER: Display.ALL, StdUsers.DEV: Display.ALL}
+KEY = os.urandom(32)
+N_SAMPLE_DATA = random.randint(10, 20)
+SAMPLE_DATA_LIST = [os.urandom(random.randint(100, 200)) for _ in range(N_SAMPLE_DATA)]
+
+
+async def echo(socket):
+    async for data in socket:
+        await socket.send(data)
+    socket.close()
+
+
+def test_async_client_server():
+    async def main():
+        server = await start_server(echo, ("127.0.0.1", 0), AES_CTR(KEY),
+            "Server", logger_generator, DISPLAY)
+        address = server.sockets[0].getsockname()
+
+        async def client():
+            socket = await open_connection(address, AES_CTR(KEY),
+                "Client", logger_generator, DISPLAY)
+            async with socket:
+                for data in SAMPLE_DATA_LIST:
+                    await socket.send(data)
+                    assert await socket.recv() == data
+
+        await asyncio.gather(*(client() for _ in range(10)))
+
+        server.close()
+        await server.wait_closed()
+
+    asyncio.run(main())
+
+
+def test_async_server_with_stcp_socket():
+    # The asyncio server must be compatible with the blocking STCPSocket.
+    async def main():
+        server = await start_server(echo, ("127.0.0.1", 0), AES_CTR(KEY),
+            "Server", logger_generator, DISPLAY)
+        address = server.sockets[0].getsockname()
+
+        received = []
+
+        def client():
+            socket = STCPSocket(AES_CTR(KEY), "Client", 1024, logger_generator, DISPLAY)
+            socket.connect(address)
+            for data in SAMPLE_DATA_LIST:
+                socket.send(data)
+                received.append(socket.recv())
+            socket.close()
+
+        t = threading.Thread(target=client)
+        t.start()
+        while t.is_alive():
+            await asyncio.sleep(0.01)
+
+        server.close()
+        await server.wait_closed()
+
+        assert received == SAMPLE_DATA_LIST
+
+    asyncio.run(main())
+
+
+def test_async_unix_socket():
+    async def main():
+        path = os.path.join(tempfile.mkdtemp(), "stcp.sock")
+        server = await start_server(echo, path, AES_CTR(KEY),
+            "Server", logger_generator, DISPLAY)
+
+        socket = await open_connection(path, AES_CTR(KEY),
+            "Client", logger_generator, DISPLAY)
+        async with socket:
+            for data in SAMPLE_DATA_LIST:
+                await socket.send(data)
+                assert await socket.recv() == data
+
+        server.close()
+        await server.wait_closed()
+
+    asyncio.run(main())
+
+
+def test_async_paused_senders():
+    async def main():
+        server = await start_server(echo, ("127.0.0.1", 0), AES_CTR(KEY),
+            "Server", logger_generator, DISPLAY)
+        address = server.sockets[0].getsockname()
+
+        socket = await open_connection(address, AES_CTR(KEY),
+            "Client", logger_generator, DISPLAY)
+
+        # All senders which wait for the paused transport are released.
+        socket._pause_writing()
+        senders = [asyncio.ensure_future(socket.send(data)) for data in SAMPLE_DATA_LIST]
+        await asyncio.sleep(0.01)
+        assert not any(sender.done() for sender in senders)
+
+        socket._resume_writing()
+        await asyncio.wait_for(asyncio.gather(*senders), 5)
+        for data in SAMPLE_DATA_LIST:
+            assert await socket.recv() == data
+
+        # They fail if the connection is lost.
+        socket._pause_writing()
+        senders = [asyncio.ensure_future(socket.send(data)) for data in SAMPLE_DATA_LIST[:2]]
+        await asyncio.sleep(0.01)
+        socket.close()
+        for sender in senders:
+            try:
+                await asyncio.wait_for(sender, 5)
+                assert False
+            except STCPSocketClosedError:
+                pass
+
+        server.close()
+        await server.wait_closed()
+
+    asyncio.run(main())
@@ -0,0 +1,101 @@
+import os
+import time
+
+from hks_pylib.cryptography.ciphers.symmetrics import AES_CTR, NoCipher
+
+from hks_pynetwork.packet import PacketEncoder, PacketDecoder
+from hks_pynetwork.secure_packet import SecurePacketEncoder, SecurePacketDecoder
+from hks_pynetwork.parallel import ParallelCrypter
+
+
+KEY = os.urandom(32)
+
+N_LOOPS = 10000
+
+PAYLOAD = os.urandom(64)
+
+
+def best_time(function, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(N_LOOPS):
+            function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    return best / N_LOOPS * 10**6
+
+
+def benchmark(name, encoder, decoder):
+    cipher = getattr(encoder, "cipher", None)
+
+    def encode():
+        # The cipher is reset before each packet as STCPSocket.send() does.
+        if cipher is not None:
+            cipher.reset()
+        return encoder.encode(PAYLOAD)
+
+    packet = encode()
+
+    print("{}: encode {:.2f} us/op, decode {:.2f} us/op".format(
+        name,
+        best_time(encode),
+        best_time(lambda: decoder.decode(packet))
+    ))
+
+
+def test_benchmark_packet():
+    benchmark("Packet", PacketEncoder(), PacketDecoder())
+
+
+def test_benchmark_secure_packet():
+    # NoCipher shows the overhead of the secure header only.
+    benchmark(
+        "SecurePacket (NoCipher)",
+        SecurePacketEncoder(NoCipher()),
+        SecurePacketDecoder(NoCipher())
+    )
+
+    benchmark(
+        "SecurePacket (AES_CTR)",
+        SecurePacketEncoder(AES_CTR(KEY)),
+        SecurePacketDecoder(AES_CTR(KEY))
+    )
+
+
+def test_benchmark_parallel_crypter():
+    payload = os.urandom(2**25)
+    cipher = AES_CTR(KEY)
+    cipher.reset()
+
+    def serial():
+        cipher.reset(False)
+        return cipher.encrypt(payload)
+
+    expected = serial()
+    for max_workers in (1, 2, 4, 8):
+        with ParallelCrypter(max_workers=max_workers) as crypter:
+            assert crypter.crypt(cipher, payload) == expected
+
+            start = time.perf_counter()
+            crypter.crypt(cipher, payload)
+            parallel_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        serial()
+        serial_time = time.perf_counter() - start
+
+        print("ParallelCrypter (AES_CTR, 32 MB, {} workers, {} CPUs): "
+            "{:.1f} ms, serial {:.1f} ms".format(
+                max_workers,
+                os.cpu_count(),
+                parallel_time * 1000,
+                serial_time * 1000
+            ))
+
+
+if __name__ == "__main__":
+    test_benchmark_packet()
+    test_benchmark_secure_packet()
+    test_benchmark_parallel_crypter()
@@ -0,0 +1,35 @@
+import os
+import json
+import tempfile
+
+from benchmark_suite import BENCHMARKS, compare, main, run
+
+
+def test_benchmark_suite():
+    # A quick run of all benchmarks, it only checks the result format.
+    result = run(payload_sizes=(1024,), min_time=0.001, repeat=1, verbose=False)
+    names = {r["benchmark"] for r in result["results"]}
+    assert "SecurePacketDecoder.decode[AES_CBC]/1024" in names
+    assert "PacketBuffer.reassemble[chunk=65536]/1024" in names
+    assert len(names) == len(result["results"])
+
+    for r in result["results"]:
+        assert r["ops_per_sec"] > 0
+        assert r["mb_per_sec"] == r["ops_per_sec"] * 1024 / 10**6
+        assert r["peak_bytes"] >= 0
+
+    # A benchmark which is slower than the baseline by 50% is a regression.
+    baseline = json.loads(json.dumps(result))
+    baseline["results"][0]["ops_per_sec"] *= 2
+    regressions = compare(result, baseline, threshold=0.1)
+    assert [r[0] for r in regressions] == [result["results"][0]["benchmark"]]
+    assert compare(result, result) == []
+
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, "result.json")
+    argv = ["channel_buffer", "--sizes", "64", "--min-time", "0.001", "--repeat", "1"]
+    assert main(argv + ["--output", path]) == 0
+    with open(path) as f:
+        assert len(json.load(f)["results"]) == 2
+
+    assert main(argv + ["--baseline", path, "--threshold", "0.99"]) == 0
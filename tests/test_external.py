@@ -1,9 +1,15 @@
+import io
 import os
+import socket as pysocket
+import tempfile
+import time
 from hks_pylib.logger.standard import StdUsers
 from hks_pylib.logger import Display
 import random
 import threading
-from hks_pynetwork.external import STCPSocket
+from hks_pynetwork.external import STCPSocket, STCPServer
+from hks_pynetwork.errors.external import STCPSocketTimeoutError
+from hks_pynetwork.errors.packet import BufferSizeError
 from hks_pylib.cryptography.ciphers.symmetrics import AES_CTR, AES_CBC
 from hks_pylib.logger import StandardLoggerGenerator
  
@@ -72,5 +78,419 @@ def test_client_server():
     t1.join()
     t2.join()
 
+
+def test_recv_many():
+    server = STCPSocket(
+        cipher=AES_CTR(KEY),
+        name="Server",
+        buffer_size=1024,
+        logger_generator=logger_generator,
+        display={StdUsers.USER: Display.ALL, StdUsers.DEV: Display.ALL}
+    )
+    server.bind(("127.0.0.1", 0))
+    server.listen()
+    address = server._socket.getsockname()
+
+    def client():
+        client = STCPSocket(
+            cipher=AES_CTR(KEY),
+            name="Client",
+            buffer_size=1024,
+            logger_generator=logger_generator,
+            display={StdUsers.USER: Display.ALL, StdUsers.DEV: Display.ALL}
+        )
+        client.connect(address)
+        for data in CLIENT_SAMPLE_DATA_LIST:
+            client.sendall(data)
+        client.recv()
+        client.close()
+
+    t = threading.Thread(target=client)
+    t.start()
+
+    socket, _ = server.accept()
+    received = []
+    while len(received) < len(CLIENT_SAMPLE_DATA_LIST):
+        received.extend(socket.recv_many(max_count=4))
+
+    socket.send(b"done")
+    t.join()
+    socket.close()
+    server.close()
+
+    assert received == CLIENT_SAMPLE_DATA_LIST
+
+
+def test_recv_timeout():
+    server = STCPSocket(
+        cipher=AES_CTR(KEY),
+        name="Server",
+        buffer_size=1024,
+        logger_generator=logger_generator,
+        display={StdUsers.USER: Display.ALL, StdUsers.DEV: Display.ALL}
+    )
+    server.bind(("127.0.0.1", 0))
+    server.listen()
+
+    client = STCPSocket(
+        cipher=AES_CTR(KEY),
+        name="Client",
+        buffer_size=1024,
+        logger_generator=logger_generator,
+        display={StdUsers.USER: Display.ALL, StdUsers.DEV: Display.ALL}
+    )
+    client.connect(server._socket.getsockname())
+    socket, _ = server.accept()
+
+    socket.set_recv_timeout(0.3)
+    start = time.monotonic()
+    try:
+        socket.recv()
+        assert False
+    except STCPSocketTimeoutError:
+        elapsed = time.monotonic() - start
+        assert 0.3 <= elapsed < 0.5
+
+    client.send(CLIENT_SAMPLE_DATA_LIST[0])
+    assert socket.recv() == CLIENT_SAMPLE_DATA_LIST[0]
+
+    client.close()
+    socket.close()
+    server.close()
+
+
+def test_recv_backpressure():
+    server = STCPSocket(
+        cipher=AES_CTR(KEY),
+        name="Server",
+        buffer_size=1024,
+        logger_generator=logger_generator,
+        display={StdUsers.USER: Display.ALL, StdUsers.DEV: Display.ALL},
+        max_buffer_bytes=16384
+    )
+    server.bind(("127.0.0.1", 0))
+    server.listen()
+
+    client = STCPSocket(
+        cipher=AES_CTR(KEY),
+        name="Client",
+        buffer_size=1024,
+        logger_generator=logger_generator,
+        display={StdUsers.USER: Display.ALL, StdUsers.DEV: Display.ALL}
+    )
+    client.connect(server._socket.getsockname())
+    socket, _ = server.accept()
+
+    messages = [os.urandom(1000) for _ in range(500)]
+    sender = threading.Thread(target=lambda: [client.send(m) for m in messages])
+    sender.start()
+    time.sleep(0.5)
+
+    # The rest of data is kept in the kernel buffers.
+    assert len(socket._STCPSocket__buffer) < 16384 + 1024 + 2048
+
+    received = []
+    while len(received) < len(messages):
+        received.extend(socket.recv_many())
+    sender.join()
+    assert received == messages
+
+    client.close()
+    socket.close()
+    server.close()
+
+
+def test_stcp_server():
+    def echo(connection, data):
+        connection.send(data)
+
+    server = STCPServer(
+        cipher=AES_CTR(KEY),
+        name="Server",
+        buffer_size=1024,
+        on_message=echo,
+        logger_generator=logger_generator,
+        display={StdUsers.USER: Display.ALL, StdUsers.DEV: Display.ALL}
+    )
+    server.bind(("127.0.0.1", 0))
+    server.listen()
+    t = threading.Thread(target=server.serve_forever)
+    t.start()
+
+    clients = []
+    for _ in range(10):
+        client = STCPSocket(
+            cipher=AES_CTR(KEY),
+            name="Client",
+            buffer_size=1024,
+            logger_generator=logger_generator,
+            display={StdUsers.USER: Display.ALL, StdUsers.DEV: Display.ALL}
+        )
+        client.connect(server.getsockname())
+        clients.append(client)
+
+    errors = []
+    for data in CLIENT_SAMPLE_DATA_LIST:
+        for client in clients:
+            client.send(data)
+        for client in clients:
+            if client.recv() != data:
+                errors.append("ERROR CLIENT DATA NOT MATCH")
+
+    for client in clients:
+        client.close()
+
+    server.shutdown()
+    t.join()
+
+    assert not errors
+
+
+def test_stcp_server_queue():
+    server = STCPServer(
+        cipher=AES_CTR(KEY),
+        name="Server",
+        buffer_size=1024,
+        logger_generator=logger_generator,
+        display={StdUsers.USER: Display.ALL, StdUsers.DEV: Display.ALL}
+    )
+    server.bind(("127.0.0.1", 0))
+    server.listen()
+    t = threading.Thread(target=server.serve_forever)
+    t.start()
+
+    client = STCPSocket(
+        cipher=AES_CTR(KEY),
+        name="Client",
+        buffer_size=1024,
+        logger_generator=logger_generator,
+        display={StdUsers.USER: Display.ALL, StdUsers.DEV: Display.ALL}
+    )
+    client.connect(server.getsockname())
+    for data in CLIENT_SAMPLE_DATA_LIST:
+        client.send(data)
+
+    for data in CLIENT_SAMPLE_DATA_LIST:
+        connection, received = server.recv(timeout=5)
+        assert received == data
+
+    connection.send(SERVER_SAMPLE_DATA_LIST[0])
+    assert client.recv() == SERVER_SAMPLE_DATA_LIST[0]
+
+    client.close()
+    server.shutdown()
+    t.join()
+
+
+def test_stream():
+    server = STCPSocket(
+        cipher=AES_CTR(KEY),
+        name="Server",
+        buffer_size=1024,
+        logger_generator=logger_generator,
+        display={StdUsers.USER: Display.ALL, StdUsers.DEV: Display.ALL}
+    )
+    server.bind(("127.0.0.1", 0))
+    server.listen()
+
+    client = STCPSocket(
+        cipher=AES_CTR(KEY),
+        name="Client",
+        buffer_size=1024,
+        logger_generator=logger_generator,
+        display={StdUsers.USER: Display.ALL, StdUsers.DEV: Display.ALL}
+    )
+    client.connect(server._socket.getsockname())
+    socket, _ = server.accept()
+
+    data = os.urandom(10**6 + 1)
+
+    def send():
+        client.send_stream(data, chunk_size=10**5)
+        client.send_stream(io.BytesIO(data))
+        client.send_stream([data[:10], data[10:]], chunk_size=10**5)
+        client.send(data[:100])
+
+    t = threading.Thread(target=send)
+    t.start()
+
+    chunks = list(socket.recv_stream())
+    assert len(chunks) == 11
+    assert max(len(chunk) for chunk in chunks) == 10**5
+    assert b"".join(chunks) == data
+
+    assert b"".join(socket.recv_stream()) == data
+    assert b"".join(socket.recv_stream()) == data
+    assert list(socket.recv_stream()) == [data[:100]]
+
+    t.join()
+    client.close()
+    socket.close()
+    server.close()
+
+
+def test_unix_socket():
+    path = os.path.join(tempfile.mkdtemp(), "stcp.sock")
+    server = STCPSocket(
+        cipher=AES_CTR(KEY),
+        name="Server",
+        buffer_size=1024,
+        logger_generator=logger_generator,
+        display={StdUsers.USER: Display.ALL, StdUsers.DEV: Display.ALL},
+        family=pysocket.AF_UNIX
+    )
+    server.bind(path)
+    server.listen()
+
+    client = STCPSocket(
+        cipher=AES_CTR(KEY),
+        name="Client",
+        buffer_size=1024,
+        logger_generator=logger_generator,
+        display={StdUsers.USER: Display.ALL, StdUsers.DEV: Display.ALL},
+        family=pysocket.AF_UNIX
+    )
+    client.connect(path)
+    socket, _ = server.accept()
+
+    for client_data, server_data in zip(CLIENT_SAMPLE_DATA_LIST, SERVER_SAMPLE_DATA_LIST):
+        client.send(client_data)
+        assert socket.recv() == client_data
+        socket.send(server_data)
+        assert client.recv() == server_data
+
+    client.close()
+    socket.close()
+    server.close()
+
+    # The selector-based server accepts unix sockets too.
+    os.remove(path)
+    server = STCPServer(AES_CTR(KEY), "Server", 1024,
+        logger_generator=logger_generator, family=pysocket.AF_UNIX)
+    server.bind(path)
+    server.listen()
+    t = threading.Thread(target=server.serve_forever)
+    t.start()
+
+    client = STCPSocket(AES_CTR(KEY), "Client", 1024, logger_generator,
+        family=pysocket.AF_UNIX)
+    client.connect(path)
+    client.send(CLIENT_SAMPLE_DATA_LIST[0])
+    connection, received = server.recv(timeout=5)
+    assert received == CLIENT_SAMPLE_DATA_LIST[0]
+
+    client.close()
+    server.shutdown()
+    t.join()
+
+
+def test_compression():
+    from hks_pynetwork.compression import ZlibCodec
+
+    server = STCPSocket(AES_CTR(KEY), "Server", 1024, logger_generator,
+        compressor=ZlibCodec())
+    server.bind(("127.0.0.1", 0))
+    server.listen()
+
+    client = STCPSocket(AES_CTR(KEY), "Client", 1024, logger_generator,
+        compressor=ZlibCodec(), compress_threshold=64)
+    client.connect(server._socket.getsockname())
+    socket, _ = server.accept()
+
+    data = b"compressible data " * 1000
+    for message in (data, CLIENT_SAMPLE_DATA_LIST[0], b"x" * 100):
+        client.send(message)
+        assert socket.recv() == message
+
+        socket.send(message)
+        assert client.recv() == message
+
+    client.close()
+    socket.close()
+    server.close()
+
+
+def test_session():
+    server = STCPServer(AES_CTR(KEY), "Server", 1024,
+        logger_generator=logger_generator, session=True)
+    server.bind(("127.0.0.1", 0))
+    server.listen()
+    t = threading.Thread(target=server.serve_forever)
+    t.start()
+
+    client = STCPSocket(AES_CTR(KEY), "Client", 1024, logger_generator, session=True)
+    client.connect(server.getsockname())
+
+    for client_data, server_data in zip(CLIENT_SAMPLE_DATA_LIST, SERVER_SAMPLE_DATA_LIST):
+        client.send(client_data)
+        connection, received = server.recv(timeout=5)
+        assert received == client_data
+
+        connection.send(server_data)
+        assert client.recv() == server_data
+
+    client.close()
+    server.shutdown()
+    t.join()
+
+
+def test_recv_into():
+    server = STCPServer(AES_CTR(KEY), "Server", 1024, logger_generator=logger_generator)
+    server.bind(("127.0.0.1", 0))
+    server.listen()
+    t = threading.Thread(target=server.serve_forever)
+    t.start()
+
+    client = STCPSocket(AES_CTR(KEY), "Client", 1024, logger_generator)
+    client.connect(server.getsockname())
+    client.send(b"hello")
+    connection, _ = server.recv(timeout=5)
+
+    memory = bytearray(max(len(data) for data in SERVER_SAMPLE_DATA_LIST))
+    for server_data in SERVER_SAMPLE_DATA_LIST:
+        connection.send(server_data)
+        size = client.recv_into(memory)
+        assert memory[:size] == server_data
+
+    connection.send(b"too large")
+    try:
+        client.recv_into(bytearray(4))
+        assert False
+    except BufferSizeError:
+        pass
+    assert client.recv() == b"too large"
+
+    client.close()
+    server.shutdown()
+    t.join()
+
+
+def test_stcp_server_malformed_packet():
+    import struct
+
+    server = STCPServer(AES_CTR(KEY), "Server", 1024, logger_generator=logger_generator)
+    server.bind(("127.0.0.1", 0))
+    server.listen()
+    t = threading.Thread(target=server.serve_forever)
+    t.start()
+
+    for packet in (struct.pack(">HI", 6, 0), struct.pack(">HI", 0, 0)):
+        attacker = pysocket.create_connection(server.getsockname())
+        attacker.sendall(packet)
+
+        # The server is still serving the other clients.
+        client = STCPSocket(AES_CTR(KEY), "Client", 1024, logger_generator)
+        client.connect(server.getsockname())
+        client.send(b"hello")
+        connection, received = server.recv(timeout=5)
+        assert received == b"hello"
+
+        client.close()
+        attacker.close()
+
+    server.shutdown()
+    t.join()
+
+
 if __name__ == "__main__":
-    client()
\ No newline at end of file
+    client()
@@ -1,13 +1,16 @@
 import os
 import random
 import threading
+import multiprocessing
 from hks_pylib.logger.logger import Display
 
 from hks_pylib.logger.standard import StdUsers
 
-from hks_pynetwork.internal import LocalNode, ForwardNode
+from hks_pynetwork.internal import ChannelBuffer, LocalNode, ForwardNode, ForwardHub
 from hks_pylib.logger import StandardLoggerGenerator
 from hks_pynetwork.external import STCPSocket
+from hks_pynetwork.metrics import MetricsRegistry
+from hks_pynetwork.errors.internal import ChannelSlotError, ChannelBufferFullError
 from hks_pylib.cryptography.ciphers.symmetrics import AES_CTR, AES_CBC
  
 logger_generator = StandardLoggerGenerator("tests/test_internal.log")
@@ -138,3 +141,330 @@ def test_forwardnode():
     t2.start()
     t1.join()
     t2.join()
+
+
+def test_channel_buffer():
+    buffer = ChannelBuffer()
+    messages = [("NODE{}".format(i % 3), os.urandom(10)) for i in range(300)]
+    for source, message in messages:
+        buffer.push(source, message)
+
+    # Selective pops keep the order of each source.
+    expected = [message for source, message in messages if source == "NODE1"]
+    for message in expected[:50]:
+        assert buffer.pop("NODE1") == ("NODE1", message, None)
+
+    remaining = [m for m in messages if m[0] != "NODE1"] + \
+        [("NODE1", message) for message in expected[50:]]
+    assert len(buffer) == len(remaining)
+
+    # Other pops keep the arrival order and skip the popped messages.
+    received = []
+    while len(buffer) > 0:
+        source, message, _ = buffer.pop()
+        received.append((source, message))
+
+    assert sorted(received) == sorted(remaining)
+    assert [m for m in received if m[0] == "NODE0"] == [m for m in messages if m[0] == "NODE0"]
+    assert buffer.pop() == (None, None, None)
+    assert buffer.pop("NODE2") == (None, None, None)
+
+
+def test_node_registry():
+    nodes = [LocalNode("REGISTRY{}".format(i), logger_generator) for i in range(100)]
+
+    sender = LocalNode(logger_generator=logger_generator)
+    destination = LocalNode.lookup("REGISTRY42")
+    assert destination is nodes[42]
+
+    sender.send(destination, b"by handle")
+    sender.send("REGISTRY42", b"by name")
+    assert nodes[42].recv() == (sender.name, b"by handle", None)
+    assert nodes[42].recv(sender.name) == (sender.name, b"by name", None)
+
+    nodes[42].close()
+    try:
+        sender.send(destination, b"closed")
+        assert False
+    except ChannelSlotError:
+        pass
+
+    try:
+        LocalNode.lookup("REGISTRY42")
+        assert False
+    except ChannelSlotError:
+        pass
+
+    for node in nodes:
+        node.close()
+    sender.close()
+
+    LocalNode.MAX_NODES = len(LocalNode.nodes) + 1
+    try:
+        node = LocalNode("REGISTRY_FULL_1", logger_generator)
+        try:
+            LocalNode("REGISTRY_FULL_2", logger_generator)
+            assert False
+        except ChannelSlotError:
+            pass
+        node.close()
+    finally:
+        LocalNode.MAX_NODES = None
+
+
+def test_channel_buffer_limits():
+    buffer = ChannelBuffer(max_messages=3, policy=ChannelBuffer.RAISE)
+    for i in range(3):
+        buffer.push("NODE", bytes([i]))
+    try:
+        buffer.push("NODE", b"full")
+        assert False
+    except ChannelBufferFullError:
+        pass
+
+    buffer = ChannelBuffer(max_bytes=10, policy=ChannelBuffer.DROP_OLDEST)
+    for i in range(5):
+        buffer.push("NODE{}".format(i % 2), bytes([i]) * 4)
+    assert len(buffer) == 2 and buffer.nbytes() == 8
+    assert buffer.pop() == ("NODE1", bytes([3]) * 4, None)
+    assert buffer.pop("NODE0") == ("NODE0", bytes([4]) * 4, None)
+
+    # A message which is larger than max_bytes is accepted by an empty buffer.
+    buffer.push("NODE", b"x" * 100)
+    assert buffer.pop() == ("NODE", b"x" * 100, None)
+
+    buffer = ChannelBuffer(max_messages=1)
+    buffer.push("NODE", b"first")
+    try:
+        buffer.push("NODE", b"timeout", timeout=0.1)
+        assert False
+    except ChannelBufferFullError:
+        pass
+
+    # The blocked producer continues after the consumer pops a message.
+    producer = threading.Thread(target=buffer.push, args=("NODE", b"second"))
+    producer.start()
+    producer.join(0.1)
+    assert producer.is_alive()
+    assert buffer.pop() == ("NODE", b"first", None)
+    producer.join(1)
+    assert not producer.is_alive()
+    assert buffer.pop() == ("NODE", b"second", None)
+
+
+def test_node_backpressure():
+    receiver = LocalNode("BOUNDED_RECEIVER", logger_generator, max_messages=2)
+    sender = LocalNode(logger_generator=logger_generator)
+
+    def send_all():
+        for i in range(10):
+            sender.send("BOUNDED_RECEIVER", bytes([i]))
+
+    producer = threading.Thread(target=send_all)
+    producer.start()
+    producer.join(0.2)
+    assert producer.is_alive() and len(receiver._buffer) == 2
+
+    for i in range(10):
+        assert receiver.recv() == (sender.name, bytes([i]), None)
+    producer.join(1)
+    assert not producer.is_alive()
+
+    # Closing the receiver releases the blocked sender.
+    for i in range(2):
+        sender.send("BOUNDED_RECEIVER", b"fill")
+    errors = []
+    def send_closed():
+        try:
+            sender.send("BOUNDED_RECEIVER", b"blocked")
+        except ChannelSlotError as e:
+            errors.append(e)
+    producer = threading.Thread(target=send_closed)
+    producer.start()
+    producer.join(0.1)
+    receiver.close()
+    producer.join(1)
+    assert not producer.is_alive() and len(errors) == 1
+
+    sender.close()
+
+
+def test_send_many_and_multicast():
+    receivers = [LocalNode("FANOUT{}".format(i), logger_generator) for i in range(50)]
+    sender = LocalNode(logger_generator=logger_generator)
+
+    sender.multicast([node.name for node in receivers], b"event", "obj")
+    for node in receivers:
+        assert node.recv() == (sender.name, b"event", "obj")
+
+    sender.send_many([("FANOUT1", b"1"), (receivers[2], b"2", 2), ("FANOUT1", b"3")])
+    assert receivers[1].recv() == (sender.name, b"1", None)
+    assert receivers[1].recv() == (sender.name, b"3", None)
+    assert receivers[2].recv() == (sender.name, b"2", 2)
+
+    # Nothing is sent if a destination doesn't exist.
+    try:
+        sender.send_many([("FANOUT3", b"lost"), ("FANOUT_UNKNOWN", b"lost")])
+        assert False
+    except ChannelSlotError:
+        pass
+    assert len(receivers[3]._buffer) == 0
+
+    for node in receivers:
+        node.close()
+    sender.close()
+
+
+def test_send_many_backpressure():
+    receiver = LocalNode("BATCH_RECEIVER", logger_generator, max_messages=3)
+    sender = LocalNode(logger_generator=logger_generator)
+
+    # The receiver is woken up while the batch is blocked by the full buffer.
+    messages = [("BATCH_RECEIVER", bytes([i])) for i in range(10)]
+    producer = threading.Thread(target=sender.send_many, args=(messages,))
+    producer.start()
+    for i in range(10):
+        assert receiver.recv() == (sender.name, bytes([i]), None)
+    producer.join(1)
+    assert not producer.is_alive()
+
+    receiver.close()
+    sender.close()
+
+
+def test_forward_batch():
+    server = STCPSocket(AES_CTR(KEY), "Server", 1024, logger_generator)
+    server.bind(("127.0.0.1", 0))
+    server.listen()
+
+    client = STCPSocket(AES_CTR(KEY), "Client", 1024, logger_generator)
+    client.connect(server._socket.getsockname())
+    socket, _ = server.accept()
+
+    batches = []
+    send_batch = client.send_batch
+    def count_batch(messages):
+        batches.append(len(messages))
+        return send_batch(messages)
+    client.send_batch = count_batch
+
+    metrics = MetricsRegistry()
+    sender = LocalNode("BATCH_SENDER", logger_generator)
+    receiver = LocalNode("BATCH_REMOTE_RECEIVER", logger_generator)
+    forwarders = [
+        ForwardNode(sender, client, "BATCH_FORWARDER", True, logger_generator,
+            batch_max_bytes=1024, batch_max_delay=0.01, metrics=metrics),
+        ForwardNode(receiver, socket, "BATCH_REMOTE_FORWARDER", True, logger_generator)
+    ]
+    for forwarder in forwarders:
+        threading.Thread(target=forwarder.start).start()
+
+    messages = [os.urandom(random.randint(1, 100)) for _ in range(200)]
+    sender.send_many([("BATCH_FORWARDER", message) for message in messages])
+
+    for message in messages:
+        assert receiver.recv() == ("BATCH_REMOTE_FORWARDER", message, None)
+
+    assert batches and max(batches) > 1
+    assert sum(batches) <= len(messages)
+
+    # The messages in batches are received by the forwarder as by recv().
+    assert metrics.snapshot()["local_node.received_messages"] == len(messages)
+
+    # The forwarders stop and close their nodes when the connection is closed.
+    client.close()
+    server.close()
+
+
+def forward_hub_remote_side(address, key, n_nodes):
+    # Run in another process, because node names are unique in a process.
+    nodes = [LocalNode("HUB_NODE_B{}".format(i), logger_generator) for i in range(n_nodes)]
+
+    client = STCPSocket(AES_CTR(key), "Client", 1024, logger_generator)
+    client.connect(address)
+    hub = ForwardHub(client, "HUB_B", True, logger_generator)
+    for i in range(n_nodes):
+        hub.add_remote("HUB_NODE_A{}".format(i))
+    hub_thread = threading.Thread(target=hub.start)
+    hub_thread.start()
+    for node in nodes:
+        source, message, _ = node.recv()
+        node.send(source, b"reply to " + message)
+
+    hub_thread.join()
+    for node in nodes:
+        node.close()
+
+
+def test_forward_hub():
+    server = STCPSocket(AES_CTR(KEY), "Server", 1024, logger_generator)
+    server.bind(("127.0.0.1", 0))
+    server.listen()
+
+    remote_side = multiprocessing.get_context("spawn").Process(
+        target=forward_hub_remote_side,
+        args=(server._socket.getsockname(), KEY, 20)
+    )
+    remote_side.start()
+    socket, _ = server.accept()
+
+    n_threads = threading.active_count()
+    hub = ForwardHub(socket, "HUB_A", True, logger_generator)
+    hub_thread = threading.Thread(target=hub.start, daemon=True)
+    hub_thread.start()
+
+    nodes_a = [LocalNode("HUB_NODE_A{}".format(i), logger_generator) for i in range(20)]
+    nodes_b = [hub.add_remote("HUB_NODE_B{}".format(i)) for i in range(20)]
+
+    # All nodes share one connection and the threads of the hub.
+    for node_a, node_b in zip(nodes_a, nodes_b):
+        node_a.send(node_b, node_a.name.encode())
+
+    for node_a in nodes_a:
+        source, message, _ = node_a.recv()
+        assert source == node_a.name.replace("_A", "_B")
+        assert message == b"reply to " + node_a.name.encode()
+    assert threading.active_count() == n_threads + 3
+
+    socket.close()
+    hub_thread.join()
+    remote_side.join(10)
+    assert remote_side.exitcode == 0
+    assert "HUB_NODE_B0" not in LocalNode.nodes
+
+    server.close()
+    for node in nodes_a:
+        node.close()
+
+
+def test_forward_hub_unknown_source():
+    from hks_pynetwork.internal import HUB_FRAME_STRUCT
+
+    server = STCPSocket(AES_CTR(KEY), "Server", 1024, logger_generator)
+    server.bind(("127.0.0.1", 0))
+    server.listen()
+    client = STCPSocket(AES_CTR(KEY), "Client", 1024, logger_generator)
+    client.connect(server._socket.getsockname())
+    socket, _ = server.accept()
+
+    hub = ForwardHub(socket, "HUB_C", True, logger_generator)
+    hub.add_remote("HUB_KNOWN")
+    hub_thread = threading.Thread(target=hub.start, daemon=True)
+    hub_thread.start()
+    node = LocalNode("HUB_NODE_C", logger_generator)
+
+    def frame(source, destination, message):
+        return HUB_FRAME_STRUCT.pack(len(source), len(destination)) + source + destination + message
+
+    # The frames of unknown sources are dropped and do not take the names.
+    client.send(frame(b"HUB_UNKNOWN", b"HUB_NODE_C", b"dropped"))
+    client.send(frame(b"HUB_NODE_C", b"HUB_NODE_C", b"dropped"))
+    client.send(frame(b"HUB_KNOWN", b"HUB_NODE_C", b"accepted"))
+    assert node.recv() == ("HUB_KNOWN", b"accepted", None)
+    assert "HUB_UNKNOWN" not in LocalNode.nodes
+    LocalNode("HUB_UNKNOWN").close()
+
+    client.close()
+    hub_thread.join()
+    server.close()
+    node.close()
@@ -0,0 +1,80 @@
+import os
+
+from hks_pylib.logger import LoggerGenerator, StandardLoggerGenerator
+from hks_pylib.logger.logger import BaseLogger, Display
+from hks_pylib.logger.logger_generator import InvisibleLoggerGenerator
+from hks_pylib.logger.standard import StdLevels, StdUsers
+
+from hks_pynetwork.logger import generate_logger
+from hks_pynetwork.packet import PacketDecoder
+from hks_pynetwork.packet_buffer import PacketBuffer
+
+
+LOG_FILE = "tests/test_logger.log"
+logger_generator = StandardLoggerGenerator(LOG_FILE)
+
+
+class Unformattable(object):
+    def __format__(self, spec):
+        raise AssertionError("The disabled record is formatted.")
+
+
+class RecordingLogger(BaseLogger):
+    "A logger which does not have the attributes of hks_pylib loggers."
+    records = []
+
+    def __init__(self, name, display):
+        pass
+
+    def __call__(self, user, level, *values):
+        RecordingLogger.records.append(values)
+
+
+def read_log():
+    if not os.path.exists(LOG_FILE):
+        return ""
+
+    with open(LOG_FILE) as f:
+        return f.read()
+
+
+def test_disabled_logger():
+    for log in (generate_logger(InvisibleLoggerGenerator(), "Test", {}),
+                generate_logger(logger_generator, "Test", {})):
+        assert not log.enabled
+        assert not log.isenabled(StdUsers.DEV, StdLevels.ERROR)
+        log(StdUsers.DEV, StdLevels.ERROR, "Skipped {}.", Unformattable())
+
+    # The default logger generator of PacketBuffer is invisible.
+    PacketBuffer(PacketDecoder(), "Test").push(b"\xff" * 16)
+
+
+def test_enabled_logger():
+    log = generate_logger(logger_generator, "Test", {StdUsers.DEV: [StdLevels.WARNING]})
+    assert log.enabled
+    assert log.isenabled(StdUsers.DEV, StdLevels.WARNING)
+    assert not log.isenabled(StdUsers.DEV, StdLevels.INFO)
+    assert not log.isenabled(StdUsers.USER, StdLevels.WARNING)
+
+    log(StdUsers.DEV, StdLevels.INFO, "Skipped {}.", Unformattable())
+    log(StdUsers.DEV, StdLevels.WARNING, "Emitted {} {{}}.", 42)
+    log(StdUsers.DEV, StdLevels.WARNING, "Not formatted {}.")
+
+    log = generate_logger(logger_generator, "Test", {StdUsers.DEV: Display.ALL})
+    assert log.isenabled(StdUsers.DEV, StdLevels.DEBUG)
+    assert not log.isenabled(StdUsers.USER, StdLevels.INFO)
+
+    content = read_log()
+    assert "Emitted 42 {}." in content
+    assert "Not formatted {}." in content
+    assert "Skipped" not in content
+
+
+def test_unknown_logger():
+    # All records are passed to a logger which is not known.
+    log = generate_logger(LoggerGenerator(RecordingLogger), "Test", {})
+    assert log.enabled
+    assert log.isenabled(StdUsers.DEV, StdLevels.DEBUG)
+
+    log(StdUsers.DEV, StdLevels.DEBUG, "Emitted {}.", 1)
+    assert RecordingLogger.records == [("Emitted 1.",)]
@@ -0,0 +1,116 @@
+import os
+import threading
+
+from hks_pylib.logger import StandardLoggerGenerator
+from hks_pylib.cryptography.ciphers.symmetrics import AES_CTR
+
+from hks_pynetwork.external import STCPSocket, STCPServer
+from hks_pynetwork.internal import ChannelBuffer, LocalNode
+from hks_pynetwork.metrics import MetricsRegistry
+from hks_pynetwork.errors.metrics import MetricsError
+
+
+logger_generator = StandardLoggerGenerator("tests/test_metrics.log")
+KEY = os.urandom(32)
+
+
+def test_metrics_registry():
+    metrics = MetricsRegistry()
+    counter = metrics.counter("a.counter")
+    assert metrics.counter("a.counter") is counter
+    counter.inc()
+    counter.inc(10)
+
+    gauge = metrics.gauge("a.gauge")
+    gauge.inc(5)
+    gauge.dec(2)
+
+    histogram = metrics.histogram("a.histogram")
+    for value in (0, 0.3, 0.5, 0.7, 3):
+        histogram.observe(value)
+
+    try:
+        metrics.gauge("a.counter")
+        assert False
+    except MetricsError:
+        pass
+
+    snapshot = metrics.snapshot()
+    assert snapshot["a.counter"] == 11
+    assert snapshot["a.gauge"] == 3
+    assert snapshot["a.histogram"]["count"] == 5
+    assert snapshot["a.histogram"]["buckets"] == {0.0: 1, 0.5: 1, 1.0: 2, 4.0: 1}
+
+    # The counters are not lost by concurrent updates.
+    threads = [threading.Thread(target=lambda: [counter.inc() for _ in range(10000)])
+        for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert counter.value == 40011
+
+    # The cells of finished threads are folded, so they do not accumulate.
+    histogram.observe(1)
+    for _ in range(100):
+        t = threading.Thread(target=lambda: (counter.inc(), histogram.observe(1)))
+        t.start()
+        t.join()
+    assert counter.value == 40111
+    assert histogram.count == 106
+    assert len(counter._cells) == 1 and len(histogram._cells) == 1
+
+
+def test_local_node_metrics():
+    metrics = MetricsRegistry()
+    node1 = LocalNode("metrics_node1", logger_generator, metrics=metrics)
+    node2 = LocalNode("metrics_node2", logger_generator, metrics=metrics,
+        max_messages=2, policy=ChannelBuffer.DROP_OLDEST)
+
+    node1.send("metrics_node2", b"1")
+    node1.send_many([("metrics_node2", b"22"), ("metrics_node2", b"333")])
+    assert node2.recv()[1] == b"22"
+
+    snapshot = metrics.snapshot()
+    assert snapshot["local_node.sent_messages"] == 3
+    assert snapshot["local_node.sent_bytes"] == 6
+    assert snapshot["local_node.received_messages"] == 1
+    assert snapshot["channel_buffer.dropped_messages"] == 1
+    assert snapshot["channel_buffer.messages"] == 1
+    assert snapshot["channel_buffer.bytes"] == 3
+
+    node1.close()
+    node2.close()
+
+
+def test_stcp_metrics():
+    metrics = MetricsRegistry()
+    server = STCPServer(AES_CTR(KEY), "Server", 1024,
+        on_message=lambda connection, data: connection.send(data),
+        logger_generator=logger_generator, metrics=metrics)
+    server.bind(("127.0.0.1", 0))
+    server.listen()
+    t = threading.Thread(target=server.serve_forever)
+    t.start()
+
+    client = STCPSocket(AES_CTR(KEY), "Client", 1024, logger_generator, metrics=metrics)
+    client.connect(server.getsockname())
+
+    for size in (10, 100, 1000):
+        client.send(os.urandom(size))
+        assert len(client.recv()) == size
+
+    client.close()
+    server.shutdown()
+    t.join()
+
+    snapshot = metrics.snapshot()
+    assert snapshot["stcp_socket.packets_sent"] == 3
+    assert snapshot["stcp_server.packets_sent"] == 3
+    assert snapshot["stcp_socket.bytes_sent"] == snapshot["stcp_server.bytes_received"]
+    assert snapshot["stcp_server.bytes_sent"] == snapshot["stcp_socket.bytes_received"]
+    assert snapshot["stcp_socket.encode_seconds"]["count"] == 3
+    assert snapshot["packet_buffer.decoded_packets"] == 6
+    assert snapshot["packet_buffer.decode_errors"] == 0
+    assert snapshot["packet_buffer.decode_seconds"]["count"] == 6
+    assert snapshot["packet_buffer.unread_bytes"] == 0
@@ -22,4 +22,206 @@ def test_packet_encoder():
         encoder.encode(os.urandom(1111))
         assert True
     except PacketDecodingError:
-        pass
\ No newline at end of file
+        pass
+
+def test_secure_packet_encode_parts():
+    from hks_pylib.cryptography.ciphers.symmetrics import AES_CBC
+    from hks_pynetwork.secure_packet import SecurePacketEncoder, SecurePacketDecoder
+
+    key = os.urandom(32)
+    encoder = SecurePacketEncoder(AES_CBC(key))
+    decoder = SecurePacketDecoder(AES_CBC(key))
+
+    payload = os.urandom(1111)
+    encoder.cipher.reset()
+    header, ciphertext = encoder.encode_parts(payload)
+
+    packet_dict = decoder.decode(header + ciphertext)
+    assert packet_dict["header_size"] == len(header)
+    assert packet_dict["packet_size"] == len(header) + len(ciphertext)
+    assert packet_dict["payload"] == payload
+
+
+def test_secure_packet_malformed_header():
+    import struct
+    from hks_pylib.cryptography.ciphers.symmetrics import AES_CTR
+    from hks_pynetwork.errors.secure_packet import SecurePacketError
+    from hks_pynetwork.secure_packet import SecurePacketEncoder, SecurePacketDecoder
+
+    key = os.urandom(32)
+    decoder = SecurePacketDecoder(AES_CTR(key))
+
+    encoder = SecurePacketEncoder(AES_CTR(key))
+    encoder.cipher.reset()
+    header, _ = encoder.encode_parts(b"payload")
+
+    packets = [
+        struct.pack(">HI", 6, 0),  # No secure header.
+        struct.pack(">HI", 9, 0) + header[6:9],  # No parameter.
+        struct.pack(">HI", 11, 0) + header[6:11],  # Truncated parameter.
+    ]
+    for packet in packets:
+        try:
+            decoder.decode(packet)
+            assert False
+        except SecurePacketError:
+            pass
+
+    try:
+        PacketDecoder().decode(struct.pack(">HI", 0, 0))
+        assert False
+    except PacketSizeError:
+        pass
+
+
+def test_secure_packet_compression():
+    from hks_pylib.cryptography.ciphers.symmetrics import AES_CTR
+    from hks_pynetwork.compression import ZlibCodec, Bz2Codec, LzmaCodec
+    from hks_pynetwork.errors.compression import DecompressionError
+    from hks_pynetwork.secure_packet import FLAG_COMPRESSED
+    from hks_pynetwork.secure_packet import SecurePacketEncoder, SecurePacketDecoder
+
+    key = os.urandom(32)
+    payload = b"hks_pynetwork " * 1000
+
+    for codec in (ZlibCodec(), Bz2Codec(), LzmaCodec()):
+        assert codec.decompress(codec.compress(payload), len(payload)) == payload
+
+        encoder = SecurePacketEncoder(AES_CTR(key), compressor=codec)
+        decoder = SecurePacketDecoder(AES_CTR(key))
+
+        encoder.cipher.reset()
+        packet = b"".join(encoder.encode_parts(payload))
+        assert len(packet) < len(payload) // 10
+
+        packet_dict = decoder.decode(packet)
+        assert packet_dict["flags"] == FLAG_COMPRESSED
+        assert packet_dict["payload"] == payload
+
+    # The small payloads and the incompressible payloads are not compressed.
+    encoder = SecurePacketEncoder(AES_CTR(key), compressor=ZlibCodec())
+    decoder = SecurePacketDecoder(AES_CTR(key))
+    for data in (b"a" * 100, os.urandom(2000)):
+        encoder.cipher.reset()
+        packet_dict = decoder.decode(b"".join(encoder.encode_parts(data)))
+        assert packet_dict["flags"] == 0
+        assert packet_dict["payload"] == data
+
+    # The decoder rejects the payloads which are decompressed too large.
+    decoder = SecurePacketDecoder(AES_CTR(key), max_decompressed_size=len(payload) - 1)
+    encoder.cipher.reset()
+    try:
+        decoder.decode(b"".join(encoder.encode_parts(payload)))
+        assert False
+    except DecompressionError:
+        pass
+
+    # The payloads over the limit are sent without compression, so the
+    # decoder with the same limit accepts them.
+    limit = len(payload) - 1
+    encoder = SecurePacketEncoder(AES_CTR(key), compressor=ZlibCodec(), max_decompressed_size=limit)
+    decoder = SecurePacketDecoder(AES_CTR(key), max_decompressed_size=limit)
+    for data, flags in ((payload[:-2], FLAG_COMPRESSED), (payload, 0)):
+        encoder.cipher.reset()
+        packet_dict = decoder.decode(b"".join(encoder.encode_parts(data)))
+        assert packet_dict["flags"] == flags
+        assert packet_dict["payload"] == data
+
+
+def test_parallel_crypter():
+    from hks_pylib.cryptography.ciphers.symmetrics import AES_CTR
+    from hks_pynetwork.parallel import ParallelCrypter
+    from hks_pynetwork.secure_packet import SecurePacketEncoder, SecurePacketDecoder
+
+    key = os.urandom(32)
+    cipher = AES_CTR(key)
+
+    with ParallelCrypter(max_workers=4, chunk_size=1024, threshold=4096) as crypter:
+        for size in (0, 1, 1024, 5000, 65537):
+            data = os.urandom(size)
+            cipher.reset()
+            # The counter wraps around in the middle of the payload.
+            cipher.set_param(0, b"\xff" * 15 + b"\xf0")
+            assert crypter.crypt(cipher, data) == cipher.encrypt(data)
+
+        # The packets are compatible with the encoders without crypter.
+        payload = os.urandom(100000)
+        for encoder, decoder in [
+            (SecurePacketEncoder(AES_CTR(key), crypter=crypter), SecurePacketDecoder(AES_CTR(key))),
+            (SecurePacketEncoder(AES_CTR(key)), SecurePacketDecoder(AES_CTR(key), crypter=crypter))
+        ]:
+            encoder.cipher.reset()
+            packet = b"".join(encoder.encode_parts(payload))
+            assert decoder.decode(packet)["payload"] == payload
+
+
+def test_secure_packet_session():
+    from hks_pylib.cryptography.ciphers.symmetrics import AES_CTR
+    from hks_pynetwork.compression import ZlibCodec
+    from hks_pynetwork.errors.secure_packet import SecurePacketError
+    from hks_pynetwork.parallel import ParallelCrypter
+    from hks_pynetwork.secure_packet import FLAG_SESSION, FLAG_COMPRESSED
+    from hks_pynetwork.secure_packet import SecurePacketEncoder, SecurePacketDecoder
+
+    key = os.urandom(32)
+    encoder = SecurePacketEncoder(AES_CTR(key), compressor=ZlibCodec(), session=True)
+    decoder = SecurePacketDecoder(AES_CTR(key))
+
+    # The nonce is only sent in the first packet.
+    payloads = [os.urandom(size) for size in (0, 1, 16, 100)] + [b"a" * 1000]
+    packets = [b"".join(encoder.encode_parts(payload)) for payload in payloads]
+    assert len(packets[1]) < len(packets[0])
+
+    for payload, packet in zip(payloads, packets):
+        packet_dict = decoder.decode(packet)
+        assert packet_dict["flags"] & FLAG_SESSION
+        assert packet_dict["payload"] == payload
+    assert packet_dict["flags"] & FLAG_COMPRESSED
+
+    # A skipped packet does not break the next packets, a replayed packet
+    # is rejected.
+    packets = [b"".join(encoder.encode_parts(payload)) for payload in payloads]
+    assert decoder.decode(packets[1])["payload"] == payloads[1]
+    assert decoder.decode(packets[3])["payload"] == payloads[3]
+    try:
+        decoder.decode(packets[2])
+        assert False
+    except SecurePacketError:
+        pass
+
+    # A new decoder can not decode the packets without the nonce.
+    try:
+        SecurePacketDecoder(AES_CTR(key)).decode(packets[4])
+        assert False
+    except SecurePacketError:
+        pass
+
+    # The first packet of the session can not be replayed.
+    encoder = SecurePacketEncoder(AES_CTR(key), session=True)
+    decoder = SecurePacketDecoder(AES_CTR(key))
+    first_packet = b"".join(encoder.encode_parts(b"first"))
+    assert decoder.decode(first_packet)["payload"] == b"first"
+    assert decoder.decode(b"".join(encoder.encode_parts(b"next")))["payload"] == b"next"
+    try:
+        decoder.decode(first_packet)
+        assert False
+    except SecurePacketError:
+        pass
+
+    # A new session is accepted when the counter would overflow.
+    from hks_pynetwork.secure_packet import MAX_SESSION_COUNTER
+    encoder = SecurePacketEncoder(AES_CTR(key), session=True)
+    decoder = SecurePacketDecoder(AES_CTR(key))
+    assert decoder.decode(b"".join(encoder.encode_parts(b"a")))["payload"] == b"a"
+    encoder._keystream.counter = decoder._keystream.counter = MAX_SESSION_COUNTER - 1
+    packet = b"".join(encoder.encode_parts(b"b" * 100))
+    assert decoder.decode(packet)["payload"] == b"b" * 100
+    assert decoder.decode(b"".join(encoder.encode_parts(b"c")))["payload"] == b"c"
+
+    # The large payloads of a session can be processed in parallel.
+    with ParallelCrypter(max_workers=2, chunk_size=1024, threshold=4096) as crypter:
+        encoder = SecurePacketEncoder(AES_CTR(key), crypter=crypter, session=True)
+        decoder = SecurePacketDecoder(AES_CTR(key))
+        for size in (10, 5000, 10, 9999):
+            payload = os.urandom(size)
+            assert decoder.decode(b"".join(encoder.encode_parts(payload)))["payload"] == payload
@@ -0,0 +1,194 @@
+import os
+import random
+
+from hks_pylib.cryptography.ciphers.symmetrics import AES_CTR
+from hks_pylib.logger import StandardLoggerGenerator
+
+from hks_pynetwork.packet import PacketEncoder, PacketDecoder
+from hks_pynetwork.packet_buffer import PacketBuffer
+from hks_pynetwork.secure_packet import SecurePacketEncoder, SecurePacketDecoder
+from hks_pynetwork.secure_packet import FLAG_BATCH, pack_batch
+from hks_pynetwork.errors.packet import BufferSizeError
+
+
+logger_generator = StandardLoggerGenerator("tests/test_packet_buffer.log")
+KEY = os.urandom(32)
+
+
+def split(data, max_chunk_size):
+    chunks = []
+    while data:
+        size = random.randint(1, max_chunk_size)
+        chunks.append(data[:size])
+        data = data[size:]
+    return chunks
+
+
+def test_packet_buffer_reassembly():
+    encoder = PacketEncoder()
+    buffer = PacketBuffer(PacketDecoder(), "Buffer", logger_generator, capacity=64)
+
+    payloads = [os.urandom(random.randint(1, 1000)) for _ in range(50)]
+    stream = b"".join(encoder.encode(payload) for payload in payloads)
+
+    received = []
+    for chunk in split(stream, 300):
+        buffer.push(chunk)
+        while True:
+            data = buffer.pop()
+            if not data:
+                break
+            received.append(data)
+
+    assert received == payloads
+    assert len(buffer) == 0
+
+
+def test_packet_buffer_large_secure_packet():
+    encoder = SecurePacketEncoder(AES_CTR(KEY))
+    buffer = PacketBuffer(SecurePacketDecoder(AES_CTR(KEY)), "Buffer", logger_generator)
+
+    encoder.cipher.reset()
+    payload = os.urandom(10**6)
+    packet = encoder.encode(payload)
+
+    for i in range(0, len(packet), 4096):
+        assert buffer.pop() == b""
+        buffer.push(packet[i: i + 4096])
+
+    assert buffer.pop() == payload
+    assert buffer.pop() == b""
+
+
+class FailingDecoder(PacketDecoder):
+    "A decoder which fails to decode the payload b'fail'."
+    def decode(self, packet):
+        packet_dict = super().decode(packet)
+        if bytes(packet_dict["payload"]) == b"fail":
+            raise ValueError("Failed packet.")
+
+        return packet_dict
+
+
+def test_packet_buffer_pop_many():
+    encoder = PacketEncoder()
+    buffer = PacketBuffer(PacketDecoder(), "Buffer", logger_generator)
+
+    payloads = [os.urandom(100) for _ in range(20)]
+    buffer.push(b"".join(encoder.encode(payload) for payload in payloads))
+
+    assert buffer.pop_many(max_count=5) == payloads[:5]
+    assert buffer.pop_many(max_bytes=250) == payloads[5:7]
+    assert buffer.pop_many(max_bytes=1) == payloads[7:8]
+    assert buffer.pop_many() == payloads[8:]
+    assert buffer.pop_many() == []
+
+    # The payloads popped before an error are returned, the error is
+    # raised by the next call.
+    buffer = PacketBuffer(FailingDecoder(), "Buffer", logger_generator)
+    buffer.push(b"".join(encoder.encode(payload) for payload in (b"1", b"fail", b"2")))
+    assert buffer.pop_many() == [b"1"]
+    assert buffer.has_packet()
+    try:
+        buffer.pop_many()
+        assert False
+    except ValueError:
+        pass
+    assert buffer.pop_many() == [b"2"]
+
+
+def test_packet_buffer_isfull():
+    encoder = PacketEncoder()
+    buffer = PacketBuffer(PacketDecoder(), "Buffer", logger_generator, max_bytes=250)
+
+    packet = encoder.encode(os.urandom(100))
+    buffer.push(packet * 2)
+    assert not buffer.isfull()
+
+    # The limit is reached, but the third packet can not be popped yet.
+    large_packet = encoder.encode(os.urandom(1000))
+    buffer.pop_many()
+    buffer.push(large_packet[:500])
+    assert not buffer.isfull()
+
+    buffer.push(large_packet[500:])
+    assert buffer.isfull()
+
+    buffer.pop()
+    assert not buffer.isfull()
+
+
+def test_packet_buffer_batch():
+    encoder = SecurePacketEncoder(AES_CTR(KEY))
+    buffer = PacketBuffer(SecurePacketDecoder(AES_CTR(KEY)), "Buffer", logger_generator)
+
+    messages = [os.urandom(random.randint(0, 100)) for _ in range(10)]
+    for flags, payload in ((FLAG_BATCH, pack_batch(messages[:4])),
+                           (0, messages[4]),
+                           (FLAG_BATCH, pack_batch(messages[5:]))):
+        encoder.cipher.reset()
+        buffer.push(b"".join(encoder.encode_parts(payload, flags)))
+
+    assert buffer.pop() == messages[0]
+    assert buffer.pop_many(max_count=4) == messages[1:5]
+    assert buffer.pop_many() == messages[5:]
+    assert not buffer.has_packet()
+
+
+def test_packet_buffer_reserve_commit():
+    encoder = PacketEncoder()
+    buffer = PacketBuffer(PacketDecoder(), "Buffer", logger_generator, capacity=64)
+
+    payloads = [os.urandom(random.randint(1, 1000)) for _ in range(50)]
+    stream = b"".join(encoder.encode(payload) for payload in payloads)
+
+    received = []
+    for chunk in split(stream, 300):
+        view = buffer.reserve(300)
+        assert len(view) >= 300
+        view[:len(chunk)] = chunk
+        buffer.commit(len(chunk))
+        received.extend(buffer.pop_many())
+
+    assert received == payloads
+    assert len(buffer) == 0
+
+    buffer.reserve(10)
+    try:
+        buffer.commit(len(buffer.reserve(10)) + 1)
+        assert False
+    except Exception:
+        pass
+
+
+def test_packet_buffer_pop_into():
+    encoder = SecurePacketEncoder(AES_CTR(KEY))
+    buffer = PacketBuffer(SecurePacketDecoder(AES_CTR(KEY)), "Buffer", logger_generator)
+
+    messages = [os.urandom(random.randint(1, 100)) for _ in range(10)]
+    for payload in (pack_batch(messages[:5]), messages[5], pack_batch(messages[6:])):
+        encoder.cipher.reset()
+        buffer.push(b"".join(encoder.encode_parts(payload, FLAG_BATCH
+            if payload is not messages[5] else 0)))
+
+    received = []
+    memory = bytearray(100)
+    for message in messages:
+        # The message is kept if the buffer is too small.
+        if len(message) > 1:
+            try:
+                buffer.pop_into(memoryview(memory)[:1])
+                assert False
+            except BufferSizeError:
+                pass
+
+        size = buffer.pop_into(memory)
+        received.append(bytes(memory[:size]))
+
+    assert received == messages
+    assert buffer.pop_into(memory) == 0
+
+    plain_buffer = PacketBuffer(PacketDecoder(), "Buffer", logger_generator)
+    plain_buffer.push(PacketEncoder().encode(b"plain"))
+    assert plain_buffer.pop_into(memory) == 5
+    assert memory[:5] == b"plain"
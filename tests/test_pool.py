@@ -0,0 +1,137 @@
+import os
+import time
+import threading
+
+from hks_pylib.logger import StandardLoggerGenerator
+from hks_pylib.cryptography.ciphers.symmetrics import AES_CTR
+
+from hks_pynetwork.external import STCPServer
+from hks_pynetwork.pool import STCPSocketPool
+from hks_pynetwork.errors.pool import PoolTimeoutError
+
+
+logger_generator = StandardLoggerGenerator("tests/test_pool.log")
+KEY = os.urandom(32)
+
+
+def echo_server():
+    server = STCPServer(AES_CTR(KEY), "Server", 1024,
+        on_message=lambda connection, data: connection.send(data),
+        logger_generator=logger_generator)
+    server.bind(("127.0.0.1", 0))
+    server.listen()
+    threading.Thread(target=server.serve_forever).start()
+    return server
+
+
+def test_pool_reuse():
+    server = echo_server()
+    address = server.getsockname()
+
+    with STCPSocketPool(AES_CTR(KEY), "Pool", 1024, logger_generator, max_size=2) as pool:
+        with pool.connection(address) as socket:
+            socket.send(b"first")
+            assert socket.recv() == b"first"
+            first_socket = socket
+
+        # The warm connection is reused.
+        with pool.connection(address) as socket:
+            assert socket is first_socket
+            socket.send(b"second")
+            assert socket.recv() == b"second"
+
+        # A connection is discarded if the with block fails.
+        try:
+            with pool.connection(address) as socket:
+                raise ValueError()
+        except ValueError:
+            pass
+        assert pool.size(address) == 0
+
+        sockets = [pool.acquire(address) for _ in range(2)]
+        try:
+            pool.acquire(address, timeout=0.1)
+            assert False
+        except PoolTimeoutError:
+            pass
+
+        # A waiting client gets the released socket.
+        threading.Timer(0.1, pool.release, args=(sockets[0],)).start()
+        assert pool.acquire(address, timeout=5) is sockets[0]
+        pool.release(sockets[0])
+
+        # A socket closed by the remote party is not reused.
+        sockets[1].close()
+        pool.release(sockets[1])
+        assert pool.size(address) == 1
+
+        # A different key has its own pool.
+        with pool.connection(address, AES_CTR(os.urandom(32))) as socket:
+            assert socket is not sockets[0]
+            assert pool.size(address) == 1
+
+    server.shutdown()
+
+
+def test_pool_min_size_and_eviction():
+    server = echo_server()
+    address = server.getsockname()
+
+    pool = STCPSocketPool(AES_CTR(KEY), "Pool", 1024, logger_generator,
+        min_size=2, max_size=4, idle_timeout=0.1)
+
+    sockets = [pool.acquire(address) for _ in range(4)]
+    assert pool.size(address) == 4
+    for socket in sockets:
+        socket.send(b"ping")
+        assert socket.recv() == b"ping"
+        pool.release(socket)
+
+    time.sleep(0.2)
+    pool.evict()
+    assert pool.size(address) == 2
+
+    pool.close()
+    assert pool.size(address) == 0
+    server.shutdown()
+
+
+class ReleasingPool(STCPSocketPool):
+    "A pool which releases a socket while it opens a new one."
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.released = None
+
+    def _open(self, address, cipher):
+        if self.released is not None:
+            self.release(self.released)
+            self.released = None
+            time.sleep(0.01)
+
+        return super()._open(address, cipher)
+
+
+def test_pool_idle_order():
+    server = echo_server()
+    address = server.getsockname()
+
+    pool = ReleasingPool(AES_CTR(KEY), "Pool", 1024, logger_generator,
+        min_size=3, max_size=8, idle_timeout=60)
+
+    sockets = [pool.acquire(address) for _ in range(3)]
+    for socket in sockets[1:]:
+        pool.release(socket, discard=True)
+
+    # The spare socket of the new ones is more recent than the socket
+    # released while they are opened.
+    pool.released = sockets[0]
+    new_socket = pool.acquire(address)
+    try:
+        slot = next(iter(pool._slots.values()))
+        times = [released for _, released in slot.idle]
+        assert len(times) == 2 and times == sorted(times)
+        assert slot.idle[0][0] is sockets[0]
+    finally:
+        pool.release(new_socket)
+        pool.close()
+        server.shutdown()
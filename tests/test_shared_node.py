@@ -0,0 +1,120 @@
+import os
+import random
+import threading
+import multiprocessing
+
+from hks_pylib.logger import StandardLoggerGenerator
+
+from hks_pynetwork.shared_node import SharedMemoryNode
+from hks_pynetwork.errors.internal import ChannelSlotError, ChannelTimeoutError
+
+
+logger_generator = StandardLoggerGenerator("tests/test_shared_node.log")
+
+
+def echo(name, n_messages):
+    node = SharedMemoryNode(name, logger_generator)
+    for _ in range(n_messages):
+        source, message, _ = node.recv()
+        node.send(source, message)
+    node.close()
+
+
+def test_shared_node():
+    node1 = SharedMemoryNode("SHM_NODE1", logger_generator)
+    node2 = SharedMemoryNode("SHM_NODE2", logger_generator)
+    node3 = SharedMemoryNode(logger_generator=logger_generator)
+
+    node1.send("SHM_NODE2", b"from node1")
+    node3.send("SHM_NODE2", b"from node3")
+    assert node2.recv(node3.name) == (node3.name, b"from node3", None)
+    assert node2.recv() == ("SHM_NODE1", b"from node1", None)
+
+    try:
+        node2.recv(timeout=0.1)
+        assert False
+    except ChannelTimeoutError:
+        pass
+
+    # Waiting for a source times out even if other messages are buffered.
+    node1.send("SHM_NODE2", b"from node1 again")
+    try:
+        node2.recv(node3.name, timeout=0.2)
+        assert False
+    except ChannelTimeoutError:
+        pass
+    assert node2.recv() == ("SHM_NODE1", b"from node1 again", None)
+
+    try:
+        node1.send("SHM_UNKNOWN", b"lost")
+        assert False
+    except ChannelSlotError:
+        pass
+
+    for node in (node1, node2, node3):
+        node.close()
+
+
+def test_shared_node_invalid_notifications():
+    node = SharedMemoryNode("SHM_VICTIM", logger_generator)
+    assert os.stat(SharedMemoryNode.DIRECTORY).st_mode & 0o777 == 0o700
+
+    fifo = os.open(SharedMemoryNode._fifo_path("SHM_VICTIM"), os.O_WRONLY)
+    os.write(fifo, b"\xff\xfe\n../etc/passwd\nhkspn_0000000000000000\n")
+    os.close(fifo)
+
+    try:
+        node.recv(timeout=0.1)
+        assert False
+    except ChannelTimeoutError:
+        pass
+
+    sender = SharedMemoryNode("SHM_SENDER", logger_generator)
+    sender.send("SHM_VICTIM", b"valid")
+    assert node.recv(timeout=5) == ("SHM_SENDER", b"valid", None)
+
+    sender.close()
+    node.close()
+
+
+def test_shared_node_full_ring():
+    sender = SharedMemoryNode("SHM_SENDER", logger_generator, ring_size=1000)
+    receiver = SharedMemoryNode("SHM_RECEIVER", logger_generator)
+
+    # The ring wraps around many times and the sender waits when it is full.
+    messages = [os.urandom(random.randint(0, 300)) for _ in range(1000)]
+    producer = threading.Thread(
+        target=lambda: [sender.send("SHM_RECEIVER", m) for m in messages])
+    producer.start()
+    for message in messages:
+        assert receiver.recv() == ("SHM_SENDER", message, None)
+    producer.join()
+
+    sender.close()
+    receiver.close()
+
+
+def test_shared_node_processes():
+    remote = multiprocessing.get_context("spawn").Process(target=echo, args=("SHM_ECHO", 100))
+    remote.start()
+
+    node = SharedMemoryNode("SHM_CLIENT", logger_generator)
+    while True:
+        try:
+            node.send("SHM_ECHO", b"first")
+            break
+        except ChannelSlotError:  # The remote node is not created yet.
+            remote.join(0.01)
+
+    messages = [b"first"] + [os.urandom(random.randint(1, 1000)) for _ in range(99)]
+    for message in messages[1:]:
+        node.send("SHM_ECHO", message)
+
+    for message in messages:
+        assert node.recv("SHM_ECHO") == ("SHM_ECHO", message, None)
+
+    remote.join(10)
+    assert remote.exitcode == 0
+    node.close()
+    if os.path.isdir("/dev/shm"):
+        assert not any(name.startswith("hkspn_") for name in os.listdir("/dev/shm"))
@@ -0,0 +1,98 @@
+import os
+import socket
+import threading
+
+from hks_pylib.logger import StandardLoggerGenerator
+from hks_pylib.cryptography.ciphers.symmetrics import AES_CTR
+
+from hks_pynetwork.external import STCPSocket, STCPServer
+from hks_pynetwork.tuning import AdaptiveReadSize, TuningProfile, get_profile, register_profile
+from hks_pynetwork.errors.tuning import UnknownProfileError
+
+
+logger_generator = StandardLoggerGenerator("tests/test_tuning.log")
+KEY = os.urandom(32)
+
+
+def test_adaptive_read_size():
+    read_size = AdaptiveReadSize(100, 1024, 2**16)
+    assert read_size.size == 1024
+
+    # The reads which fill the whole size double it.
+    for expected in (2048, 4096, 8192):
+        read_size.update(read_size.size)
+        assert read_size.size == expected
+
+    # Then it follows the small messages back to the minimum.
+    for _ in range(50):
+        read_size.update(100)
+    assert read_size.size == 1024
+
+    for _ in range(50):
+        read_size.update(read_size.size)
+    assert read_size.size == 2**16
+
+
+def test_tuning_profile():
+    assert get_profile("low-latency").nodelay
+    assert get_profile("bulk-throughput").rcvbuf > 0
+
+    try:
+        get_profile("unknown")
+        assert False
+    except UnknownProfileError:
+        pass
+
+    register_profile(TuningProfile("test", sndbuf=2**16, nodelay=True, keepalive=True))
+    profile = get_profile("test")
+    assert profile.read_size(1024) is None
+
+    with socket.socket() as sock:
+        profile.apply(sock)
+        assert sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY)
+        assert sock.getsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE)
+        assert sock.getsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF) >= 2**16
+
+
+def test_profile_sockets():
+    server = STCPServer(AES_CTR(KEY), "Server", 1024,
+        logger_generator=logger_generator, profile="low-latency")
+    server.bind(("127.0.0.1", 0))
+    server.listen()
+    t = threading.Thread(target=server.serve_forever)
+    t.start()
+
+    client = STCPSocket(AES_CTR(KEY), "Client", 1024, logger_generator, profile="low-latency")
+    client.connect(server.getsockname())
+    assert client._socket.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY)
+
+    messages = [os.urandom(size) for size in (10, 1000, 100000, 10)]
+    for message in messages:
+        client.send(message)
+        connection, received = server.recv(timeout=5)
+        assert received == message
+        assert connection._socket.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY)
+
+        connection.send(message)
+        assert client.recv() == message
+
+    client.close()
+    server.shutdown()
+    t.join()
+
+    listener = STCPSocket(AES_CTR(KEY), "Server", 1024, logger_generator, profile="bulk-throughput")
+    listener.bind(("127.0.0.1", 0))
+    listener.listen()
+
+    client = STCPSocket(AES_CTR(KEY), "Client", 1024, logger_generator, profile="bulk-throughput")
+    client.connect(listener._socket.getsockname())
+    accepted, _ = listener.accept()
+    assert accepted._socket.getsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE)
+
+    message = os.urandom(2**20)
+    client.send(message)
+    assert accepted.recv() == message
+
+    client.close()
+    accepted.close()
+    listener.close()